@@ -0,0 +1,297 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count
+
+from reviews import sharding
+from reviews.models import Category, Genre, Review, Title, User
+from . import reference
+
+REBUILD_SECONDS = getattr(settings, 'AUTOCOMPLETE_REBUILD_SECONDS', 300)
+BACKGROUND = getattr(settings, 'AUTOCOMPLETE_BACKGROUND', True)
+TOP_SIZE = getattr(settings, 'AUTOCOMPLETE_MAX_LIMIT', 50)
+TOP_PREFIX_LENGTH = 3
+VERSION_KEY = 'autocomplete:{}:version'
+KEY_END = '\U0010ffff'
+
+
+def normalize(value):
+    """Приводит строку к виду для сравнения без учёта регистра."""
+    return value.casefold().replace('ё', 'е')
+
+
+def invalidate(name):
+    """Просит все процессы перестроить индекс name."""
+    cache.set(VERSION_KEY.format(name), time.time_ns(), timeout=None)
+
+
+class PrefixIndex:
+    """Отсортированный индекс строк для поиска по префиксу.
+
+    Ключи хранятся в отсортированном списке, поэтому диапазон совпадений
+    находится двоичным поиском, а из него выбираются самые популярные.
+    Для коротких префиксов диапазон велик, поэтому их TOP_SIZE лучших
+    записей хранятся готовыми и поправляются при изменениях.
+
+    Устаревший индекс перестраивается в фоне не более чем одним потоком;
+    до подмены поиск идёт по старому индексу. Изменения, пришедшие во
+    время перестроения, повторяются на новом индексе. Изменения из других
+    процессов видны по версии индекса в общем кэше.
+    """
+
+    def __init__(self, loader, name=None):
+        self._loader = loader
+        self._name = name
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+        self._top = {}
+        self._built = None
+        self._version = None
+        self._checked = float('-inf')
+        self._rebuilding = False
+        self._journal = None
+
+    def _shared_version(self):
+        if self._name is None:
+            return None
+        return reference.shared_version(VERSION_KEY.format(self._name))
+
+    def build(self):
+        """Полностью перестраивает индекс из базы данных."""
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        with self._lock:
+            self._journal = []
+        try:
+            # Версия читается до загрузки: изменение во время загрузки
+            # сменит её, и индекс перестроится ещё раз.
+            version = self._shared_version()
+            entries = {
+                pk: (normalize(label), popularity, payload)
+                for pk, label, popularity, payload in self._loader()
+            }
+            keys = sorted((key, pk) for pk, (key, _, _) in entries.items())
+            with self._lock:
+                self._entries = entries
+                self._keys = keys
+                self._top = {}
+                for change, args in self._journal:
+                    change(*args)
+                self._built = self._checked = time.monotonic()
+                self._version = version
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def _rebuild_in_thread(self):
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+            connections.close_all()
+
+    def _stale(self):
+        now = time.monotonic()
+        if now - self._built > REBUILD_SECONDS:
+            return True
+        if self._name is None or now - self._checked < reference.CHECK_SECONDS:
+            return False
+        self._checked = now
+        return self._shared_version() != self._version
+
+    def _ensure_built(self):
+        if self._built is None:
+            # Старого индекса ещё нет: первый запрос строит его,
+            # остальные ждут на _build_lock и не строят повторно.
+            with self._build_lock:
+                if self._built is None:
+                    self._build()
+            return
+        if not self._stale():
+            return
+        if not BACKGROUND:
+            self.build()
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        _executor.submit(self._rebuild_in_thread)
+
+    def _rank(self, pk):
+        key, popularity, _ = self._entries[pk]
+        return -popularity, key, pk
+
+    def _collect(self, prefix, limit):
+        low = bisect_left(self._keys, (prefix,))
+        high = bisect_left(self._keys, (prefix + KEY_END,), low)
+        return heapq.nsmallest(
+            limit, (self._rank(pk) for _, pk in self._keys[low:high])
+        )
+
+    def _retop(self, pk, old_key):
+        """Поправляет готовые списки префиксов старого и нового ключа."""
+        entry = self._entries.get(pk)
+        new_key = entry[0] if entry else ''
+        prefixes = {
+            key[:length] for key in (old_key, new_key)
+            for length in range(1, min(len(key), TOP_PREFIX_LENGTH) + 1)
+        }
+        for prefix in prefixes:
+            top = self._top.get(prefix)
+            if top is None:
+                continue
+            full = len(top) >= TOP_SIZE
+            was_member = any(rank[2] == pk for rank in top)
+            if was_member:
+                top[:] = [rank for rank in top if rank[2] != pk]
+            if entry is not None and new_key.startswith(prefix):
+                insort(top, self._rank(pk))
+                del top[TOP_SIZE:]
+            # Неполный список содержит все совпадения и точен. Из полного
+            # запись могла уйти или опуститься в конец, а её место занял
+            # бы кто-то за пределами списка: такой список считается заново.
+            if full and was_member and (
+                len(top) < TOP_SIZE or top[-1][2] == pk
+            ):
+                del self._top[prefix]
+
+    def _discard(self, pk):
+        entry = self._entries.pop(pk, None)
+        if entry is not None:
+            position = bisect_left(self._keys, (entry[0], pk))
+            del self._keys[position]
+        return entry
+
+    def _remove(self, pk):
+        entry = self._discard(pk)
+        if entry is not None:
+            self._retop(pk, entry[0])
+
+    def _change(self, change, *args):
+        # До первого построения менять нечего: индекс загрузится целиком.
+        with self._lock:
+            if self._built is None and self._journal is None:
+                return
+            if self._journal is not None:
+                self._journal.append((change, args))
+            change(*args)
+
+    def _update(self, pk, label, payload):
+        entry = self._discard(pk)
+        popularity = entry[1] if entry else 0
+        key = normalize(label)
+        self._entries[pk] = (key, popularity, payload)
+        insort(self._keys, (key, pk))
+        self._retop(pk, entry[0] if entry else '')
+
+    def update(self, pk, label, payload):
+        """Добавляет или переименовывает запись."""
+        self._change(self._update, pk, label, payload)
+
+    def remove(self, pk):
+        """Удаляет запись из индекса."""
+        self._change(self._remove, pk)
+
+    def bump(self, pk, delta):
+        """Меняет популярность записи без сброса ранжирования.
+
+        Во время перестроения не запоминается: загрузчик мог уже учесть
+        это изменение, а популярность уточнит следующее перестроение.
+        """
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is not None:
+                key, popularity, payload = entry
+                self._entries[pk] = (key, popularity + delta, payload)
+                self._retop(pk, key)
+
+    def search(self, prefix, limit):
+        """Возвращает самые популярные записи с заданным префиксом."""
+        self._ensure_built()
+        prefix = normalize(prefix)
+        with self._lock:
+            if len(prefix) <= TOP_PREFIX_LENGTH and limit <= TOP_SIZE:
+                top = self._top.get(prefix)
+                if top is None:
+                    top = self._top[prefix] = self._collect(prefix, TOP_SIZE)
+                found = top[:limit]
+            else:
+                found = self._collect(prefix, limit)
+            return [self._entries[pk][2] for _, _, pk in found]
+
+
+def _load_titles():
+    titles = Title.objects.filter(is_deleted=False).values_list(
+        'id', 'name', 'rating_count'
+    )
+    for pk, name, popularity in titles.order_by():
+        yield pk, name, popularity, {'id': pk, 'name': name}
+
+
+def _load_slugged(queryset):
+    def loader():
+        rows = queryset.annotate(
+            popularity=Count('titles')
+        ).values_list('id', 'name', 'slug', 'popularity')
+        for pk, name, slug, popularity in rows.order_by():
+            yield pk, name, popularity, {'name': name, 'slug': slug}
+    return loader
+
+
+def _load_users():
+    popularity = Counter()
+    for alias in sharding.SHARDS:
+        popularity.update(dict(
+            Review.objects.using(alias).values('author_id').annotate(
+                count=Count('pk')
+            ).values_list('author_id', 'count').order_by()
+        ))
+    users = User.objects.filter(
+        is_deleted=False, username__isnull=False
+    ).values_list('id', 'username')
+    for pk, username in users.order_by():
+        yield pk, username, popularity[pk], {'username': username}
+
+
+INDEXES = {
+    'titles': PrefixIndex(_load_titles, 'titles'),
+    'genres': PrefixIndex(_load_slugged(Genre.objects.all()), 'genres'),
+    'categories': PrefixIndex(
+        _load_slugged(Category.objects.filter(is_deleted=False)),
+        'categories',
+    ),
+    'users': PrefixIndex(_load_users, 'users'),
+}
+
+PUBLIC_INDEXES = ('titles', 'genres', 'categories')
+
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def title_payload(title):
+    return title.name, {'id': title.pk, 'name': title.name}
+
+
+def slugged_payload(obj):
+    return obj.name, {'name': obj.name, 'slug': obj.slug}
+
+
+def user_payload(user):
+    return user.username, {'username': user.username}
+
+
+def search(prefix, kinds, limit):
+    """Ищет записи по префиксу в нескольких индексах."""
+    return {kind: INDEXES[kind].search(prefix, limit) for kind in kinds}
@@ -0,0 +1,94 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.viewsets import ViewSetMixin
+
+MAX_REQUESTS = getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+WORKERS = getattr(settings, 'BATCH_WORKERS', 4)
+PREFIX = '/api/v1/'
+
+logger = logging.getLogger(__name__)
+
+
+def absolute(path):
+    """Путь относительно /api/v1/ превращает в полный."""
+    return path if path.startswith('/') else PREFIX + path
+
+
+def _error(path, code, detail):
+    return {'path': path, 'status': code, 'body': {'detail': detail}}
+
+
+class Batch:
+    """Выполняет GET-запросы к вьюсетам API внутри одного запроса.
+
+    Подзапросы не проходят middleware и аутентификацию заново: им
+    передаётся пользователь и токен исходного запроса. Анонимные
+    подзапросы идут как есть, чтобы отказы совпадали с обычными.
+    """
+
+    def __init__(self, request):
+        self.user = request.user
+        self.auth = request.auth
+        self.factory = RequestFactory(**{
+            'HTTP_HOST': request.get_host(),
+            'HTTP_ACCEPT': 'application/json',
+            'wsgi.url_scheme': request.scheme,
+        })
+
+    def get(self, path):
+        path = absolute(path)
+        request = self.factory.get(path)
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return _error(path, status.HTTP_404_NOT_FOUND, 'Не найдено.')
+        view_class = getattr(match.func, 'cls', None)
+        if (not request.path_info.startswith(PREFIX)
+                or view_class is None
+                or not issubclass(view_class, ViewSetMixin)):
+            return _error(path, status.HTTP_400_BAD_REQUEST,
+                          'Пакетный запрос поддерживает только вьюсеты API.')
+        if self.user.is_authenticated:
+            request._force_auth_user = self.user
+            request._force_auth_token = self.auth
+        try:
+            response = match.func(request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception('Ошибка подзапроса %s', path)
+            return _error(path, status.HTTP_500_INTERNAL_SERVER_ERROR,
+                          'Ошибка сервера.')
+        return {'path': path, 'status': response.status_code,
+                'body': getattr(response, 'data', None)}
+
+    def get_many(self, paths):
+        """Выполняет подзапросы последовательно в текущем потоке."""
+        return [self.get(path) for path in paths]
+
+    def _run_group(self, paths):
+        try:
+            return self.get_many(paths)
+        finally:
+            connections.close_all()
+
+    def run(self, paths, parallel=False):
+        """Возвращает ответы в порядке путей.
+
+        При parallel пути делятся между WORKERS потоками; у каждого
+        потока своё соединение с базой, которое закрывается в конце.
+        """
+        workers = min(WORKERS, len(paths))
+        if not parallel or workers < 2:
+            return self.get_many(paths)
+        groups = [paths[number::workers] for number in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self._run_group, groups))
+        responses = [None] * len(paths)
+        for number, group in enumerate(results):
+            responses[number::workers] = group
+        return responses
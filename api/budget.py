@@ -0,0 +1,133 @@
+import logging
+import math
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+BUDGETS = getattr(settings, 'QUERY_BUDGETS', {})
+PROGRESS_STEPS = getattr(settings, 'QUERY_BUDGET_PROGRESS_STEPS', 1000)
+METRIC_KEY = 'metrics:query_budget:{}'
+POSTGRES_CANCELED = '57014'
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = ('Запрос слишком долго выполнялся в базе данных. '
+                      'Сузьте условия отбора или повторите позже.')
+    default_code = 'query_budget_exceeded'
+
+
+def record(name):
+    """Увеличивает счётчик превышений бюджета в общем кэше."""
+    key = METRIC_KEY.format(name)
+    cache.set(key, cache.get(key, 0) + 1, timeout=None)
+
+
+def exceeded():
+    """Число превышений бюджета по маршрутам."""
+    return {
+        name: cache.get(METRIC_KEY.format(name), 0) for name in BUDGETS
+    }
+
+
+def _canceled(error):
+    cause = error.__cause__
+    return (getattr(cause, 'pgcode', None) == POSTGRES_CANCELED
+            or 'interrupted' in str(error))
+
+
+class Deadline:
+    """Обёртка SQL-запросов, которая считает время их выполнения.
+
+    Бюджет расходуется только временем внутри execute(); аутентификация
+    и Python-код представления в него не входят. Запрос, который не
+    укладывается в остаток бюджета, прерывается: в SQLite обработчиком
+    прогресса, в PostgreSQL — statement_timeout, равным остатку.
+    """
+
+    def __init__(self, name, seconds):
+        self.name = name
+        self.seconds = seconds
+        self.spent = 0.0
+        self.breached = False
+        self.query_deadline = None
+        self.timeouts = set()
+
+    def remaining(self):
+        return self.seconds - self.spent
+
+    def expired(self):
+        return time.monotonic() >= self.query_deadline
+
+    def exceed(self, sql):
+        self.breached = True
+        logger.warning('Превышен бюджет запросов %s: %s', self.name, sql)
+        return QueryBudgetExceeded()
+
+    def __call__(self, execute, sql, params, many, context):
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise self.exceed(sql)
+        connection = context['connection']
+        raw = connection.connection
+        if connection.vendor == 'postgresql':
+            context['cursor'].cursor.execute(
+                'SET statement_timeout = %s', [math.ceil(remaining * 1000)]
+            )
+            self.timeouts.add(connection.alias)
+        started = time.monotonic()
+        self.query_deadline = started + remaining
+        if connection.vendor == 'sqlite':
+            raw.set_progress_handler(self.expired, PROGRESS_STEPS)
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            # Прерывает запрос только эта обёртка, а таймаут PostgreSQL
+            # может сработать чуть раньше срока по часам процесса.
+            if _canceled(error):
+                raise self.exceed(sql) from error
+            raise
+        finally:
+            self.spent += time.monotonic() - started
+            if connection.vendor == 'sqlite':
+                raw.set_progress_handler(None, 0)
+
+    def reset(self):
+        for alias in self.timeouts:
+            connection = connections[alias]
+            if connection.connection is not None:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET statement_timeout')
+
+
+@contextmanager
+def limit(name):
+    """Ограничивает суммарное время SQL-запросов бюджетом маршрута.
+
+    Бюджет берётся из QUERY_BUDGETS[name] в секундах; без настройки
+    запросы не ограничиваются. Превышение записывается в общий кэш
+    после снятия обёрток, чтобы запрос к кэшу не попал в бюджет.
+    """
+    seconds = BUDGETS.get(name)
+    if not seconds:
+        yield None
+        return
+    deadline = Deadline(name, seconds)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(deadline)
+                )
+            yield deadline
+    finally:
+        deadline.reset()
+        if deadline.breached:
+            record(name)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+import uuid
+from collections import OrderedDict, defaultdict, deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+HISTORY = getattr(settings, 'EVENTS_HISTORY', 100)
+QUEUE_SIZE = getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+CHANNELS = getattr(settings, 'EVENTS_HISTORY_CHANNELS', 10000)
+
+RESET = 'reset'
+
+
+def title_channel(title_id):
+    return f'title:{title_id}'
+
+
+class Subscription:
+    """Подписка одного соединения на канал.
+
+    Сообщения доставляются в очередь цикла событий соединения. При
+    переполнении очереди подписка помечается отставшей и клиент получает
+    событие reset.
+    """
+
+    def __init__(self, broker, channel, loop, size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size)
+        self.lagging = False
+
+    def deliver(self, message):
+        """Передаёт сообщение из любого потока."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            self.broker.unsubscribe(self)
+
+    def _put(self, message):
+        if self.lagging:
+            return
+        if self.queue.full():
+            self.lagging = True
+            self.queue.get_nowait()
+            self.queue.put_nowait((None, RESET, {}))
+            return
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    """Интерфейс брокера событий."""
+
+    def publish(self, channel, event, data):
+        raise NotImplementedError
+
+    def subscribe(self, channel, loop, last_id=None):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """Брокер событий внутри одного процесса.
+
+    Хранит последние HISTORY сообщений каждого канала для продолжения
+    потока по Last-Event-ID. Идентификатор события состоит из метки
+    процесса и номера в канале, поэтому после перезапуска или при
+    разрыве в истории клиент получает reset.
+    """
+
+    def __init__(self, history=HISTORY, queue_size=QUEUE_SIZE,
+                 channels=CHANNELS):
+        self._lock = threading.Lock()
+        self._epoch = uuid.uuid4().hex[:8]
+        self._numbers = defaultdict(int)
+        self._subscribers = defaultdict(set)
+        self._history = OrderedDict()
+        self._history_size = history
+        self._channels = channels
+        self._queue_size = queue_size
+
+    def _remember(self, channel, entry):
+        history = self._history.get(channel)
+        if history is None:
+            history = self._history[channel] = deque(
+                maxlen=self._history_size
+            )
+            if len(self._history) > self._channels:
+                self._history.popitem(last=False)
+        else:
+            self._history.move_to_end(channel)
+        history.append(entry)
+
+    def _message(self, number, event, data):
+        return (f'{self._epoch}-{number}', event, data)
+
+    def _parse(self, last_id):
+        epoch, _, number = last_id.partition('-')
+        if epoch != self._epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def publish(self, channel, event, data):
+        with self._lock:
+            self._numbers[channel] += 1
+            number = self._numbers[channel]
+            self._remember(channel, (number, event, data))
+            subscribers = list(self._subscribers.get(channel, ()))
+        message = self._message(number, event, data)
+        for subscription in subscribers:
+            subscription.deliver(message)
+        return message[0]
+
+    def subscribe(self, channel, loop, last_id=None):
+        subscription = Subscription(self, channel, loop, self._queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+            history = list(self._history.get(channel, ()))
+            latest = self._numbers.get(channel, 0)
+        if last_id is None:
+            return subscription
+        last = self._parse(last_id)
+        oldest = history[0][0] if history else latest + 1
+        if last is None or last > latest or oldest > last + 1:
+            missed = [(None, RESET, {})]
+        else:
+            missed = [self._message(*entry) for entry in history
+                      if entry[0] > last]
+        for message in missed[-self._queue_size:]:
+            subscription.queue.put_nowait(message)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+_broker = None
+
+
+def get_broker():
+    """Возвращает брокер из настройки EVENTS_BROKER."""
+    global _broker
+    if _broker is None:
+        _broker = import_string(
+            getattr(settings, 'EVENTS_BROKER', 'api.events.InMemoryBroker')
+        )()
+    return _broker
+
+
+def encode(message):
+    """Кодирует сообщение в формат Server-Sent Events."""
+    event_id, event, data = message
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+    lines.append(f'data: {payload}')
+    return ('\n'.join(lines) + '\n\n').encode()
@@ -1,19 +1,20 @@
 from django_filters import rest_framework as filters
 
 from reviews.models import Title
+from . import reference
+
+
+def slugs_containing(cache, value):
+    """Возвращает id записей справочника, slug которых содержит value."""
+    value = value.lower()
+    return [obj.pk for obj in cache.visible() if value in obj.slug.lower()]
 
 
 class TitleFilter(filters.FilterSet):
     """Фильтр для тайтлов."""
 
-    category = filters.CharFilter(
-        field_name='category__slug',
-        lookup_expr='icontains'
-    )
-    genre = filters.CharFilter(
-        field_name='genre__slug',
-        lookup_expr='icontains'
-    )
+    category = filters.CharFilter(method='filter_category')
+    genre = filters.CharFilter(method='filter_genre')
     name = filters.CharFilter(
         field_name='name',
         lookup_expr='contains'
@@ -26,3 +27,13 @@ class TitleFilter(filters.FilterSet):
     class Meta:
         model = Title
         fields = '__all__'
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(
+            category_id__in=slugs_containing(reference.categories, value)
+        )
+
+    def filter_genre(self, queryset, name, value):
+        return queryset.filter(
+            genre__in=slugs_containing(reference.genres, value)
+        )
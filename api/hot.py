@@ -0,0 +1,275 @@
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from . import reference, snapshot
+
+TOP_SIZE = getattr(settings, 'HOT_TITLES', 100)
+MIN_HITS = getattr(settings, 'HOT_MIN_HITS', 5)
+WIDTH = getattr(settings, 'HOT_SKETCH_WIDTH', 2048)
+DEPTH = getattr(settings, 'HOT_SKETCH_DEPTH', 4)
+DECAY_SECONDS = getattr(settings, 'HOT_DECAY_SECONDS', 300)
+CACHE_TIMEOUT = getattr(settings, 'HOT_CACHE_TIMEOUT', 3600)
+BACKGROUND = getattr(settings, 'HOT_BACKGROUND', True)
+RENDER_HEADER = 'HTTP_X_HOT_RENDER'
+PAGES = {
+    'detail': '/api/v1/titles/{}/',
+    'reviews': '/api/v1/titles/{}/reviews/',
+}
+
+
+class CountMinSketch:
+    """Приблизительные счётчики в DEPTH строках по WIDTH ячеек.
+
+    Оценка никогда не меньше настоящего значения; память не зависит
+    от числа ключей.
+    """
+
+    def __init__(self, width=WIDTH, depth=DEPTH):
+        self.width = width
+        self.rows = [array('d', [0.0]) * width for _ in range(depth)]
+
+    def _cells(self, key):
+        for number, row in enumerate(self.rows):
+            yield row, hash((number, key)) % self.width
+
+    def add(self, key, count=1):
+        """Увеличивает счётчик ключа и возвращает его оценку."""
+        estimate = None
+        for row, cell in self._cells(key):
+            row[cell] += count
+            if estimate is None or row[cell] < estimate:
+                estimate = row[cell]
+        return estimate
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in self._cells(key))
+
+    def scale(self, factor):
+        for number, row in enumerate(self.rows):
+            self.rows[number] = array('d', (value * factor for value in row))
+
+
+class HotTracker:
+    """Самые запрашиваемые ключи с затуханием.
+
+    Раз в DECAY_SECONDS все счётчики делятся пополам, поэтому старые
+    всплески забываются. Верхние TOP_SIZE ключей хранятся отдельно
+    вместе с оценкой числа обращений.
+    """
+
+    def __init__(self, size=TOP_SIZE, min_hits=MIN_HITS,
+                 decay_seconds=DECAY_SECONDS):
+        self.size = size
+        self.min_hits = min_hits
+        self.decay_seconds = decay_seconds
+        self.sketch = CountMinSketch()
+        self.top = {}
+        self._lock = threading.Lock()
+        self._decayed = time.monotonic()
+
+    def _decay(self):
+        now = time.monotonic()
+        periods = int((now - self._decayed) // self.decay_seconds)
+        if periods:
+            factor = 0.5 ** periods
+            self.sketch.scale(factor)
+            self.top = {key: hits * factor for key, hits in self.top.items()
+                        if hits * factor >= 1}
+            self._decayed += periods * self.decay_seconds
+
+    def hit(self, key):
+        """Учитывает обращение; возвращает True, если ключ горячий."""
+        with self._lock:
+            self._decay()
+            hits = self.sketch.add(key)
+            if key in self.top or len(self.top) < self.size:
+                self.top[key] = hits
+            else:
+                coldest = min(self.top, key=self.top.get)
+                if hits <= self.top[coldest]:
+                    return False
+                del self.top[coldest]
+                self.top[key] = hits
+            return hits >= self.min_hits
+
+    def is_hot(self, key):
+        return self.top.get(key, 0) >= self.min_hits
+
+    def hot(self):
+        """Горячие ключи и оценки обращений, самые частые первыми."""
+        with self._lock:
+            self._decay()
+            items = list(self.top.items())
+        return sorted(
+            ((key, hits) for key, hits in items if hits >= self.min_hits),
+            key=lambda item: -item[1],
+        )
+
+
+tracker = HotTracker()
+_pending = set()
+_pending_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1)
+
+ALL_VERSION_KEY = 'hot:version'
+TITLE_VERSION_KEY = 'hot:version:{}'
+PAGE_KEY = 'hot:{}:{}'
+
+
+def _version_keys(title_id):
+    return [reference.VERSION_KEY, ALL_VERSION_KEY,
+            TITLE_VERSION_KEY.format(title_id)]
+
+
+def _version(values, title_id):
+    # Пропавший ключ, истёкший или вытесненный при переполнении кэша,
+    # нельзя считать прежним значением: тогда страница, отрисованная до
+    # изменения, снова выглядела бы актуальной.
+    keys = _version_keys(title_id)
+    if any(values.get(key) is None for key in keys):
+        return None
+    return tuple(values[key] for key in keys)
+
+
+def version(title_id):
+    """Версия страниц тайтла: справочников, всех тайтлов и самого тайтла.
+
+    Запись кэша с другой версией считается устаревшей, поэтому смена
+    любой части сбрасывает страницы во всех процессах сразу. Отсутствующие
+    ключи создаются с новой меткой времени.
+    """
+    keys = _version_keys(title_id)
+    values = cache.get_many(keys)
+    missing = [key for key in keys if values.get(key) is None]
+    for key in missing:
+        cache.add(key, time.time_ns(), timeout=None)
+    if missing:
+        values = cache.get_many(keys)
+    return _version(values, title_id)
+
+
+def _entry(kind, title_id, base_url):
+    """Запись страницы и признак её актуальности одним запросом к кэшу."""
+    key = PAGE_KEY.format(kind, title_id)
+    values = cache.get_many([key] + _version_keys(title_id))
+    entry = values.get(key)
+    current = _version(values, title_id)
+    fresh = (entry is not None and current is not None
+             and entry['base'] == base_url and entry['version'] == current)
+    return entry, fresh
+
+
+def cached(kind, title_id, base_url):
+    """Готовые данные страницы тайтла или None."""
+    entry, fresh = _entry(kind, title_id, base_url)
+    return entry['data'] if fresh else None
+
+
+def warm(title_id, base_url=None):
+    """Отрисовывает карточку и первую страницу отзывов тайтла в кэш.
+
+    Версия читается до отрисовки: если тайтл изменится во время неё,
+    записанные страницы сразу окажутся устаревшими. Без base_url
+    берётся адрес из уже закэшированной записи.
+    """
+    current = version(title_id)
+    factories = {}
+    for kind, url in PAGES.items():
+        key = PAGE_KEY.format(kind, title_id)
+        base = base_url
+        if base is None:
+            entry = cache.get(key)
+            base = entry['base'] if entry else snapshot.BASE_URL
+        if base not in factories:
+            factories[base] = snapshot.request_factory(base)
+        response = snapshot.render(
+            url.format(title_id), factories[base], **{RENDER_HEADER: '1'}
+        )
+        if response.status_code == 200:
+            cache.set(key, {'base': base, 'data': response.data,
+                            'version': current, 'rendered': time.time()},
+                      CACHE_TIMEOUT)
+        else:
+            cache.delete(key)
+
+
+def _warm_in_thread(title_id, base_url):
+    try:
+        warm(title_id, base_url)
+    finally:
+        with _pending_lock:
+            _pending.discard(title_id)
+        connections.close_all()
+
+
+def schedule(title_id, base_url=None):
+    """Ставит перерисовку страниц тайтла в фоновый поток.
+
+    Тайтл, который уже ждёт перерисовки, повторно не ставится.
+    """
+    if not BACKGROUND:
+        warm(title_id, base_url)
+        return
+    with _pending_lock:
+        if title_id in _pending:
+            return
+        _pending.add(title_id)
+    _executor.submit(_warm_in_thread, title_id, base_url)
+
+
+def track(title_id):
+    """Учитывает обращение к тайтлу; возвращает True для горячего."""
+    return tracker.hit(title_id)
+
+
+def page(kind, title_id, base_url):
+    """Страница горячего тайтла из кэша или None.
+
+    Отсутствующая или устаревшая страница, а также страница старше
+    половины CACHE_TIMEOUT ставится на перерисовку в фоне, чтобы запись
+    не успела истечь.
+    """
+    entry, fresh = _entry(kind, title_id, base_url)
+    if not fresh or time.time() - entry['rendered'] > CACHE_TIMEOUT / 2:
+        schedule(title_id, base_url)
+    return entry['data'] if fresh else None
+
+
+def refresh(title_id):
+    """Сбрасывает страницы тайтла после изменения во всех процессах.
+
+    Горячий тайтл этого процесса перерисовывается в фоне, остальные
+    процессы перерисуют его при следующем обращении.
+    """
+    cache.set(TITLE_VERSION_KEY.format(title_id), time.time_ns(),
+              timeout=None)
+    if tracker.is_hot(title_id):
+        schedule(title_id)
+
+
+def refresh_many(title_ids):
+    """Сбрасывает страницы нескольких тайтлов после записи пачкой.
+
+    Больше TOP_SIZE тайтлов сбрасываются вместе со всеми остальными:
+    одна запись в кэш вместо записи на каждый тайтл.
+    """
+    title_ids = set(title_ids)
+    if len(title_ids) > TOP_SIZE:
+        refresh_all()
+        return
+    for title_id in title_ids:
+        refresh(title_id)
+
+
+def refresh_all():
+    """Сбрасывает страницы всех тайтлов, например после смены справочников
+    или массовой модерации, и перерисовывает горячие тайтлы в фоне."""
+    cache.set(ALL_VERSION_KEY, time.time_ns(), timeout=None)
+    for title_id, _ in tracker.hot():
+        schedule(title_id)
@@ -30,3 +30,13 @@ class IsAdminAuthorModeratorOrReadOnly(permissions.BasePermission):
                 or request.user.is_moderator
                 or request.user.is_admin
                 or obj.author == request.user)
+
+
+class IsAdminOrModerator(permissions.BasePermission):
+    """Пермишен для админа или модератора."""
+
+    def has_permission(self, request, view):
+        return (request.user.is_authenticated
+                and (request.user.is_moderator
+                     or request.user.is_admin
+                     or request.user.is_superuser))
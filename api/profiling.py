@@ -0,0 +1,281 @@
+import itertools
+import json
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework.exceptions import AuthenticationFailed
+
+PROFILING_DIR = Path(getattr(settings, 'PROFILING_DIR', 'profiles'))
+SAMPLE_RATE = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+INTERVAL = getattr(settings, 'PROFILING_INTERVAL', 0.001)
+KEEP = getattr(settings, 'PROFILING_KEEP', 100)
+ALLOCATIONS = getattr(settings, 'PROFILING_ALLOCATIONS', 30)
+HEADER = 'HTTP_X_PROFILE'
+QUERY_FLAG = 'profile'
+
+ARTIFACTS = {
+    'speedscope': 'profile.speedscope.json',
+    'collapsed': 'profile.collapsed',
+    'allocations': 'allocations.json',
+    'sql': 'sql.json',
+}
+
+
+class Sampler(threading.Thread):
+    """Снимает стек потока запроса раз в interval секунд."""
+
+    def __init__(self, thread_id, interval=INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    (code.co_name, code.co_filename, code.co_firstlineno)
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class QueryLog:
+    """Запоминает SQL-запросы всех баз во время запроса.
+
+    Параметры запросов не сохраняются: в них бывают пароли, токены
+    и личные данные. Остаётся только их число.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': self.alias,
+                'sql': sql,
+                'params': len(params or ()),
+                'many': many,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+
+def frame_name(frame):
+    name, filename, line = frame
+    return f'{name} ({filename}:{line})'
+
+
+def collapsed(stacks):
+    """Стеки в формате collapsed: «a;b;c число»."""
+    return ''.join(
+        ';'.join(frame_name(frame) for frame in stack) + f' {count}\n'
+        for stack, count in stacks.most_common()
+    )
+
+
+def speedscope(stacks, name, interval):
+    """Стеки в формате sampled-профиля speedscope."""
+    frames = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        samples.append([
+            frames.setdefault(frame, len(frames)) for frame in stack
+        ])
+        weights.append(count * interval)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'api_yamdb',
+        'shared': {'frames': [
+            {'name': frame[0], 'file': frame[1], 'line': frame[2]}
+            for frame in frames
+        ]},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+def allocations(snapshot, limit=ALLOCATIONS):
+    statistics = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    )).statistics('lineno')
+    return [
+        {'file': stat.traceback[0].filename,
+         'line': stat.traceback[0].lineno,
+         'size': stat.size,
+         'count': stat.count}
+        for stat in statistics[:limit]
+    ]
+
+
+def _prune():
+    profiles = sorted(
+        (path for path in PROFILING_DIR.iterdir() if path.is_dir()),
+        key=lambda path: path.name,
+    )
+    for path in profiles[:-KEEP] if KEEP else ():
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def save(meta, stacks, snapshot, queries, interval=INTERVAL):
+    """Сохраняет артефакты профиля и возвращает его id."""
+    profile_id = '{}-{}'.format(
+        timezone.now().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8]
+    )
+    directory = PROFILING_DIR / profile_id
+    directory.mkdir(parents=True)
+    name = f'{meta["method"]} {meta["path"]}'
+    files = {
+        'speedscope': json.dumps(speedscope(stacks, name, interval)),
+        'collapsed': collapsed(stacks),
+        'allocations': json.dumps(
+            allocations(snapshot) if snapshot is not None else []
+        ),
+        'sql': json.dumps(queries),
+    }
+    for kind, content in files.items():
+        (directory / ARTIFACTS[kind]).write_text(content, encoding='utf-8')
+    meta = dict(meta, id=profile_id, samples=sum(stacks.values()),
+                queries=len(queries))
+    (directory / 'meta.json').write_text(json.dumps(meta), encoding='utf-8')
+    _prune()
+    return profile_id
+
+
+def list_profiles():
+    """Метаданные сохранённых профилей, новые первыми."""
+    if not PROFILING_DIR.exists():
+        return []
+    result = []
+    for directory in sorted(PROFILING_DIR.iterdir(), reverse=True):
+        try:
+            result.append(json.loads(
+                (directory / 'meta.json').read_text(encoding='utf-8')
+            ))
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            continue
+    return result
+
+
+def artifact_path(profile_id, kind):
+    """Путь к файлу профиля или None, если его нет."""
+    if kind not in ARTIFACTS or '/' in profile_id or '..' in profile_id:
+        return None
+    path = PROFILING_DIR / profile_id / ARTIFACTS[kind]
+    return path if path.is_file() else None
+
+
+def _is_admin(user):
+    return (user is not None and user.is_authenticated
+            and (user.is_admin or user.is_superuser))
+
+
+class ProfilingMiddleware:
+    """Профилирует запрос по заголовку X-Profile, флагу ?profile=
+    или каждый PROFILING_SAMPLE_RATE-й запрос.
+
+    Заголовок и флаг действуют только для администраторов. Без
+    триггера запрос проходит без профилировщика и журнала SQL. Id
+    профиля в заголовке X-Profile-Id получают только администраторы.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.counter = itertools.count(1)
+
+    def trigger(self, request):
+        if HEADER in request.META or QUERY_FLAG in request.GET:
+            if self.requested_by_admin(request):
+                return 'request'
+        if SAMPLE_RATE and next(self.counter) % SAMPLE_RATE == 0:
+            return 'sample'
+        return None
+
+    @staticmethod
+    def requested_by_admin(request):
+        if _is_admin(getattr(request, 'user', None)):
+            return True
+        try:
+            authenticated = JWTAuthentication().authenticate(request)
+        except (AuthenticationFailed, TokenError):
+            return False
+        return authenticated is not None and _is_admin(authenticated[0])
+
+    def __call__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        return self.profile(request, trigger)
+
+    def profile(self, request, trigger):
+        logs = [QueryLog(alias) for alias in connections]
+        wrappers = [connections[log.alias].execute_wrapper(log)
+                    for log in logs]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        sampler = Sampler(threading.get_ident())
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+            duration = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot() if tracing else None
+            if tracing:
+                tracemalloc.stop()
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+        profile_id = save(
+            {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': duration * 1000,
+                'trigger': trigger,
+                'created': timezone.now().isoformat(),
+            },
+            sampler.stacks,
+            snapshot,
+            [query for log in logs for query in log.queries],
+        )
+        if trigger == 'request' or self.requested_by_admin(request):
+            response['X-Profile-Id'] = profile_id
+        return response
@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from reviews.models import User
+from . import autocomplete
+from .serializers import ProvisionUserSerializer
+
+CHUNK_SIZE = getattr(settings, 'PROVISION_CHUNK_SIZE', 1000)
+MAX_ROWS = getattr(settings, 'PROVISION_MAX_ROWS', 10000)
+FIELDS = tuple(ProvisionUserSerializer().fields)
+
+
+class ProvisioningConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = ('Имена или почты из файла заняли во время загрузки. '
+                      'Повторите запрос.')
+    default_code = 'provisioning_conflict'
+
+
+def read_csv(text):
+    """Строки файла в формате users.csv; колонка id не используется."""
+    return [
+        {name: value for name, value in row.items() if name in FIELDS}
+        for row in csv.DictReader(io.StringIO(text))
+    ]
+
+
+def read_json(text):
+    """Список пользователей или объект с ключом users."""
+    data = json.loads(text)
+    return data.get('users') if isinstance(data, dict) else data
+
+
+def read_file(name, content):
+    """Строки файла .json или .csv.
+
+    Файл не в UTF-8, с битым JSON или CSV вызывает ValueError.
+    """
+    text = content.decode('utf-8-sig') if isinstance(
+        content, bytes
+    ) else content
+    if name.lower().endswith('.json'):
+        return read_json(text)
+    try:
+        return read_csv(text)
+    except csv.Error as error:
+        raise ValueError(str(error)) from error
+
+
+def _chunks(items):
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+
+def _taken(usernames, emails):
+    """Занятые имена и почты одним запросом на пачку."""
+    taken_names, taken_emails = set(), set()
+    for names, addresses in zip(_chunks(usernames), _chunks(emails)):
+        for username, email in User.objects.filter(
+            Q(username__in=names) | Q(email__in=addresses)
+        ).values_list('username', 'email'):
+            taken_names.add(username)
+            taken_emails.add(email)
+    return taken_names, taken_emails
+
+
+def validate(rows):
+    """Проверяет строки; возвращает пригодные данные и ошибки по строкам.
+
+    Один экземпляр сериализатора проверяет все строки, чтобы поля не
+    собирались заново. Номера строк начинаются с 1. Повтор имени или
+    почты внутри файла считается ошибкой второй и следующих строк.
+    """
+    serializer = ProvisionUserSerializer()
+    valid, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        try:
+            valid.append((number, serializer.run_validation(row)))
+        except ValidationError as error:
+            errors.append({'row': number, 'errors': error.detail})
+    taken_names, taken_emails = _taken(
+        [data['username'] for _, data in valid],
+        [data['email'] for _, data in valid],
+    )
+    unique = []
+    for number, data in valid:
+        row_errors = {}
+        if data['username'] in taken_names:
+            row_errors['username'] = ['Имя пользователя уже занято.']
+        if data['email'] in taken_emails:
+            row_errors['email'] = ['Почта уже занята.']
+        taken_names.add(data['username'])
+        taken_emails.add(data['email'])
+        if row_errors:
+            errors.append({'row': number, 'errors': row_errors})
+        else:
+            unique.append((number, data))
+    errors.sort(key=lambda error: error['row'])
+    return unique, errors
+
+
+def create(valid):
+    """Создаёт пользователей пачками и возвращает их с id."""
+    users = [User(**data) for _, data in valid]
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=CHUNK_SIZE)
+    if users and users[0].pk is None:
+        ids = {}
+        for chunk in _chunks([user.username for user in users]):
+            ids.update(User.objects.filter(username__in=chunk).values_list(
+                'username', 'pk'
+            ))
+        for user in users:
+            user.pk = ids[user.username]
+    return users
+
+
+def invitation(user):
+    return EmailMessage(
+        subject='Код подтверждения',
+        body=(
+            f'Ваш код подтверждения '
+            f'{default_token_generator.make_token(user)}'
+        ),
+        from_email=settings.EMAIL_HOST_USER,
+        to=[user.email],
+    )
+
+
+def send_invitations(users):
+    """Отправляет коды подтверждения через одно соединение с почтой.
+
+    Возвращает число отправленных писем.
+    """
+    sent = 0
+    with get_connection() as connection:
+        for chunk in _chunks(users):
+            sent += connection.send_messages(
+                [invitation(user) for user in chunk]
+            ) or 0
+    return sent
+
+
+def provision(rows, send_email=True):
+    """Создаёт пользователей из строк users.csv или JSON.
+
+    Возвращает число созданных пользователей и отправленных писем
+    и ошибки по строкам; строки с ошибками пропускаются. Если имена
+    заняты и при повторной проверке, вызывает ProvisioningConflict.
+    """
+    valid, errors = validate(rows)
+    try:
+        users = create(valid)
+    except IntegrityError:
+        # Имя или почту заняли между проверкой и вставкой.
+        valid, errors = validate(rows)
+        try:
+            users = create(valid)
+        except IntegrityError:
+            raise ProvisioningConflict()
+    if users:
+        # Индекс перестраивают в фоне все процессы, не этот запрос.
+        transaction.on_commit(partial(autocomplete.invalidate, 'users'))
+    sent = send_invitations(users) if send_email else 0
+    return {'created': len(users), 'emails_sent': sent, 'errors': errors}
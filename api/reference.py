@@ -0,0 +1,121 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from reviews.models import Category, Genre
+
+VERSION_KEY = 'reference:version'
+CHECK_SECONDS = getattr(settings, 'REFERENCE_CACHE_CHECK_SECONDS', 1)
+
+
+def shared_version(key=VERSION_KEY):
+    """Возвращает версию из общего кэша, по умолчанию версию справочников."""
+    version = cache.get(key)
+    if version is None:
+        # Ключ мог быть вытеснен: новая метка, а не 1, чтобы не совпасть
+        # с версией, которая была до последнего сброса.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate():
+    """Сбрасывает справочники во всех процессах.
+
+    Новая версия — метка времени, а не cache.incr(): у кэша в базе incr
+    перезаписывает ключ со сроком по умолчанию, и после его истечения
+    версия вернулась бы к старому значению.
+    """
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    for reference in (genres, categories):
+        reference.expire()
+
+
+class ReferenceCache:
+    """Копия небольшого справочника в памяти процесса.
+
+    Актуальность сверяется с версией в общем кэше не чаще раза
+    в REFERENCE_CACHE_CHECK_SECONDS секунд.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._objects = []
+        self._by_id = {}
+        self._by_slug = {}
+        self._rendered = {}
+        self._version = None
+        self._checked = float('-inf')
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def load(self, version=None):
+        """Загружает справочник из базы данных."""
+        if version is None:
+            version = shared_version()
+        objects = list(self.model.objects.all())
+        with self._lock:
+            self._objects = objects
+            self._by_id = {obj.pk: obj for obj in objects}
+            self._by_slug = {obj.slug: obj for obj in objects}
+            self._rendered = {}
+            self._version = version
+            self._checked = time.monotonic()
+
+    def expire(self):
+        """Заставляет сверить версию при следующем обращении."""
+        self._checked = float('-inf')
+
+    def _fresh(self):
+        now = time.monotonic()
+        if self._version is None or now - self._checked >= CHECK_SECONDS:
+            version = shared_version()
+            if version != self._version:
+                self.load(version)
+            else:
+                self._checked = now
+        return self
+
+    def get(self, pk):
+        """Возвращает объект по id, в том числе скрытый."""
+        return self._fresh()._by_id.get(pk)
+
+    def by_slug(self, slug):
+        """Возвращает видимый объект по slug.
+
+        Если slug не найден, версия сверяется сразу: объект мог только
+        что появиться в другом процессе.
+        """
+        obj = self._fresh()._by_slug.get(slug)
+        if obj is None:
+            self.expire()
+            obj = self._fresh()._by_slug.get(slug)
+        if obj is None or getattr(obj, 'is_deleted', False):
+            return None
+        return obj
+
+    def visible(self):
+        """Возвращает видимые объекты в порядке сортировки модели."""
+        return [obj for obj in self._fresh()._objects
+                if not getattr(obj, 'is_deleted', False)]
+
+    def render(self, pk, serializer_class):
+        """Возвращает сериализованный объект, запоминая результат."""
+        self._fresh()
+        key = (pk, serializer_class)
+        data = self._rendered.get(key)
+        if data is None:
+            obj = self._by_id.get(pk)
+            if obj is None:
+                return None
+            data = serializer_class(obj).data
+            self._rendered[key] = data
+        return data
+
+
+genres = ReferenceCache(Genre)
+categories = ReferenceCache(Category)
@@ -1,13 +1,92 @@
 from django.shortcuts import get_object_or_404
+from django.utils.encoding import smart_str
 from rest_framework import serializers
 from rest_framework.relations import SlugRelatedField
 from rest_framework.validators import UniqueValidator
 
-from reviews.models import Category, Comment, Genre, Review, Title, User
-from api_yamdb.settings import USERNAME_LENGTH, EMAIL_LENGTH
+from reviews.models import (Category, Change, Comment, DeletionJob, Genre,
+                            Review, SimilarTitle, Title, User)
+from api_yamdb.settings import (BATCH_MAX_REQUESTS, CHANGES_LIMIT,
+                                CHANGES_MAX_LIMIT, MODERATION_MAX_IDS,
+                                USERNAME_LENGTH, EMAIL_LENGTH)
+from . import reference
 from .validators import validate_username
 
 
+def requested_fields(request, available):
+    """Возвращает поля ответа с учётом параметров fields и omit.
+
+    None означает, что параметры не переданы и нужны все поля.
+    """
+    if request is None or request.method != 'GET':
+        return None
+    fields = request.query_params.get('fields')
+    omit = request.query_params.get('omit')
+    if not fields and not omit:
+        return None
+    keep = set(available)
+    if fields:
+        keep &= {name.strip() for name in fields.split(',')}
+    if omit:
+        keep -= {name.strip() for name in omit.split(',')}
+    return keep
+
+
+class SparseFieldsMixin:
+    """Убирает из ответа поля, не запрошенные через ?fields= и ?omit=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = requested_fields(self.context.get('request'), self.fields)
+        if keep is not None:
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class CachedSlugRelatedField(SlugRelatedField):
+    """Поле по slug, которое ищет объекты в кэше справочника."""
+
+    def __init__(self, reference, **kwargs):
+        self.reference = reference
+        kwargs.setdefault('queryset', reference.model.objects.all())
+        super().__init__(slug_field='slug', **kwargs)
+
+    def to_internal_value(self, data):
+        obj = self.reference.by_slug(smart_str(data))
+        if obj is None:
+            self.fail('does_not_exist', slug_name=self.slug_field,
+                      value=smart_str(data))
+        return obj
+
+
+class CachedReferenceField(serializers.Field):
+    """Поле для чтения, которое отдаёт справочник из кэша по id."""
+
+    def __init__(self, reference, serializer_class, many=False, **kwargs):
+        self.reference = reference
+        self.serializer_class = serializer_class
+        self.many = many
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        if not self.many:
+            return getattr(instance, f'{self.source}_id')
+        prefetched = getattr(instance, '_prefetched_objects_cache', {})
+        if self.source in prefetched:
+            return [obj.pk for obj in prefetched[self.source]]
+        related = getattr(type(instance), self.source)
+        return list(related.through.objects.filter(
+            **{related.field.m2m_field_name(): instance.pk}
+        ).values_list(related.field.m2m_reverse_field_name(), flat=True))
+
+    def to_representation(self, value):
+        if self.many:
+            return [self.reference.render(pk, self.serializer_class)
+                    for pk in value]
+        return self.reference.render(value, self.serializer_class)
+
+
 class SignupSerializer(serializers.Serializer):
     """Сериализатор для регистрации."""
 
@@ -73,6 +152,24 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
 
 
+class ProvisionUserSerializer(serializers.Serializer):
+    """Проверка строки массового создания пользователей без запросов
+    к базе: уникальность проверяется для всей пачки сразу."""
+
+    username = serializers.CharField(
+        max_length=USERNAME_LENGTH,
+        validators=[validate_username],
+    )
+    email = serializers.EmailField(max_length=EMAIL_LENGTH)
+    role = serializers.ChoiceField(choices=User.ROLE_CHOICES,
+                                   default=User.USER)
+    bio = serializers.CharField(allow_blank=True, default='')
+    first_name = serializers.CharField(max_length=150, allow_blank=True,
+                                       default='')
+    last_name = serializers.CharField(max_length=150, allow_blank=True,
+                                      default='')
+
+
 class UserEditSerializer(serializers.ModelSerializer):
     """Сериализатор для изменения users."""
 
@@ -83,16 +180,16 @@ class UserEditSerializer(serializers.ModelSerializer):
         read_only_fields = ('role',)
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для категорий."""
 
     class Meta:
         model = Category
-        exclude = ('id', )
+        exclude = ('id', 'is_deleted')
         lookup_field = 'slug'
 
 
-class GenreSerializer(serializers.ModelSerializer):
+class GenreSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для жанров."""
 
     class Meta:
@@ -101,11 +198,17 @@ class GenreSerializer(serializers.ModelSerializer):
         lookup_field = 'slug'
 
 
-class TitleGETSerializer(serializers.ModelSerializer):
-    """Сериализатор для тайтлов при GET-запросах."""
-    category = CategorySerializer(read_only=True)
-    genre = GenreSerializer(read_only=True, many=True)
+class TitleGETSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для тайтлов при GET-запросах.
+
+    Поля my_score и reviewed выводятся, только если в контексте
+    переданы оценки пользователя my_scores.
+    """
+    category = CachedReferenceField(reference.categories, CategorySerializer)
+    genre = CachedReferenceField(reference.genres, GenreSerializer, many=True)
     rating = serializers.FloatField(read_only=True)
+    my_score = serializers.SerializerMethodField()
+    reviewed = serializers.SerializerMethodField()
 
     class Meta:
         model = Title
@@ -116,21 +219,28 @@ class TitleGETSerializer(serializers.ModelSerializer):
             'rating',
             'description',
             'genre',
-            'category'
+            'category',
+            'my_score',
+            'reviewed',
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'my_scores' not in self.context:
+            self.fields.pop('my_score', None)
+            self.fields.pop('reviewed', None)
+
+    def get_my_score(self, title):
+        return self.context['my_scores'].get(title.pk)
+
+    def get_reviewed(self, title):
+        return title.pk in self.context['my_scores']
+
 
 class TitleSerializer(serializers.ModelSerializer):
     """Сериализатор для тайтлов при остальных запросах."""
-    category = serializers.SlugRelatedField(
-        queryset=Category.objects.all(),
-        slug_field='slug'
-    )
-    genre = serializers.SlugRelatedField(
-        queryset=Genre.objects.all(),
-        slug_field='slug',
-        many=True
-    )
+    category = CachedSlugRelatedField(reference.categories)
+    genre = CachedSlugRelatedField(reference.genres, many=True)
 
     class Meta:
         model = Title
@@ -148,24 +258,38 @@ class TitleSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
-class ReviewSerializer(serializers.ModelSerializer):
-    """Сериализатор для отзывов."""
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для отзывов.
+
+    Поле latest_comments выводится, только если в контексте переданы
+    последние комментарии отзывов.
+    """
 
     author = SlugRelatedField(slug_field='username', read_only=True)
+    latest_comments = serializers.SerializerMethodField()
 
     class Meta:
         fields = (
-            'id', 'text', 'author', 'score', 'pub_date')
+            'id', 'text', 'author', 'score', 'pub_date', 'comment_count',
+            'latest_comments')
         model = Review
         read_only_fields = ('title',)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'latest_comments' not in self.context:
+            self.fields.pop('latest_comments', None)
+
+    def get_latest_comments(self, review):
+        return self.context['latest_comments'].get(review.pk, [])
+
     def validate(self, data):
         """Запрещает пользователям оставлять повторные отзывы."""
         if not self.context.get('request').method == 'POST':
             return data
         title_id = self.context['view'].kwargs.get('title_id')
         author = self.context.get('request').user
-        title = get_object_or_404(Title, id=title_id)
+        title = get_object_or_404(Title, id=title_id, is_deleted=False)
         if title.reviews.filter(author=author).exists():
             raise serializers.ValidationError(
                 'Можно оставлять только один отзыв!'
@@ -173,7 +297,7 @@ class ReviewSerializer(serializers.ModelSerializer):
         return data
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для комментариев."""
 
     author = SlugRelatedField(
@@ -185,3 +309,112 @@ class CommentSerializer(serializers.ModelSerializer):
             'id', 'text', 'author', 'pub_date')
         model = Comment
         read_only_fields = ('review',)
+
+
+class DeletionJobSerializer(serializers.ModelSerializer):
+    """Сериализатор для задач фонового удаления."""
+
+    class Meta:
+        fields = ('id', 'model', 'object_id', 'status', 'total',
+                  'processed', 'error', 'created', 'finished')
+        model = DeletionJob
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    """Сериализатор параметров запроса журнала изменений."""
+
+    since = serializers.IntegerField(min_value=0, default=0)
+    type = serializers.CharField(required=False)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=CHANGES_MAX_LIMIT,
+        default=CHANGES_LIMIT,
+    )
+
+    def validate_type(self, value):
+        kinds = {kind for kind, _ in Change.KIND_CHOICES}
+        requested = [kind for kind in value.split(',') if kind]
+        unknown = set(requested) - kinds
+        if unknown:
+            raise serializers.ValidationError(
+                f'Неизвестный тип: {", ".join(sorted(unknown))}'
+            )
+        return requested
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    """Сериализатор для записей журнала изменений."""
+
+    type = serializers.CharField(source='kind')
+    id = serializers.IntegerField(source='object_id')
+    data = serializers.SerializerMethodField()
+
+    class Meta:
+        fields = ('seq', 'type', 'id', 'title_id', 'action', 'created',
+                  'data')
+        model = Change
+
+    def get_data(self, change):
+        if change.action == Change.DELETE:
+            return None
+        return self.context['objects'].get((change.kind, change.object_id))
+
+
+class SimilarTitleSerializer(serializers.ModelSerializer):
+    """Сериализатор для похожих тайтлов."""
+
+    id = serializers.IntegerField(source='similar.id')
+    name = serializers.CharField(source='similar.name')
+    year = serializers.IntegerField(source='similar.year')
+
+    class Meta:
+        fields = ('id', 'name', 'year', 'score')
+        model = SimilarTitle
+
+
+class StatsQuerySerializer(serializers.Serializer):
+    """Сериализатор параметров запроса статистики."""
+
+    group_by = serializers.ChoiceField(
+        choices=('category_year', 'month', 'genre')
+    )
+
+
+class ModerationSerializer(serializers.Serializer):
+    """Сериализатор условий массового удаления отзывов и комментариев."""
+
+    type = serializers.ChoiceField(choices=('reviews', 'comments'))
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=MODERATION_MAX_IDS,
+        allow_empty=False,
+        required=False,
+    )
+    title = serializers.IntegerField(min_value=1, required=False)
+    author = serializers.SlugRelatedField(
+        slug_field='username',
+        queryset=User.objects.all(),
+        required=False,
+    )
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    text = serializers.CharField(min_length=3, required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if not {'ids', 'author', 'since', 'until', 'text'} & set(data):
+            raise serializers.ValidationError(
+                'Нужно передать ids или хотя бы одно условие отбора.'
+            )
+        return data
+
+
+class BatchSerializer(serializers.Serializer):
+    """Сериализатор пакета GET-запросов."""
+
+    requests = serializers.ListField(
+        child=serializers.CharField(max_length=2000),
+        max_length=BATCH_MAX_REQUESTS,
+        allow_empty=False,
+    )
+    parallel = serializers.BooleanField(default=False)
@@ -0,0 +1,137 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from reviews.changelog import title_id_of, titles_changed
+from reviews.models import Category, Comment, Genre, Review, Title, User
+from . import autocomplete, hot, reference
+from .events import get_broker, title_channel
+from .serializers import CommentSerializer, ReviewSerializer
+
+AUTOCOMPLETE_SOURCES = {
+    Title: ('titles', autocomplete.title_payload),
+    Genre: ('genres', autocomplete.slugged_payload),
+    Category: ('categories', autocomplete.slugged_payload),
+    User: ('users', autocomplete.user_payload),
+}
+
+
+@receiver(post_save, sender=Title)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=User)
+def update_autocomplete(sender, instance, **kwargs):
+    """Обновляет индекс автодополнения после сохранения.
+
+    Свой процесс меняет индекс сразу, остальные перестраивают его
+    по новой версии в общем кэше.
+    """
+    kind, payload = AUTOCOMPLETE_SOURCES[sender]
+    index = autocomplete.INDEXES[kind]
+    label, data = payload(instance)
+    if getattr(instance, 'is_deleted', False) or label is None:
+        index.remove(instance.pk)
+    else:
+        index.update(instance.pk, label, data)
+    transaction.on_commit(partial(autocomplete.invalidate, kind))
+
+
+@receiver(post_delete, sender=Title)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=User)
+def remove_autocomplete(sender, instance, **kwargs):
+    """Удаляет запись из индекса автодополнения."""
+    kind, _ = AUTOCOMPLETE_SOURCES[sender]
+    autocomplete.INDEXES[kind].remove(instance.pk)
+    transaction.on_commit(partial(autocomplete.invalidate, kind))
+
+
+@receiver(post_save, sender=Review)
+def count_review_popularity(sender, instance, created, **kwargs):
+    """Повышает популярность тайтла и автора при новом отзыве."""
+    if created:
+        autocomplete.INDEXES['titles'].bump(instance.title_id, 1)
+        autocomplete.INDEXES['users'].bump(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Review)
+def discount_review_popularity(sender, instance, **kwargs):
+    """Понижает популярность тайтла и автора при удалении отзыва."""
+    autocomplete.INDEXES['titles'].bump(instance.title_id, -1)
+    autocomplete.INDEXES['users'].bump(instance.author_id, -1)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Category)
+def invalidate_reference(sender, **kwargs):
+    """Сбрасывает кэш справочников после коммита изменений."""
+    transaction.on_commit(reference.invalidate)
+
+
+@receiver(post_save, sender=Title)
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Title)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=Comment)
+def refresh_hot_title(sender, instance, raw=False, **kwargs):
+    """Сбрасывает страницы тайтла в кэше после коммита изменений."""
+    if raw:
+        return
+    title_id = title_id_of(instance)
+    if title_id is not None:
+        transaction.on_commit(partial(hot.refresh, title_id))
+
+
+@receiver(titles_changed)
+def refresh_changed_titles(sender, title_ids, **kwargs):
+    """Сбрасывает страницы тайтлов после записей пачками: удаления
+    в reviews.deletion, пересчёта оценок и загрузки изменений."""
+    if title_ids:
+        transaction.on_commit(partial(hot.refresh_many, title_ids))
+
+
+@receiver(titles_changed, sender=Title)
+def invalidate_title_autocomplete(sender, title_ids, **kwargs):
+    """Перестраивает индекс тайтлов после удаления и пересчёта пачками."""
+    if title_ids:
+        transaction.on_commit(partial(autocomplete.invalidate, 'titles'))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Category)
+def refresh_hot_titles(sender, **kwargs):
+    """Сбрасывает страницы всех тайтлов после смены справочников."""
+    transaction.on_commit(hot.refresh_all)
+
+
+def stream_payload(instance):
+    """Сериализует отзыв или комментарий для потока событий."""
+    if isinstance(instance, Review):
+        return ReviewSerializer(instance).data
+    return dict(CommentSerializer(instance).data, review=instance.review_id)
+
+
+def publish(channel, event, instance):
+    get_broker().publish(channel, event, stream_payload(instance))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=Comment)
+def stream_change(sender, instance, created, raw=False, **kwargs):
+    """Отправляет новый или изменённый объект подписчикам после коммита."""
+    if raw or getattr(instance, 'is_deleted', False):
+        return
+    event = '{}.{}'.format(
+        sender._meta.model_name, 'created' if created else 'updated'
+    )
+    transaction.on_commit(partial(
+        publish, title_channel(title_id_of(instance)), event, instance
+    ))
@@ -0,0 +1,206 @@
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.test import RequestFactory
+from django.urls import resolve
+from rest_framework.renderers import JSONRenderer
+
+from reviews import changelog
+from reviews.models import Change, Genre, Title
+from reviews.ratings import RATING
+from . import reference
+from .serializers import TitleGETSerializer
+
+SNAPSHOT_DIR = Path(getattr(settings, 'SNAPSHOT_DIR', 'snapshot'))
+BASE_URL = getattr(settings, 'SNAPSHOT_BASE_URL', 'http://localhost')
+TITLE_PAGES = getattr(settings, 'SNAPSHOT_TITLE_PAGES', 5)
+CHUNK_SIZE = 500
+STATE_FILE = '.state.json'
+LISTS = ('categories', 'genres')
+PREFIX = 'api/v1'
+
+
+def request_factory(base_url=BASE_URL):
+    url = urlsplit(base_url)
+    return RequestFactory(
+        HTTP_HOST=url.netloc,
+        HTTP_ACCEPT='application/json',
+        **{'wsgi.url_scheme': url.scheme or 'http'},
+    )
+
+
+def render(url, factory=None, **extra):
+    """Выполняет GET анонимного клиента через представление API."""
+    request = (factory or request_factory()).get(url, **extra)
+    match = resolve(request.path_info)
+    response = match.func(request, *match.args, **match.kwargs)
+    response.render()
+    return response
+
+
+def list_path(resource, page):
+    """Файл страницы списка: index.json для первой, page-N.json далее."""
+    name = 'index.json' if page == 1 else f'page-{page}.json'
+    return Path(PREFIX, resource, name)
+
+
+def detail_path(title_id):
+    return Path(PREFIX, 'titles', str(title_id), 'index.json')
+
+
+class Publisher:
+    """Записывает ответы API в файлы каталога SNAPSHOT_DIR.
+
+    Каждый файл пишется рядом во временный и подменяется через
+    os.replace, рядом кладётся его сжатая копия .gz. Файлы с тем же
+    содержимым не перезаписываются.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = Path(directory)
+        self.factory = request_factory()
+        self.renderer = JSONRenderer()
+        self.written = 0
+        self.removed = 0
+
+    def write(self, relative, content):
+        path = self.directory / relative
+        try:
+            if path.read_bytes() == content:
+                return
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        for target, data in ((path.with_name(path.name + '.gz'),
+                              gzip.compress(content, mtime=0)),
+                             (path, content)):
+            temporary = target.with_name(f'.{target.name}.tmp')
+            temporary.write_bytes(data)
+            os.replace(temporary, target)
+        self.written += 1
+
+    def remove(self, relative):
+        path = self.directory / relative
+        for target in (path.with_name(path.name + '.gz'), path):
+            try:
+                target.unlink()
+            except FileNotFoundError:
+                continue
+        try:
+            path.parent.rmdir()
+        except OSError:
+            pass
+        self.removed += 1
+
+    def get(self, url):
+        response = render(url, self.factory)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: ответ {response.status_code}.')
+        return response
+
+    def publish_list(self, resource, pages=None):
+        """Публикует страницы списка; возвращает их содержимое."""
+        url = f'/{PREFIX}/{resource}/'
+        contents = []
+        page = 0
+        while pages is None or page < pages:
+            page += 1
+            response = self.get(url if page == 1 else f'{url}?page={page}')
+            contents.append(response.content)
+            self.write(list_path(resource, page), response.content)
+            if response.data.get('next') is None:
+                break
+        self.prune_pages(resource, page)
+        return contents
+
+    def prune_pages(self, resource, last):
+        folder = self.directory / PREFIX / resource
+        if not folder.is_dir():
+            return
+        for path in folder.glob('page-*.json'):
+            number = path.stem[len('page-'):]
+            if number.isdigit() and int(number) > last:
+                self.remove(path.relative_to(self.directory))
+
+    def publish_titles(self, title_ids):
+        """Публикует карточки тайтлов и удаляет карточки скрытых."""
+        queryset = Title.objects.filter(is_deleted=False).annotate(
+            rating=RATING
+        ).prefetch_related(
+            Prefetch('genre', queryset=Genre.objects.only('id'))
+        )
+        title_ids = sorted(title_ids)
+        for start in range(0, len(title_ids), CHUNK_SIZE):
+            chunk = title_ids[start:start + CHUNK_SIZE]
+            found = set()
+            for title in queryset.filter(pk__in=chunk):
+                found.add(title.pk)
+                self.write(detail_path(title.pk), self.renderer.render(
+                    TitleGETSerializer(title).data
+                ))
+            for title_id in set(chunk) - found:
+                if (self.directory / detail_path(title_id)).exists():
+                    self.remove(detail_path(title_id))
+
+    def published_titles(self):
+        folder = self.directory / PREFIX / 'titles'
+        if not folder.is_dir():
+            return set()
+        return {int(path.name) for path in folder.iterdir()
+                if path.name.isdigit()}
+
+
+def read_state(directory=SNAPSHOT_DIR):
+    try:
+        return json.loads((Path(directory) / STATE_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_state(directory, state):
+    path = Path(directory) / STATE_FILE
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(state))
+    os.replace(temporary, path)
+
+
+def publish(directory=SNAPSHOT_DIR, full=False):
+    """Обновляет снимок каталога для анонимных клиентов.
+
+    Справочники перерисовываются всегда: они в памяти и малы. Если они
+    изменились, карточки всех тайтлов пересобираются, иначе — только
+    тайтлов из журнала изменений после прошлой публикации.
+    Возвращает число записанных и удалённых файлов.
+    """
+    publisher = Publisher(directory)
+    state = None if full else read_state(directory)
+    upper = changelog.read_upper(state['seq'] if state else 0)
+    for cache in (reference.categories, reference.genres):
+        cache.load()
+    digest = hashlib.blake2b(digest_size=16)
+    for resource in LISTS:
+        for content in publisher.publish_list(resource):
+            digest.update(content)
+    digest = digest.hexdigest()
+    if state is None or state.get('reference') != digest:
+        title_ids = set(Title.objects.filter(
+            is_deleted=False
+        ).values_list('pk', flat=True))
+        title_ids |= publisher.published_titles()
+    else:
+        title_ids = set(Change.objects.filter(
+            seq__gt=state['seq'], seq__lte=upper
+        ).exclude(kind=Change.COMMENT).values_list(
+            'title_id', flat=True
+        ).distinct().order_by())
+    if title_ids or state is None:
+        publisher.publish_titles(title_ids)
+        publisher.publish_list('titles', TITLE_PAGES)
+    write_state(directory, {'seq': upper, 'reference': digest})
+    return {'written': publisher.written, 'removed': publisher.removed,
+            'titles': len(title_ids)}
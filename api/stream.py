@@ -0,0 +1,108 @@
+import asyncio
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from reviews.models import Title
+from .events import encode, get_broker, title_channel
+
+HEARTBEAT_SECONDS = getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)
+STREAM_PATH = re.compile(r'^/api/v1/titles/(?P<title_id>\d+)/reviews/stream/$')
+
+HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def title_exists(title_id):
+    return Title.objects.filter(pk=title_id, is_deleted=False).exists()
+
+
+class ReviewStream:
+    """ASGI-приложение с потоком новых отзывов и комментариев тайтла.
+
+    Обрабатывает только путь потока, остальные запросы передаёт Django.
+    Каждое соединение — одна корутина с очередью, поэтому простаивающие
+    подписчики не занимают потоки.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = None
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = STREAM_PATH.match(scope['path'])
+        if match is None:
+            return await self.app(scope, receive, send)
+        return await self.stream(
+            int(match.group('title_id')), scope, receive, send
+        )
+
+    async def stream(self, title_id, scope, receive, send):
+        if not await sync_to_async(title_exists)(title_id):
+            await send({
+                'type': 'http.response.start',
+                'status': 404,
+                'headers': [(b'content-type', b'application/json')],
+            })
+            await send({
+                'type': 'http.response.body',
+                'body': b'{"detail": "Not found."}',
+            })
+            return
+        headers = dict(scope['headers'])
+        last_id = headers.get(b'last-event-id')
+        broker = get_broker()
+        subscription = broker.subscribe(
+            title_channel(title_id),
+            asyncio.get_running_loop(),
+            last_id.decode('latin-1') if last_id else None,
+        )
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': HEADERS,
+            })
+            await send({
+                'type': 'http.response.body',
+                'body': f'retry: {HEARTBEAT_SECONDS * 1000}\n\n'.encode(),
+                'more_body': True,
+            })
+            while not disconnected.done():
+                message = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait(
+                    (message, disconnected),
+                    timeout=HEARTBEAT_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if message not in done:
+                    message.cancel()
+                    if not disconnected.done():
+                        await send({
+                            'type': 'http.response.body',
+                            'body': b': ping\n\n',
+                            'more_body': True,
+                        })
+                    continue
+                await send({
+                    'type': 'http.response.body',
+                    'body': encode(message.result()),
+                    'more_body': True,
+                })
+                if subscription.lagging and subscription.queue.empty():
+                    break
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            broker.unsubscribe(subscription)
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -0,0 +1,843 @@
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import (IntegrityError, OperationalError, connection,
+                       connections)
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from reviews import changelog, deletion, ratings, sharding
+from reviews.models import (Category, Change, ChangeCompaction, Comment,
+                            Genre, Review, Title, User)
+from . import (autocomplete, batch, budget, events, hot, profiling,
+               provisioning, reference, snapshot)
+from .stream import ReviewStream
+
+BULK_URL = '/api/v1/users/bulk/'
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'
+)
+class BulkUsersTests(APITestCase):
+    """Массовое создание пользователей из файла."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.admin = User.objects.create(
+            username='admin', email='admin@example.com', role=User.ADMIN
+        )
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, name, content):
+        return self.client.post(
+            BULK_URL,
+            {'file': SimpleUploadedFile(name, content)},
+            format='multipart',
+        )
+
+    def test_csv_creates_users(self):
+        response = self.upload(
+            'users.csv',
+            b'username,email\nfirst,first@example.com\n'
+            b'second,second@example.com\n',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertTrue(User.objects.filter(username='second').exists())
+
+    def test_repeated_conflict_is_reported(self):
+        error = IntegrityError('UNIQUE constraint failed')
+        with mock.patch.object(provisioning, 'create', side_effect=error):
+            response = self.upload(
+                'users.csv', b'username,email\nfirst,first@example.com\n'
+            )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_autocomplete_is_rebuilt_outside_request(self):
+        key = autocomplete.VERSION_KEY.format('users')
+        before = reference.shared_version(key)
+        index = autocomplete.INDEXES['users']
+        with mock.patch.object(index, 'build') as build, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.upload(
+                'users.csv', b'username,email\nfirst,first@example.com\n'
+            )
+        build.assert_not_called()
+        self.assertNotEqual(cache.get(key), before)
+
+    def test_malformed_json_is_bad_request(self):
+        response = self.upload('users.json', b'[{"username": ')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file', response.data)
+
+    def test_non_utf8_csv_is_bad_request(self):
+        content = 'username,email\nпётр,p@example.com\n'.encode('cp1251')
+        response = self.upload('users.csv', content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file', response.data)
+
+    def test_command_reports_unreadable_file(self):
+        handle = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        handle.write(b'\xff\xfe{')
+        handle.close()
+        self.addCleanup(os.unlink, handle.name)
+        with self.assertRaises(CommandError):
+            call_command('provision_users', handle.name, no_email=True)
+
+
+class ReferenceCacheTests(APITestCase):
+    """Кэш справочников сбрасывается во всех процессах."""
+
+    def setUp(self):
+        # Копия справочника в памяти другого рабочего процесса.
+        self.worker = reference.ReferenceCache(Category)
+        self.worker.load()
+
+    def test_invalidation_reaches_other_process(self):
+        Category.objects.create(name='Фильм', slug='movie')
+        reference.invalidate()
+        with mock.patch.object(reference, 'CHECK_SECONDS', 0):
+            slugs = [category.slug for category in self.worker.visible()]
+        self.assertEqual(slugs, ['movie'])
+
+    def test_version_does_not_expire(self):
+        reference.invalidate()
+        version = reference.shared_version()
+        later = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(reference.shared_version(), version)
+
+    def test_new_slug_is_found_before_next_check(self):
+        Category.objects.create(name='Книга', slug='book')
+        reference.invalidate()
+        with mock.patch.object(reference, 'CHECK_SECONDS', 3600):
+            self.assertEqual(self.worker.visible(), [])
+            self.assertEqual(self.worker.by_slug('book').name, 'Книга')
+
+
+class QueryBudgetTests(TestCase):
+    """Бюджет расходуется временем SQL и учитывается в общем кэше."""
+
+    SLOW = ('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 '
+            'FROM c WHERE x < 100000000) SELECT count(*) FROM c')
+
+    def setUp(self):
+        patcher = mock.patch.dict(budget.BUDGETS, {'titles': 0.2})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()
+
+    def test_python_time_is_not_counted(self):
+        with budget.limit('titles') as deadline:
+            time.sleep(0.3)
+            self.assertEqual(self.execute('SELECT 1'), (1,))
+        self.assertLess(deadline.spent, 0.2)
+        self.assertFalse(deadline.breached)
+
+    def test_slow_query_is_interrupted_and_recorded(self):
+        before = budget.exceeded()['titles']
+        started = time.monotonic()
+        with self.assertRaises(budget.QueryBudgetExceeded):
+            with budget.limit('titles'):
+                self.execute(self.SLOW)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(budget.exceeded()['titles'], before + 1)
+        self.assertEqual(self.execute('SELECT 1'), (1,))
+
+    def test_postgres_timeout_is_rounded_up_and_reported(self):
+        cursor = mock.Mock()
+        context = {
+            'connection': mock.Mock(vendor='postgresql', alias='default'),
+            'cursor': mock.Mock(cursor=cursor),
+        }
+        cause = Exception('canceling statement due to statement timeout')
+        cause.pgcode = budget.POSTGRES_CANCELED
+        error = OperationalError(str(cause))
+        error.__cause__ = cause
+        execute = mock.Mock(side_effect=error)
+        deadline = budget.Deadline('titles', 0.0015)
+        with self.assertRaises(budget.QueryBudgetExceeded):
+            deadline(execute, 'SELECT 1', None, False, context)
+        cursor.execute.assert_called_once_with(
+            'SET statement_timeout = %s', [2]
+        )
+        self.assertTrue(deadline.breached)
+
+    def test_counters_do_not_expire(self):
+        budget.record('titles')
+        budget.record('titles')
+        later = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(budget.exceeded()['titles'], 2)
+
+
+@mock.patch.object(hot, 'BACKGROUND', False)
+class HotPagesTests(APITestCase):
+    """Страницы горячих тайтлов в общем кэше."""
+
+    databases = '__all__'
+
+    BASE = 'http://testserver'
+
+    def setUp(self):
+        category = Category.objects.create(name='Фильм', slug='movie')
+        genre = Genre.objects.create(name='Драма', slug='drama')
+        self.title = Title.objects.create(
+            name='Сталкер', year=1979, category=category
+        )
+        self.title.genre.add(genre)
+        self.url = f'/api/v1/titles/{self.title.pk}/'
+        self.tracker = hot.HotTracker(min_hits=1)
+        patcher = mock.patch.object(hot, 'tracker', self.tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hot_title_is_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], 'Сталкер')
+
+    def test_write_in_other_process_invalidates_page(self):
+        hot.warm(self.title.pk, self.BASE)
+        Title.objects.filter(pk=self.title.pk).update(name='Солярис')
+        # Процесс, который записал изменение, тайтл горячим не считает.
+        with mock.patch.object(hot, 'tracker', hot.HotTracker()):
+            hot.refresh(self.title.pk)
+        self.assertIsNone(hot.cached('detail', self.title.pk, self.BASE))
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url).data['name'], 'Солярис')
+
+    def test_refresh_all_invalidates_every_title(self):
+        hot.warm(self.title.pk, self.BASE)
+        hot.refresh_all()
+        self.assertIsNone(hot.cached('detail', self.title.pk, self.BASE))
+
+    def test_bulk_writes_invalidate_pages(self):
+        review = Review.objects.create(
+            title=self.title, text='Текст', score=9,
+            author=User.objects.create(username='author',
+                                       email='author@example.com'),
+        )
+        writes = (
+            lambda: ratings.recount([self.title.pk]),
+            lambda: deletion.bulk_delete(Review.objects.filter(pk=review.pk)),
+        )
+        for write in writes:
+            hot.warm(self.title.pk, self.BASE)
+            with mock.patch.object(hot, 'tracker', hot.HotTracker()), \
+                    self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertIsNone(hot.cached('detail', self.title.pk, self.BASE))
+
+    def test_evicted_version_is_a_miss(self):
+        hot.warm(self.title.pk, self.BASE)
+        with mock.patch.object(hot, 'tracker', hot.HotTracker()):
+            hot.refresh(self.title.pk)
+        hot.warm(self.title.pk, self.BASE)
+        self.assertIsNotNone(hot.cached('detail', self.title.pk, self.BASE))
+        cache.delete(hot.TITLE_VERSION_KEY.format(self.title.pk))
+        self.assertIsNone(hot.cached('detail', self.title.pk, self.BASE))
+
+    def test_refresh_renders_in_background_once(self):
+        self.tracker.hit(self.title.pk)
+        with mock.patch.object(hot, 'BACKGROUND', True), \
+                mock.patch.object(hot, '_executor') as executor, \
+                mock.patch.object(hot, 'warm') as warm:
+            hot.refresh(self.title.pk)
+            hot.refresh(self.title.pk)
+        warm.assert_not_called()
+        executor.submit.assert_called_once()
+        hot._pending.clear()
+
+
+class ChangesTests(APITestCase):
+    """Курсоры журнала изменений."""
+
+    URL = '/api/v1/changes/'
+
+    def setUp(self):
+        admin = User.objects.create(
+            username='admin', email='admin@example.com', role=User.ADMIN
+        )
+        self.client.force_authenticate(admin)
+
+    def add(self, seq, age=0):
+        change = Change.objects.create(
+            seq=seq, kind=Change.TITLE, object_id=seq, title_id=seq,
+            action=Change.DELETE,
+        )
+        Change.objects.filter(seq=seq).update(
+            created=timezone.now() - timedelta(seconds=age)
+        )
+        return change
+
+    def seqs(self, since=0):
+        response = self.client.get(self.URL, {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [entry['seq'] for entry in response.data['results']]
+
+    def test_cursor_before_horizon_is_gone(self):
+        ChangeCompaction.objects.create(seq=10, removed=1)
+        response = self.client.get(self.URL, {'since': 5})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(response.data['horizon'], 10)
+        self.seqs(since=0)
+        self.seqs(since=10)
+
+    def test_compaction_moves_horizon(self):
+        self.add(1, age=3 * 86400)
+        self.add(2, age=3 * 86400)
+        self.add(3, age=60)
+        call_command('compact_changes', days=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.seqs(since=0), [3])
+        response = self.client.get(self.URL, {'since': 1})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(response.data['horizon'], 2)
+
+    def test_recent_gap_holds_back_later_entries(self):
+        self.add(1, age=60)
+        self.add(2)
+        self.add(4)
+        self.assertEqual(self.seqs(), [1, 2])
+        Change.objects.filter(seq=4).update(
+            created=timezone.now() - timedelta(seconds=60)
+        )
+        self.assertEqual(self.seqs(), [1, 2, 4])
+
+    def test_upper_stays_before_recent_gap(self):
+        self.add(1, age=60)
+        self.add(3)
+        self.assertEqual(changelog.committed_upper(0), 1)
+        self.assertEqual(changelog.committed_upper(1), 1)
+
+    def test_old_gap_is_skipped(self):
+        self.add(1, age=60)
+        self.add(3, age=60)
+        self.add(4)
+        self.assertEqual(self.seqs(), [1, 3, 4])
+
+    def test_snapshot_stops_before_recent_gap(self):
+        self.add(1, age=60)
+        self.add(3)
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot.publish(directory)
+            self.assertEqual(snapshot.read_state(directory)['seq'], 1)
+
+
+class PrefixIndexTests(TestCase):
+    """Перестроение индекса автодополнения."""
+
+    def setUp(self):
+        self.rows = [(1, 'Сталкер', 5, 'Сталкер')]
+        self.index = autocomplete.PrefixIndex(lambda: iter(self.rows))
+        self.index.build()
+
+    def expire(self):
+        self.index._built -= autocomplete.REBUILD_SECONDS + 1
+
+    def test_stale_index_is_rebuilt_once_in_background(self):
+        self.rows.append((2, 'Солярис', 3, 'Солярис'))
+        self.expire()
+        with mock.patch.object(autocomplete, '_executor') as executor:
+            self.assertEqual(self.index.search('с', 10), ['Сталкер'])
+            self.assertEqual(self.index.search('с', 10), ['Сталкер'])
+        executor.submit.assert_called_once()
+        with mock.patch.object(autocomplete, 'connections'):
+            executor.submit.call_args.args[0]()
+        self.assertEqual(self.index.search('с', 10), ['Сталкер', 'Солярис'])
+        self.assertFalse(self.index._rebuilding)
+
+    def test_changes_during_rebuild_are_kept(self):
+        def loader():
+            # Переименование приходит, когда загрузчик уже прочитал базу.
+            rows = list(self.rows)
+            self.index.update(1, 'Зеркало', 'Зеркало')
+            return iter(rows)
+
+        self.index._loader = loader
+        self.index.build()
+        self.assertEqual(self.index.search('з', 10), ['Зеркало'])
+        self.assertEqual(self.index.search('с', 10), [])
+
+    @mock.patch.object(autocomplete, 'TOP_SIZE', 2)
+    def test_short_prefix_top_follows_changes(self):
+        self.rows += [(2, 'Солярис', 3, 'Солярис'), (3, 'Сны', 1, 'Сны')]
+        self.index.build()
+        self.assertEqual(self.index.search('с', 2), ['Сталкер', 'Солярис'])
+        self.index.bump(3, 10)
+        self.assertEqual(self.index.search('с', 2), ['Сны', 'Сталкер'])
+        self.index.update(3, 'Зеркало', 'Зеркало')
+        self.assertEqual(self.index.search('с', 2), ['Сталкер', 'Солярис'])
+        self.index.bump(1, -10)
+        self.assertEqual(self.index.search('с', 2), ['Солярис', 'Сталкер'])
+        self.index.remove(2)
+        self.assertEqual(self.index.search('с', 2), ['Сталкер'])
+        self.assertEqual(self.index.search('з', 2), ['Зеркало'])
+
+    def test_change_in_other_process_triggers_rebuild(self):
+        self.index = autocomplete.PrefixIndex(lambda: iter(self.rows), 'test')
+        self.index.build()
+        self.rows.append((2, 'Солярис', 3, 'Солярис'))
+        autocomplete.invalidate('test')
+        self.index._checked -= reference.CHECK_SECONDS
+        with mock.patch.object(autocomplete, '_executor') as executor:
+            self.assertEqual(self.index.search('с', 10), ['Сталкер'])
+        with mock.patch.object(autocomplete, 'connections'):
+            executor.submit.call_args.args[0]()
+        self.assertEqual(self.index.search('с', 10), ['Сталкер', 'Солярис'])
+
+
+class ModerationTests(APITestCase):
+    """Массовое удаление отзывов и комментариев."""
+
+    databases = '__all__'
+
+    URL = '/api/v1/moderation/delete/'
+
+    def setUp(self):
+        admin = User.objects.create(
+            username='admin', email='admin@example.com', role=User.ADMIN
+        )
+        self.client.force_authenticate(admin)
+        title = Title.objects.create(name='Сталкер', year=1979)
+        self.visible = Review.objects.create(
+            title=title, author=admin, text='Спам', score=1
+        )
+        self.hidden = Review.objects.create(
+            title=title, author=User.objects.create(
+                username='author', email='author@example.com'
+            ), text='Спам', score=1, is_deleted=True,
+        )
+        Comment.objects.create(review=self.hidden, author=admin, text='Спам')
+
+    def test_hidden_reviews_are_skipped(self):
+        response = self.client.post(
+            self.URL, {'type': 'reviews', 'text': 'Спам'}, format='json'
+        )
+        self.assertEqual(response.data['reviews'], 1)
+        self.assertIsNone(sharding.find(Review, pk=self.visible.pk))
+        self.assertIsNotNone(sharding.find(Review, pk=self.hidden.pk))
+        response = self.client.post(
+            self.URL, {'type': 'comments', 'text': 'Спам'}, format='json'
+        )
+        self.assertEqual(response.data['comments'], 0)
+
+    def test_pages_are_rendered_in_background(self):
+        with mock.patch.object(hot, 'BACKGROUND', True), \
+                mock.patch.object(hot.tracker, 'hot',
+                                  return_value=[(self.visible.title_id, 9)]), \
+                mock.patch.object(hot, '_executor') as executor, \
+                mock.patch.object(hot, 'warm') as warm:
+            self.client.post(self.URL, {'type': 'reviews', 'text': 'Спам'},
+                             format='json')
+        warm.assert_not_called()
+        executor.submit.assert_called_once()
+        hot._pending.clear()
+
+
+class ProfilingTests(APITestCase):
+    """Профилирование запросов."""
+
+    URL = '/api/v1/titles/'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(profiling, 'PROFILING_DIR',
+                                    Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admin = User.objects.create(
+            username='admin', email='admin@example.com', role=User.ADMIN
+        )
+
+    def test_sampled_request_hides_profile_id(self):
+        with mock.patch.object(profiling, 'SAMPLE_RATE', 1):
+            response = self.client.get(self.URL)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(len(profiling.list_profiles()), 1)
+
+    def test_admin_gets_profile_id_without_sql_params(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin)}'
+        )
+        response = self.client.get(self.URL, {'name': 'секрет'},
+                                   HTTP_X_PROFILE='1')
+        path = profiling.artifact_path(response['X-Profile-Id'], 'sql')
+        queries = json.loads(path.read_text(encoding='utf-8'))
+        self.assertTrue(queries)
+        self.assertNotIn('секрет', json.dumps(queries, ensure_ascii=False))
+        self.assertTrue(all(isinstance(query['params'], int)
+                            for query in queries))
+        meta, = profiling.list_profiles()
+        self.assertEqual(meta['path'], self.URL)
+        speedscope = profiling.artifact_path(meta['id'], 'speedscope')
+        self.assertNotIn('name=', speedscope.read_text(encoding='utf-8'))
+
+
+class WarmupTests(TestCase):
+    """Прогрев только в процессе сервера."""
+
+    def test_management_commands_skip_warmup(self):
+        with mock.patch('api.warmup.prepare') as prepare:
+            apps.get_app_config('api').ready()
+        prepare.assert_not_called()
+
+    def test_server_application_is_warmed_up(self):
+        import api_yamdb.asgi
+
+        with mock.patch('api.warmup.prepare') as prepare:
+            importlib.reload(api_yamdb.asgi)
+        prepare.assert_called_once()
+        self.assertIsInstance(api_yamdb.asgi.application, ReviewStream)
+
+
+class SparseFieldsTests(APITestCase):
+    """Поля ответа из ?fields= и ?omit= и суженные запросы."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        category = Category.objects.create(name='Фильм', slug='movie')
+        genre = Genre.objects.create(name='Драма', slug='drama')
+        self.title = Title.objects.create(
+            name='Сталкер', year=1979, category=category,
+            description='Описание',
+        )
+        self.title.genre.add(genre)
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        Review.objects.create(title=self.title, author=author,
+                              text='Текст', score=8)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        return response.data['results'], sql
+
+    def test_titles_select_only_requested_columns(self):
+        results, sql = self.get('/api/v1/titles/', fields='id,name')
+        self.assertEqual(results, [{'id': self.title.pk, 'name': 'Сталкер'}])
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('reviews_title_genre', sql)
+        self.assertNotIn('AVG', sql.upper())
+
+    def test_omitted_fields_are_dropped(self):
+        results, sql = self.get('/api/v1/titles/', omit='description,genre')
+        self.assertEqual(
+            set(results[0]), {'id', 'name', 'year', 'rating', 'category'}
+        )
+        self.assertEqual(results[0]['rating'], 8)
+        self.assertNotIn('reviews_title_genre', sql)
+
+    def test_reviews_skip_authors_when_not_rendered(self):
+        results, sql = self.get(f'/api/v1/titles/{self.title.pk}/reviews/',
+                                fields='id,score')
+        self.assertEqual(len(results), 1)
+        self.assertEqual(set(results[0]), {'id', 'score'})
+        self.assertNotIn('"username"', sql)
+        results, sql = self.get(f'/api/v1/titles/{self.title.pk}/reviews/')
+        self.assertEqual(results[0]['author'], 'author')
+        self.assertIn('"username"', sql)
+
+
+class BatchTests(APITestCase):
+    """Пакет GET-запросов к вьюсетам."""
+
+    databases = '__all__'
+
+    URL = '/api/v1/batch/'
+
+    def setUp(self):
+        self.title = Title.objects.create(name='Сталкер', year=1979)
+
+    def run_batch(self, paths, **data):
+        response = self.client.post(self.URL, dict(data, requests=paths),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['responses']
+
+    def test_responses_follow_request_order(self):
+        responses = self.run_batch([
+            f'titles/{self.title.pk}/',
+            f'/api/v1/titles/{self.title.pk}/reviews/',
+            f'titles/{self.title.pk + 1}/',
+        ])
+        self.assertEqual([item['status'] for item in responses],
+                         [200, 200, 404])
+        self.assertEqual(responses[0]['body']['name'], 'Сталкер')
+        self.assertEqual(responses[1]['path'],
+                         f'/api/v1/titles/{self.title.pk}/reviews/')
+
+    def test_only_api_viewsets_are_allowed(self):
+        responses = self.run_batch(['batch/', '/admin/', 'missing/'])
+        self.assertEqual([item['status'] for item in responses],
+                         [400, 400, 404])
+
+    def test_subrequests_check_permissions_of_batch_user(self):
+        self.assertEqual(self.run_batch(['users/'])[0]['status'],
+                         status.HTTP_401_UNAUTHORIZED)
+        admin = User.objects.create(
+            username='admin', email='admin@example.com', role=User.ADMIN
+        )
+        self.client.force_authenticate(admin)
+        response = self.run_batch(['users/'])[0]
+        self.assertEqual(response['status'], status.HTTP_200_OK)
+        self.assertEqual(response['body']['results'][0]['username'], 'admin')
+
+    def test_parallel_keeps_order(self):
+        paths = [f'titles/?year={year}' for year in range(7)]
+        with mock.patch('api.batch.Batch.get', side_effect=lambda path: path):
+            responses = self.run_batch(paths, parallel=True)
+        self.assertEqual(responses, paths)
+
+    def test_size_is_limited(self):
+        response = self.client.post(
+            self.URL, {'requests': ['titles/'] * (batch.MAX_REQUESTS + 1)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@mock.patch.object(hot, 'BACKGROUND', False)
+class MyScoreTests(APITestCase):
+    """Оценка пользователя в ответах о тайтлах."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create(username='user',
+                                        email='user@example.com')
+        self.rated = Title.objects.create(name='Сталкер', year=1979)
+        self.other = Title.objects.create(name='Солярис', year=1972)
+        Review.objects.create(title=self.rated, author=self.user,
+                              text='Текст', score=7)
+
+    def titles(self, **params):
+        response = self.client.get('/api/v1/titles/', params)
+        return {item['id']: item for item in response.data['results']}
+
+    def test_anonymous_gets_no_personal_fields(self):
+        for item in self.titles().values():
+            self.assertNotIn('my_score', item)
+            self.assertNotIn('reviewed', item)
+
+    def test_list_and_detail_show_own_score(self):
+        self.client.force_authenticate(self.user)
+        titles = self.titles()
+        self.assertEqual(titles[self.rated.pk]['my_score'], 7)
+        self.assertTrue(titles[self.rated.pk]['reviewed'])
+        self.assertIsNone(titles[self.other.pk]['my_score'])
+        self.assertFalse(titles[self.other.pk]['reviewed'])
+        response = self.client.get(f'/api/v1/titles/{self.rated.pk}/')
+        self.assertEqual(response.data['my_score'], 7)
+
+    def test_cached_page_is_personalised(self):
+        with mock.patch.object(hot, 'tracker', hot.HotTracker(min_hits=1)):
+            hot.warm(self.rated.pk, HotPagesTests.BASE)
+            self.assertIsNotNone(
+                hot.cached('detail', self.rated.pk, HotPagesTests.BASE)
+            )
+            self.client.force_authenticate(self.user)
+            response = self.client.get(f'/api/v1/titles/{self.rated.pk}/')
+            self.assertEqual(response.data['my_score'], 7)
+            self.client.force_authenticate(None)
+            response = self.client.get(f'/api/v1/titles/{self.rated.pk}/')
+            self.assertNotIn('my_score', response.data)
+
+    def test_sparse_fields_skip_score_lookup(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch('api.views.scores_of') as scores_of:
+            titles = self.titles(fields='id,name')
+        scores_of.assert_not_called()
+        self.assertEqual(set(titles[self.rated.pk]), {'id', 'name'})
+
+
+class ReviewCommentsTests(APITestCase):
+    """Число комментариев и последние комментарии в списке отзывов."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.author = User.objects.create(username='author',
+                                          email='author@example.com')
+        self.title = Title.objects.create(name='Сталкер', year=1979)
+        self.url = f'/api/v1/titles/{self.title.pk}/reviews/'
+        reader = User.objects.create(username='reader',
+                                     email='reader@example.com')
+        self.reviews = [
+            Review.objects.create(title=self.title, author=author,
+                                  text='Текст', score=score)
+            for author, score in ((self.author, 5), (reader, 9))
+        ]
+        self.comments = [
+            Comment.objects.create(review=self.reviews[0],
+                                   author=self.author, text=f'Текст {number}')
+            for number in range(3)
+        ]
+
+    def reviews_by_id(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {item['id']: item for item in response.data['results']}
+
+    def test_comment_count_follows_writes(self):
+        reviews = self.reviews_by_id()
+        self.assertEqual(reviews[self.reviews[0].pk]['comment_count'], 3)
+        self.assertEqual(reviews[self.reviews[1].pk]['comment_count'], 0)
+        self.assertNotIn('latest_comments', reviews[self.reviews[0].pk])
+        self.comments[0].delete()
+        reviews = self.reviews_by_id()
+        self.assertEqual(reviews[self.reviews[0].pk]['comment_count'], 2)
+
+    def test_latest_comments_are_embedded(self):
+        reviews = self.reviews_by_id(include='latest_comments:2')
+        latest = reviews[self.reviews[0].pk]['latest_comments']
+        self.assertEqual([comment['text'] for comment in latest],
+                         ['Текст 2', 'Текст 1'])
+        self.assertEqual(latest[0]['author'], 'author')
+        self.assertEqual(reviews[self.reviews[1].pk]['latest_comments'], [])
+        reviews = self.reviews_by_id(include='latest_comments')
+        self.assertEqual(len(reviews[self.reviews[0].pk]['latest_comments']),
+                         settings.LATEST_COMMENTS)
+
+    def test_latest_comments_use_one_query(self):
+        shard = sharding.shard_for_title(self.title.pk)
+        with CaptureQueriesContext(connections[shard]) as queries:
+            self.reviews_by_id(include='latest_comments:2')
+        comment_queries = [query for query in queries.captured_queries
+                           if 'reviews_comment' in query['sql']]
+        self.assertEqual(len(comment_queries), 1)
+
+    def test_bad_limit_is_rejected(self):
+        response = self.client.get(self.url,
+                                   {'include': 'latest_comments:many'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FakeConnection:
+    """Соединение ASGI: сообщения клиента и тела ответа в очередях."""
+
+    def __init__(self, title_id, last_id=None):
+        headers = [(b'last-event-id', last_id.encode())] if last_id else []
+        self.scope = {
+            'type': 'http', 'method': 'GET', 'headers': headers,
+            'path': f'/api/v1/titles/{title_id}/reviews/stream/',
+        }
+        self.incoming = asyncio.Queue()
+        self.bodies = asyncio.Queue()
+        self.status = None
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        else:
+            await self.bodies.put(message['body'])
+
+    async def body(self):
+        return await asyncio.wait_for(self.bodies.get(), 1)
+
+    def disconnect(self):
+        self.incoming.put_nowait({'type': 'http.disconnect'})
+
+
+class ReviewStreamTests(TestCase):
+    """Поток событий тайтла поверх ASGI."""
+
+    def setUp(self):
+        self.title = Title.objects.create(name='Сталкер', year=1979)
+        self.channel = events.title_channel(self.title.pk)
+        self.broker = events.InMemoryBroker(queue_size=2)
+        patcher = mock.patch.object(events, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = ReviewStream(mock.AsyncMock())
+
+    async def connect(self, last_id=None):
+        connection = FakeConnection(self.title.pk, last_id)
+        task = asyncio.ensure_future(self.app(
+            connection.scope, connection.receive, connection.send
+        ))
+        self.assertTrue((await connection.body()).startswith(b'retry:'))
+        return connection, task
+
+    async def finish(self, connection, task):
+        connection.disconnect()
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(await connection.body(), b'')
+
+    async def test_heartbeat_while_idle(self):
+        with mock.patch('api.stream.HEARTBEAT_SECONDS', 0.01):
+            connection, task = await self.connect()
+            self.assertEqual(await connection.body(), b': ping\n\n')
+            await self.finish(connection, task)
+        self.assertEqual(connection.status, status.HTTP_200_OK)
+
+    async def test_events_fan_out_to_subscribers(self):
+        first, first_task = await self.connect()
+        second, second_task = await self.connect()
+        event_id = self.broker.publish(self.channel, 'review', {'id': 1})
+        for connection in (first, second):
+            body = (await connection.body()).decode()
+            self.assertIn(f'id: {event_id}\n', body)
+            self.assertIn('event: review\ndata: {"id": 1}', body)
+        await self.finish(first, first_task)
+        await self.finish(second, second_task)
+        self.assertNotIn(self.channel, self.broker._subscribers)
+
+    async def test_resume_after_last_event_id(self):
+        ids = [self.broker.publish(self.channel, 'review', {'id': number})
+               for number in range(3)]
+        connection, task = await self.connect(last_id=ids[0])
+        for event_id in ids[1:]:
+            self.assertIn(f'id: {event_id}\n',
+                          (await connection.body()).decode())
+        await self.finish(connection, task)
+        connection, task = await self.connect(last_id='other-1')
+        self.assertIn('event: reset', (await connection.body()).decode())
+        await self.finish(connection, task)
+
+    async def test_lagging_subscriber_gets_reset_and_is_closed(self):
+        connection, task = await self.connect()
+        for number in range(5):
+            self.broker.publish(self.channel, 'review', {'id': number})
+        bodies = [(await connection.body()).decode() for _ in range(3)]
+        self.assertIn('event: review', bodies[0])
+        self.assertIn('event: reset', bodies[1])
+        self.assertEqual(bodies[2], '')
+        await asyncio.wait_for(task, 1)
+        self.assertNotIn(self.channel, self.broker._subscribers)
+
+    async def test_unknown_title_is_not_found(self):
+        connection = FakeConnection(self.title.pk + 1)
+        await self.app(connection.scope, connection.receive, connection.send)
+        self.assertEqual(connection.status, status.HTTP_404_NOT_FOUND)
+        self.app.app.assert_not_called()
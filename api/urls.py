@@ -1,8 +1,11 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (CategoryViewSet, CommentViewSet, GenreViewSet,
-                    ReviewViewSet, TitleViewSet, UserViewSet, signup, token)
+from .views import (CategoryViewSet, CommentViewSet, DeletionJobViewSet,
+                    GenreViewSet, ReviewViewSet, TitleViewSet, UserViewSet,
+                    autocomplete, batch, budgets, changes, hot_titles,
+                    moderate, profile_artifact, profiles, signup, stats,
+                    token)
 
 app_name = 'api'
 
@@ -18,10 +21,21 @@ router_v1.register(
 router_v1.register('categories', CategoryViewSet, basename='сategories')
 router_v1.register('titles', TitleViewSet, basename='titles')
 router_v1.register('genres', GenreViewSet, basename='genres')
+router_v1.register('deletions', DeletionJobViewSet, basename='deletions')
 
 
 urlpatterns = [
     path('v1/auth/signup/', signup, name='signup'),
     path('v1/auth/token/', token, name='token'),
+    path('v1/autocomplete/', autocomplete, name='autocomplete'),
+    path('v1/changes/', changes, name='changes'),
+    path('v1/stats/', stats, name='stats'),
+    path('v1/moderation/delete/', moderate, name='moderate'),
+    path('v1/batch/', batch, name='batch'),
+    path('v1/budgets/', budgets, name='budgets'),
+    path('v1/hot/', hot_titles, name='hot_titles'),
+    path('v1/profiles/', profiles, name='profiles'),
+    path('v1/profiles/<str:profile_id>/<str:kind>/', profile_artifact,
+         name='profile_artifact'),
     path('v1/', include(router_v1.urls)),
 ]
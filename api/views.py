@@ -1,28 +1,49 @@
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import send_mail
-from django.db.models import Avg
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
 from django.db import IntegrityError
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, ListModelMixin
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import (SAFE_METHODS, AllowAny,
+                                        IsAuthenticated)
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import AccessToken
 
-from reviews.models import Category, Genre, Review, Title, User
-from api_yamdb.settings import EMAIL_HOST_USER
+from reviews import changelog, deletion, sharding
+from reviews.ratings import RATING, scores_of
+from reviews.models import (Category, Change, Comment, DeletionJob, Genre,
+                            Review, SimilarTitle, Title, User)
+from api_yamdb.settings import (AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT,
+                                EMAIL_HOST_USER, LATEST_COMMENTS,
+                                LATEST_COMMENTS_MAX)
+from . import (autocomplete as autocomplete_index, budget, hot, profiling,
+               provisioning, reference)
+from .batch import Batch
 from .filters import TitleFilter
-from .permissions import IsAdmin, IsAdminAuthorModeratorOrReadOnly, IsAdminOrReadOnly
+from .permissions import (IsAdmin, IsAdminAuthorModeratorOrReadOnly,
+                          IsAdminOrModerator, IsAdminOrReadOnly)
 from .serializers import (
+    requested_fields,
+    BatchSerializer,
     CategorySerializer,
+    ChangeSerializer,
+    ChangesQuerySerializer,
     CommentSerializer,
+    DeletionJobSerializer,
     GenreSerializer,
+    ModerationSerializer,
     ReviewSerializer,
     SignupSerializer,
+    SimilarTitleSerializer,
+    StatsQuerySerializer,
     TitleGETSerializer,
     TitleSerializer,
     TokenSerializer,
@@ -31,8 +52,76 @@ from .serializers import (
 )
 
 
+class SparseQuerysetMixin:
+    """Сужает запрос под поля, выбранные через ?fields= и ?omit=.
+
+    sparse_columns сопоставляет полю ответа колонки модели для only(),
+    sparse_related и sparse_prefetch — связи, которые подгружаются через
+    select_related() или prefetch_related() только для этого поля.
+    """
+    sparse_columns = {}
+    sparse_related = {}
+    sparse_prefetch = {}
+
+    def requested_fields(self):
+        return requested_fields(self.request, self.sparse_columns)
+
+    def sparse(self, queryset):
+        keep = self.requested_fields()
+        if keep is None:
+            keep = self.sparse_columns
+            columns = None
+        else:
+            columns = {'pk'}
+            for name in keep:
+                columns.update(self.sparse_columns[name])
+        related = [self.sparse_related[name] for name in keep
+                   if name in self.sparse_related]
+        if related:
+            queryset = queryset.select_related(*related)
+        prefetch = [self.sparse_prefetch[name] for name in keep
+                    if name in self.sparse_prefetch]
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset if columns is None else queryset.only(*columns)
+
+
+class ShardedViewSetMixin:
+    """Направляет запросы вложенного вьюсета в шард тайтла из URL."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with sharding.for_title(kwargs.get('title_id')):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class QueryBudgetMixin:
+    """Ограничивает время SQL-запросов чтения бюджетом маршрута.
+
+    Бюджет задаётся в QUERY_BUDGETS под именем budget_name; при его
+    превышении запрос прерывается и клиент получает 503.
+    """
+    budget_name = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with budget.limit(self.budget_name):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class DeferredDestroyMixin(DestroyModelMixin):
+    """Удаление, которое для крупных объектов уходит в фон."""
+
+    def destroy(self, request, *args, **kwargs):
+        job = deletion.delete(self.get_object())
+        if job is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(DeletionJobSerializer(job).data,
+                        status=status.HTTP_202_ACCEPTED)
+
+
 class BaseViewSet(CreateModelMixin,
-                  DestroyModelMixin,
+                  DeferredDestroyMixin,
                   ListModelMixin,
                   viewsets.GenericViewSet):
     """Базовый вьюсет категорий и классов."""
@@ -40,11 +129,38 @@ class BaseViewSet(CreateModelMixin,
     filter_backends = (SearchFilter, )
     search_fields = ('name', )
     lookup_field = 'slug'
+    reference = None
 
+    def list(self, request, *args, **kwargs):
+        """Список из кэша справочника без запросов к базе."""
+        serializer_class = self.get_serializer_class()
+        keep = requested_fields(request, serializer_class().fields)
+        objects = self.reference.visible()
+        terms = SearchFilter().get_search_terms(request)
+        if terms:
+            objects = [
+                obj for obj in objects
+                if all(term.casefold() in obj.name.casefold()
+                       for term in terms)
+            ]
+        page = self.paginate_queryset(objects)
+        if page is not None:
+            objects = page
+        data = [self.reference.render(obj.pk, serializer_class)
+                for obj in objects]
+        if keep is not None:
+            data = [{name: value for name, value in item.items()
+                     if name in keep} for item in data]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
-class UserViewSet(viewsets.ModelViewSet):
+
+class UserViewSet(QueryBudgetMixin,
+                  DeferredDestroyMixin,
+                  viewsets.ModelViewSet):
     """Получение пользователей"""
-    queryset = User.objects.all()
+    queryset = User.objects.filter(is_deleted=False)
     filter_backends = (SearchFilter,)
     search_fields = ('username',)
     permission_classes = (IsAdmin,)
@@ -52,7 +168,44 @@ class UserViewSet(viewsets.ModelViewSet):
     pagination_class = PageNumberPagination
     lookup_field = 'username'
     http_method_names = ['get', 'post', 'patch', 'delete']
+    budget_name = 'users'
+
+    @action(methods=['post'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """Массовое создание пользователей из CSV или JSON.
 
+        Принимает файл file (колонки users.csv или JSON) либо JSON-список
+        в теле запроса. Каждому созданному пользователю отправляется
+        код подтверждения.
+        """
+        upload = request.FILES.get('file')
+        if upload is not None:
+            try:
+                rows = provisioning.read_file(upload.name, upload.read())
+            except ValueError as error:
+                return Response(
+                    {'file': f'Не удалось прочитать файл: {error}'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        elif isinstance(request.data, dict):
+            rows = request.data.get('users')
+        else:
+            rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {'users': 'Передайте файл file или непустой список.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(rows) > provisioning.MAX_ROWS:
+            return Response(
+                {'users': f'Не больше {provisioning.MAX_ROWS} строк.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        report = provisioning.provision(rows)
+        return Response(report, status=(
+            status.HTTP_201_CREATED if report['created']
+            else status.HTTP_400_BAD_REQUEST
+        ))
 
     @action(
         methods=['get', 'patch', ],
@@ -122,34 +275,437 @@ def token(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def autocomplete(request):
+    """Подсказки по префиксу для строки поиска."""
+    prefix = request.query_params.get('q', '').strip()
+    kinds = autocomplete_index.PUBLIC_INDEXES
+    if (request.user.is_authenticated
+            and (request.user.is_admin or request.user.is_superuser)):
+        kinds += ('users',)
+    requested = request.query_params.get('type')
+    if requested:
+        kinds = [kind for kind in requested.split(',') if kind in kinds]
+    try:
+        limit = min(int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT)),
+                    AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        return Response({'limit': 'Должно быть целым числом.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if not prefix or limit < 1:
+        return Response({kind: [] for kind in kinds})
+    return Response(autocomplete_index.search(prefix, kinds, limit))
+
+
+def changed_objects(changes):
+    """Загружает текущее состояние изменённых объектов по типам."""
+    ids = {}
+    sharded = {}
+    for change in changes:
+        if change.action == Change.DELETE:
+            continue
+        if change.kind == Change.TITLE:
+            ids.setdefault(change.kind, set()).add(change.object_id)
+        else:
+            sharded.setdefault(change.kind, {}).setdefault(
+                sharding.shard_for_title(change.title_id), set()
+            ).add(change.object_id)
+    objects = {}
+    if Change.TITLE in ids:
+        titles = TitleViewSet.queryset.filter(pk__in=ids[Change.TITLE])
+        for title in titles:
+            objects[Change.TITLE, title.pk] = TitleGETSerializer(title).data
+    for alias, shard_ids in sharded.get(Change.REVIEW, {}).items():
+        reviews = Review.objects.using(alias).filter(
+            pk__in=shard_ids, is_deleted=False
+        ).prefetch_related('author')
+        for review in reviews:
+            objects[Change.REVIEW, review.pk] = ReviewSerializer(review).data
+    for alias, shard_ids in sharded.get(Change.COMMENT, {}).items():
+        comments = Comment.objects.using(alias).filter(
+            pk__in=shard_ids
+        ).prefetch_related('author')
+        for comment in comments:
+            objects[Change.COMMENT, comment.pk] = dict(
+                CommentSerializer(comment).data, review=comment.review_id
+            )
+    return objects
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def changes(request):
+    """Изменения тайтлов, отзывов и комментариев после курсора since.
+
+    Курсор старше границы сжатия журнала получает 410: записи об
+    удалении после него могли быть удалены, нужна полная синхронизация.
+    Записи, перед которыми ещё может зафиксироваться транзакция
+    с меньшим seq, не отдаются до её фиксации.
+    """
+    query = ChangesQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    since = query.validated_data['since']
+    limit = query.validated_data['limit']
+    horizon = changelog.horizon()
+    if 0 < since < horizon:
+        return Response(
+            {'detail': 'Курсор старше границы сжатия журнала. Выполните '
+                       'полную синхронизацию и продолжите с since=horizon.',
+             'horizon': horizon},
+            status=status.HTTP_410_GONE,
+        )
+    entries = Change.objects.filter(seq__gt=since)
+    upper = changelog.committed_upper(since)
+    if upper is not None:
+        entries = entries.filter(seq__lte=upper)
+    kinds = query.validated_data.get('type')
+    if kinds:
+        entries = entries.filter(kind__in=kinds)
+    entries = list(entries.order_by('seq')[:limit])
+    serializer = ChangeSerializer(
+        entries, many=True, context={'objects': changed_objects(entries)}
+    )
+    last_seq = entries[-1].seq if entries else since
+    next_url = None
+    if len(entries) == limit:
+        params = request.query_params.copy()
+        params['since'] = last_seq
+        next_url = request.build_absolute_uri(
+            f'{request.path}?{params.urlencode()}'
+        )
+    return Response({
+        'last_seq': last_seq,
+        'next': next_url,
+        'results': serializer.data,
+    })
+
+
+def stats_rows(snapshot, group_by):
+    """Строки статистики по колонкам снимка."""
+    if group_by == 'category_year':
+        categories, years, counts, average = (
+            snapshot.score_by_category_year()
+        )
+        slugs = {}
+        for pk in set(categories.tolist()):
+            category = reference.categories.get(pk)
+            slugs[pk] = category.slug if category else None
+        return [
+            {'category': slugs[category], 'year': year, 'count': count,
+             'avg_score': score}
+            for category, year, count, score in zip(
+                categories.tolist(), years.tolist(), counts.tolist(),
+                average.tolist()
+            )
+        ]
+    if group_by == 'month':
+        months, counts, average = snapshot.score_by_month()
+        return [
+            {'month': str(month), 'count': count, 'avg_score': score}
+            for month, count, score in zip(
+                months, counts.tolist(), average.tolist()
+            )
+        ]
+    genres, counts = snapshot.volume_by_genre()
+    rows = []
+    for pk, count in zip(genres.tolist(), counts.tolist()):
+        genre = reference.genres.get(pk)
+        rows.append({'genre': genre.slug if genre else None, 'count': count})
+    return rows
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def stats(request):
+    """Статистика оценок по снимку фактов без запросов к базе."""
+    from reviews.facts import get_snapshot
+
+    query = StatsQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    snapshot = get_snapshot()
+    return Response({
+        'updated': snapshot.meta.get('updated'),
+        'reviews': snapshot.meta['count'],
+        'results': stats_rows(snapshot, query.validated_data['group_by']),
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminOrModerator])
+def moderate(request):
+    """Массовое удаление отзывов или комментариев по id или условиям.
+
+    Права проверяются один раз на весь набор, удаление идёт пачками
+    во всех шардах или только в шарде переданного тайтла.
+    """
+    query = ModerationSerializer(data=request.data)
+    query.is_valid(raise_exception=True)
+    conditions = query.validated_data
+    # Скрытые отзывы и их комментарии уже удаляет задача удаления.
+    if conditions['type'] == 'reviews':
+        model = Review
+        queryset = Review.objects.filter(is_deleted=False)
+    else:
+        model = Comment
+        queryset = Comment.objects.filter(review__is_deleted=False)
+    if 'ids' in conditions:
+        queryset = queryset.filter(pk__in=conditions['ids'])
+    if 'title' in conditions:
+        title_path = 'title_id' if model is Review else 'review__title_id'
+        queryset = queryset.filter(**{title_path: conditions['title']})
+    if 'author' in conditions:
+        queryset = queryset.filter(author_id=conditions['author'].pk)
+    if 'since' in conditions:
+        queryset = queryset.filter(pub_date__gte=conditions['since'])
+    if 'until' in conditions:
+        queryset = queryset.filter(pub_date__lt=conditions['until'])
+    if 'text' in conditions:
+        queryset = queryset.filter(text__icontains=conditions['text'])
+    databases = None
+    if 'title' in conditions:
+        databases = [sharding.shard_for_title(conditions['title'])]
+    if conditions['dry_run']:
+        found = sum(queryset.using(alias).count()
+                    for alias in databases or sharding.SHARDS)
+        return Response({conditions['type']: found, 'dry_run': True})
+    counts = deletion.bulk_delete(queryset, databases)
+    # Страницы только помечаются устаревшими, перерисовка идёт в фоне.
+    hot.refresh_all()
+    return Response(dict(counts, dry_run=False))
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def budgets(request):
+    """Бюджеты времени запросов и число их превышений по маршрутам."""
+    return Response({
+        'budgets': budget.BUDGETS,
+        'exceeded': budget.exceeded(),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def hot_titles(request):
+    """Горячие тайтлы этого процесса и наличие их страниц в кэше."""
+    base_url = request.build_absolute_uri('/')[:-1]
+    return Response([
+        {
+            'title': title_id,
+            'hits': round(hits, 1),
+            'warm': {
+                kind: hot.cached(kind, title_id, base_url) is not None
+                for kind in hot.PAGES
+            },
+        }
+        for title_id, hits in hot.tracker.hot()
+    ])
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def profiles(request):
+    """Список сохранённых профилей запросов."""
+    return Response([
+        dict(meta, artifacts={
+            kind: request.build_absolute_uri(
+                f'{request.path}{meta["id"]}/{kind}/'
+            )
+            for kind in profiling.ARTIFACTS
+        })
+        for meta in profiling.list_profiles()
+    ])
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def profile_artifact(request, profile_id, kind):
+    """Скачивание файла профиля: speedscope, collapsed, allocations, sql."""
+    path = profiling.artifact_path(profile_id, kind)
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True,
+                        filename=f'{profile_id}-{path.name}')
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def batch(request):
+    """Несколько GET-запросов к вьюсетам API за один запрос.
+
+    Права проверяет каждый подзапрос от имени пользователя пакета.
+    """
+    query = BatchSerializer(data=request.data)
+    query.is_valid(raise_exception=True)
+    responses = Batch(request).run(
+        query.validated_data['requests'],
+        parallel=query.validated_data['parallel'],
+    )
+    return Response({'responses': responses})
+
+
+def hot_page(request, kind, title_id):
+    """Учитывает обращение к тайтлу и возвращает его страницу из кэша.
+
+    Кэш используется только для запросов без параметров; запросы,
+    которыми кэш заполняется, не учитываются.
+    """
+    if request.META.get(hot.RENDER_HEADER):
+        return None
+    try:
+        title_id = int(title_id)
+    except (TypeError, ValueError):
+        return None
+    if not hot.track(title_id) or request.query_params:
+        return None
+    return hot.page(kind, title_id, request.build_absolute_uri('/')[:-1])
+
+
+def latest_comments(review_ids, limit):
+    """Последние limit комментариев каждого отзыва: {id отзыва: данные}.
+
+    Один запрос с ROW_NUMBER() по отзывам в шарде текущего запроса
+    и один запрос за именами авторов.
+    """
+    if not review_ids:
+        return {}
+    ranked = Comment.objects.filter(review_id__in=review_ids).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('review_id')],
+            order_by=[F('pub_date').desc(), F('pk').desc()],
+        )
+    ).order_by()
+    sql, params = ranked.query.get_compiler(using=ranked.db).as_sql()
+    comments = list(Comment.objects.raw(
+        f'SELECT * FROM ({sql}) ranked WHERE position <= %s '
+        'ORDER BY review_id, position',
+        (*params, limit),
+    ).using(ranked.db))
+    prefetch_related_objects(
+        comments, Prefetch('author', queryset=User.objects.only('username'))
+    )
+    result = {}
+    for comment, data in zip(
+        comments, CommentSerializer(comments, many=True).data
+    ):
+        result.setdefault(comment.review_id, []).append(data)
+    return result
+
+
+class ReviewViewSet(QueryBudgetMixin,
+                    ShardedViewSetMixin,
+                    SparseQuerysetMixin,
+                    DeferredDestroyMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет для отзывов."""
     serializer_class = ReviewSerializer
     http_method_names = ['get', 'post', 'patch', 'delete']
+    budget_name = 'reviews'
     permission_classes = [IsAdminAuthorModeratorOrReadOnly]
+    sparse_columns = {
+        'id': (),
+        'text': ('text',),
+        'author': ('author',),
+        'score': ('score',),
+        'pub_date': ('pub_date',),
+        'comment_count': ('comment_count',),
+        'latest_comments': (),
+    }
+    sparse_prefetch = {
+        'author': Prefetch('author', queryset=User.objects.only('username'))
+    }
+
+    def get_title(self):
+        """Возвращает объект текущего тайтла."""
+        return get_object_or_404(
+            Title, id=self.kwargs.get('title_id'), is_deleted=False
+        )
 
     def get_queryset(self):
-        title = get_object_or_404(Title, id=self.kwargs.get('title_id'))
-        return title.reviews.all()
+        return self.sparse(Review.objects.filter(
+            title=self.get_title(), is_deleted=False
+        ))
 
     def perform_create(self, serializer):
-        title = get_object_or_404(Title, id=self.kwargs.get('title_id'))
-        serializer.save(author=self.request.user, title=title)
+        serializer.save(author=self.request.user, title=self.get_title())
+
+    def list(self, request, *args, **kwargs):
+        """Первая страница отзывов горячего тайтла отдаётся из кэша."""
+        data = hot_page(request, 'reviews', kwargs.get('title_id'))
+        if data is None:
+            return super().list(request, *args, **kwargs)
+        return Response(data)
+
+    def latest_comments_limit(self):
+        """Число комментариев из ?include=latest_comments:k или None."""
+        for item in self.request.query_params.get('include', '').split(','):
+            name, _, limit = item.strip().partition(':')
+            if name != 'latest_comments':
+                continue
+            if not limit:
+                return LATEST_COMMENTS
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise ValidationError(
+                    {'include': 'Число комментариев должно быть целым.'}
+                )
+            return max(min(limit, LATEST_COMMENTS_MAX), 0) or None
+        return None
+
+    def get_serializer(self, *args, **kwargs):
+        """Добавляет последние комментарии всей страницы одним запросом."""
+        if self.request.method == 'GET' and args:
+            keep = self.requested_fields()
+            limit = self.latest_comments_limit()
+            if limit and (keep is None or 'latest_comments' in keep):
+                reviews = args[0] if kwargs.get('many') else [args[0]]
+                kwargs['context'] = dict(
+                    self.get_serializer_context(),
+                    latest_comments=latest_comments(
+                        [review.pk for review in reviews], limit
+                    ),
+                )
+        return super().get_serializer(*args, **kwargs)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(QueryBudgetMixin,
+                     ShardedViewSetMixin,
+                     SparseQuerysetMixin,
+                     viewsets.ModelViewSet):
     """Вьюсет для комментариев."""
     serializer_class = CommentSerializer
     http_method_names = ['get', 'post', 'patch', 'delete']
+    budget_name = 'comments'
     permission_classes = [IsAdminAuthorModeratorOrReadOnly]
+    sparse_columns = {
+        'id': (),
+        'text': ('text',),
+        'author': ('author',),
+        'pub_date': ('pub_date',),
+    }
+    sparse_prefetch = {
+        'author': Prefetch('author', queryset=User.objects.only('username'))
+    }
 
     def get_review(self):
         """Возвращает объект текущего отзыва."""
-        review_id = self.kwargs.get('review_id')
-        return get_object_or_404(Review, pk=review_id)
+        get_object_or_404(
+            Title.objects.only('pk'),
+            pk=self.kwargs.get('title_id'),
+            is_deleted=False,
+        )
+        return get_object_or_404(
+            Review,
+            pk=self.kwargs.get('review_id'),
+            title_id=self.kwargs.get('title_id'),
+            is_deleted=False,
+        )
 
     def get_queryset(self):
-        return self.get_review().comments.all()
+        return self.sparse(Comment.objects.filter(review=self.get_review()))
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user, review=self.get_review())
@@ -157,27 +713,108 @@ class CommentViewSet(viewsets.ModelViewSet):
 
 class CategoryViewSet(BaseViewSet):
     """Вьюсет для категорий."""
-    queryset = Category.objects.all()
+    queryset = Category.objects.filter(is_deleted=False)
     serializer_class = CategorySerializer
+    reference = reference.categories
 
 
 class GenreViewSet(BaseViewSet):
     """Вьюсет для жанров."""
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    reference = reference.genres
 
 
-class TitleViewSet(viewsets.ModelViewSet):
+class TitleViewSet(QueryBudgetMixin,
+                   SparseQuerysetMixin,
+                   DeferredDestroyMixin,
+                   viewsets.ModelViewSet):
     """Вьюсет для тайтлов."""
-    queryset = Title.objects.annotate(rating=Avg('reviews__score'))
+    queryset = Title.objects.filter(is_deleted=False).annotate(
+        rating=RATING
+    ).prefetch_related(
+        Prefetch('genre', queryset=Genre.objects.only('id'))
+    ).order_by(*Title._meta.ordering)
     serializer_class = TitleSerializer
     permission_classes = (IsAdminOrReadOnly | IsAdmin,)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = TitleFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
+    budget_name = 'titles'
+    sparse_columns = {
+        'id': (),
+        'name': ('name',),
+        'year': ('year',),
+        'rating': (),
+        'description': ('description',),
+        'genre': (),
+        'category': ('category',),
+        'my_score': (),
+        'reviewed': (),
+    }
+
+    def get_queryset(self):
+        keep = self.requested_fields()
+        if keep is None:
+            return self.queryset.all()
+        queryset = Title.objects.filter(is_deleted=False)
+        if 'rating' in keep:
+            queryset = queryset.annotate(rating=RATING)
+        if 'genre' in keep:
+            queryset = queryset.prefetch_related(
+                Prefetch('genre', queryset=Genre.objects.only('id'))
+            )
+        return self.sparse(queryset.order_by(*Title._meta.ordering))
 
     def get_serializer_class(self):
         """Определяет сериализатор для обработки."""
         if self.request.method == 'GET':
             return TitleGETSerializer
         return TitleSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        """Карточка горячего тайтла отдаётся из кэша."""
+        data = hot_page(request, 'detail', kwargs.get('pk'))
+        if data is None:
+            return super().retrieve(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            title_id = data['id']
+            scores = scores_of(request.user.pk, [title_id])
+            data = dict(data, my_score=scores.get(title_id),
+                        reviewed=title_id in scores)
+        return Response(data)
+
+    def get_serializer(self, *args, **kwargs):
+        """Добавляет оценки пользователя для всей страницы одним запросом."""
+        user = self.request.user
+        if self.request.method == 'GET' and user.is_authenticated and args:
+            keep = self.requested_fields()
+            if keep is None or keep & {'my_score', 'reviewed'}:
+                titles = args[0] if kwargs.get('many') else [args[0]]
+                kwargs['context'] = dict(
+                    self.get_serializer_context(),
+                    my_scores=scores_of(
+                        user.pk, [title.pk for title in titles]
+                    ),
+                )
+        return super().get_serializer(*args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Похожие тайтлы из предрасчитанной таблицы."""
+        title = get_object_or_404(
+            Title.objects.only('pk'), pk=pk, is_deleted=False
+        )
+        neighbours = SimilarTitle.objects.filter(
+            title=title, similar__is_deleted=False
+        ).select_related('similar').only(
+            'score', 'similar__id', 'similar__name', 'similar__year'
+        ).order_by('rank')
+        return Response(SimilarTitleSerializer(neighbours, many=True).data)
+
+
+class DeletionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Вьюсет для отслеживания фонового удаления."""
+    queryset = DeletionJob.objects.all()
+    serializer_class = DeletionJobSerializer
+    permission_classes = (IsAdmin,)
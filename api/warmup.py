@@ -0,0 +1,85 @@
+import importlib
+import inspect
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from rest_framework.serializers import BaseSerializer
+
+MODULES = getattr(settings, 'WARMUP_MODULES', (
+    'rest_framework.authentication',
+    'rest_framework.pagination',
+    'rest_framework.renderers',
+    'rest_framework.parsers',
+    'rest_framework.negotiation',
+    'rest_framework.metadata',
+    'rest_framework_simplejwt.authentication',
+    'rest_framework_simplejwt.tokens',
+    'django_filters.rest_framework',
+    'api.urls',
+    'api.views',
+    'api.serializers',
+    'api.filters',
+))
+INDEXES = getattr(settings, 'WARMUP_INDEXES',
+                  ('titles', 'genres', 'categories', 'users'))
+
+
+def import_modules():
+    """Импортирует модули, которые иначе загрузятся на первом запросе."""
+    for name in MODULES:
+        importlib.import_module(name)
+
+
+def build_urls():
+    """Компилирует шаблоны адресов и таблицу для reverse()."""
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return len(resolver.url_patterns)
+
+
+def build_serializers():
+    """Строит поля всех сериализаторов API."""
+    from api import serializers
+
+    built = 0
+    for _, serializer_class in inspect.getmembers(serializers,
+                                                 inspect.isclass):
+        if (not issubclass(serializer_class, BaseSerializer)
+                or serializer_class.__module__ != serializers.__name__):
+            continue
+        serializer_class(context={}).fields
+        built += 1
+    return built
+
+
+def prepare():
+    """Подготовка без обращений к базе данных.
+
+    Выполняется при загрузке приложения сервера в asgi.py и wsgi.py, а не
+    в ready(), чтобы не замедлять команды управления. При preload_app
+    её результат наследуют все рабочие процессы.
+    """
+    import_modules()
+    build_urls()
+    build_serializers()
+
+
+def open_connections():
+    """Открывает соединения с базами данных заранее."""
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+
+def load_data():
+    """Загружает справочники и индексы автодополнения в процесс.
+
+    При preload_app вызывается в главном процессе gunicorn до fork,
+    поэтому рабочие процессы получают данные готовыми.
+    """
+    from api import autocomplete, reference
+
+    reference.genres.load()
+    reference.categories.load()
+    for name in INDEXES:
+        autocomplete.INDEXES[name].build()
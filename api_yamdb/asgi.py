@@ -1,7 +1,16 @@
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_yamdb.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.stream import ReviewStream  # noqa: E402
+from api.warmup import prepare  # noqa: E402
+
+if settings.WARMUP:
+    prepare()
+
+application = ReviewStream(django_application)
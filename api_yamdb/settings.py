@@ -34,6 +34,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,6 +64,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'django_cache'),
+        # С запасом под страницы горячих тайтлов и их версии.
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 100000)),
+        },
     }
 }
 
@@ -130,3 +145,116 @@ SLUG_LENGTH = 50
 USERNAME_LENGTH = 150
 
 EMAIL_LENGTH = 254
+
+DELETION_CHUNK_SIZE = 1000
+
+DELETION_SYNC_LIMIT = 1000
+
+DELETION_BACKGROUND = True
+
+DELETION_STALE_SECONDS = 600
+
+AUTOCOMPLETE_LIMIT = 10
+
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+AUTOCOMPLETE_REBUILD_SECONDS = 300
+
+AUTOCOMPLETE_BACKGROUND = True
+
+REFERENCE_CACHE_CHECK_SECONDS = 1
+
+CHANGES_LIMIT = 100
+
+CHANGES_MAX_LIMIT = 1000
+
+CHANGES_RETENTION_DAYS = 30
+
+CHANGES_SAFETY_SECONDS = 5
+
+EVENTS_BROKER = 'api.events.InMemoryBroker'
+
+EVENTS_HISTORY = 100
+
+EVENTS_QUEUE_SIZE = 100
+
+EVENTS_HEARTBEAT_SECONDS = 15
+
+ADMIN_COUNT_CAP = 10000
+
+FACTS_DIR = BASE_DIR / 'facts'
+
+WARMUP = True
+
+STARTUP_URL = '/api/v1/titles/'
+
+REVIEW_SHARDS = ['default'] + [
+    f'shard{number}'
+    for number in range(1, int(os.environ.get('REVIEW_SHARD_COUNT', 1)))
+]
+
+for alias in REVIEW_SHARDS[1:]:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db_{alias}.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    }
+
+DATABASE_ROUTERS = ['reviews.routers.ShardRouter']
+
+REVIEW_SHARD_VNODES = 64
+
+REVIEW_SHARD_ID_BLOCK = 100
+
+MODERATION_MAX_IDS = 1000
+
+IMPORT_STATE_DIR = BASE_DIR / 'import_state'
+
+IMPORT_CHUNK_SIZE = 1000
+
+PROFILING_DIR = BASE_DIR / 'profiles'
+
+PROFILING_SAMPLE_RATE = 0
+
+PROFILING_INTERVAL = 0.001
+
+PROFILING_KEEP = 100
+
+SNAPSHOT_DIR = BASE_DIR / 'snapshot'
+
+SNAPSHOT_BASE_URL = 'http://localhost'
+
+SNAPSHOT_TITLE_PAGES = 5
+
+BATCH_MAX_REQUESTS = 20
+
+BATCH_WORKERS = 4
+
+LATEST_COMMENTS = 2
+
+LATEST_COMMENTS_MAX = 10
+
+PROVISION_CHUNK_SIZE = 1000
+
+PROVISION_MAX_ROWS = 10000
+
+QUERY_BUDGETS = {
+    'titles': 1.0,
+    'users': 1.0,
+    'reviews': 1.0,
+    'comments': 1.0,
+}
+
+QUERY_BUDGET_PROGRESS_STEPS = 1000
+
+HOT_TITLES = 100
+
+HOT_MIN_HITS = 5
+
+HOT_SKETCH_WIDTH = 2048
+
+HOT_SKETCH_DEPTH = 4
+
+HOT_DECAY_SECONDS = 300
+
+HOT_CACHE_TIMEOUT = 3600
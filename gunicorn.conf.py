@@ -0,0 +1,32 @@
+"""Настройки gunicorn: приложение загружается один раз до fork.
+
+Рабочие процессы uvicorn обслуживают ASGI-приложение, поэтому вместе
+с API работает поток отзывов по SSE.
+"""
+import multiprocessing
+
+wsgi_app = 'api_yamdb.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+workers = multiprocessing.cpu_count() * 2 + 1
+
+
+def when_ready(server):
+    from django.db import connections
+
+    from api.warmup import load_data
+
+    load_data()
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    from asgiref.sync import SyncToAsync
+    from django.db import connections
+
+    from api.warmup import open_connections
+
+    connections.close_all()
+    # Синхронный код Django под ASGI выполняется в одном потоке asgiref,
+    # а соединения с базой у каждого потока свои.
+    SyncToAsync.single_thread_executor.submit(open_connections)
@@ -1,24 +1,213 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.functional import cached_property
 
-from reviews.models import Comment, Genre, Review, Title, User
+from reviews import deletion, sharding
+from reviews.models import Category, Comment, Genre, Review, Title, User
 
+COUNT_CAP = getattr(settings, 'ADMIN_COUNT_CAP', 10000)
 
-class UserAdmin(admin.ModelAdmin):
 
-    list_display = ('username', )
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который не считает все строки большой таблицы.
 
+    Без фильтров берёт оценку из статистики PostgreSQL, иначе считает
+    строки не дальше COUNT_CAP.
+    """
 
-class TitleAdmin(admin.ModelAdmin):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > COUNT_CAP:
+                return int(row[0])
+        return queryset[:COUNT_CAP].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Базовая админка для таблиц с миллионами строк."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class CascadeDeleteAdmin(admin.ModelAdmin):
+    """Удаляет объекты вместе с записями в шардах через reviews.deletion."""
+
+    def delete_model(self, request, obj):
+        deletion.delete(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            deletion.delete(obj)
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Выбор шарда: список в админке показывает одну базу за раз."""
+
+    title = 'шард'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.SHARDS]
+
+    def queryset(self, request, queryset):
+        return queryset
+
+    def choices(self, changelist):
+        current = self.value() or sharding.SHARDS[0]
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': current == alias,
+                'query_string': changelist.get_query_string(
+                    {self.parameter_name: alias}
+                ),
+                'display': title,
+            }
+
+
+class ShardedAdmin(LargeTableAdmin):
+    """Админка моделей, которые лежат в шардах.
+
+    Список и форма работают с шардом из параметра shard, объект при
+    редактировании ищется во всех шардах. Поиск по автору и тайтлу
+    сначала находит их id в основной базе.
+    """
+
+    def request_shard(self, request):
+        alias = request.GET.get('shard')
+        if alias is None:
+            alias = QueryDict(
+                request.GET.get('_changelist_filters', '')
+            ).get('shard')
+        return alias if alias in sharding.SHARDS else sharding.SHARDS[0]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(
+            self.request_shard(request)
+        )
+
+    def get_object(self, request, object_id, from_field=None):
+        queryset = self.get_queryset(request)
+        model = queryset.model
+        field = (model._meta.pk if from_field is None
+                 else model._meta.get_field(from_field))
+        try:
+            object_id = field.to_python(object_id)
+        except ValidationError:
+            return None
+        for alias in sharding.SHARDS:
+            obj = queryset.using(alias).filter(
+                **{field.name: object_id}
+            ).first()
+            if obj is not None:
+                return obj
+        return None
+
+    def changeform_view(self, request, object_id=None, form_url='',
+                        extra_context=None):
+        alias = self.request_shard(request)
+        if object_id is not None:
+            obj = self.get_object(request, object_id)
+            if obj is not None:
+                alias = obj._state.db
+        with sharding.use_shard(alias):
+            return super().changeform_view(
+                request, object_id, form_url, extra_context
+            )
+
+    def delete_view(self, request, object_id, extra_context=None):
+        obj = self.get_object(request, object_id)
+        alias = obj._state.db if obj is not None else sharding.SHARDS[0]
+        with sharding.use_shard(alias):
+            return super().delete_view(request, object_id, extra_context)
+
+    def changelist_view(self, request, extra_context=None):
+        with sharding.use_shard(self.request_shard(request)):
+            return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        terms = search_term.split()
+        if not terms:
+            return queryset, False
+        for term in terms:
+            condition = Q(author_id__in=list(
+                User.objects.filter(username=term).values_list(
+                    'pk', flat=True
+                )
+            ))
+            if 'title' in self.search_fields:
+                condition |= Q(title_id__in=list(
+                    Title.objects.filter(name__istartswith=term).values_list(
+                        'pk', flat=True
+                    )[:COUNT_CAP]
+                ))
+            queryset = queryset.filter(condition)
+        return queryset, False
+
+
+class UserAdmin(CascadeDeleteAdmin, LargeTableAdmin):
+
+    list_display = ('username', 'email', 'role')
+    list_filter = ('role', 'is_deleted')
+    search_fields = ('^username', '^email')
+    filter_horizontal = ('groups', 'user_permissions')
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name == 'user_permissions':
+            permission = db_field.remote_field.model
+            kwargs['queryset'] = permission.objects.select_related(
+                'content_type'
+            )
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class CategoryAdmin(admin.ModelAdmin):
+
+    list_display = ('id', 'name', 'slug')
+    search_fields = ('^name', '^slug')
+
+
+class TitleAdmin(CascadeDeleteAdmin, LargeTableAdmin):
 
     list_display = ('name', 'year', 'category')
+    list_select_related = ('category',)
+    list_filter = ('year', 'category', 'is_deleted')
+    search_fields = ('^name',)
+    autocomplete_fields = ('category', 'genre')
 
 
 class GenreAdmin(admin.ModelAdmin):
 
     list_display = ('id', 'name', 'slug')
+    search_fields = ('^name', '^slug')
+
+
+class ReviewAdmin(CascadeDeleteAdmin, ShardedAdmin):
 
+    list_display = ('id', 'title', 'author', 'score', 'pub_date')
+    list_select_related = ()
+    list_filter = (ShardFilter, 'is_deleted')
+    search_fields = ('author', 'title')
+    raw_id_fields = ('title', 'author')
 
-class ReviewAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            'title', 'author'
+        )
 
     def get_changeform_initial_data(self, request):
         get_data = super(
@@ -27,8 +216,21 @@ class ReviewAdmin(admin.ModelAdmin):
         return get_data
 
 
+class CommentAdmin(ShardedAdmin):
+
+    list_display = ('id', 'review', 'author', 'pub_date')
+    list_select_related = ('review',)
+    list_filter = (ShardFilter,)
+    search_fields = ('author',)
+    raw_id_fields = ('review', 'author')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('author')
+
+
 admin.site.register(Review, ReviewAdmin)
 admin.site.register(Title, TitleAdmin)
 admin.site.register(User, UserAdmin)
+admin.site.register(Category, CategoryAdmin)
 admin.site.register(Genre, GenreAdmin)
-admin.site.register(Comment)
+admin.site.register(Comment, CommentAdmin)
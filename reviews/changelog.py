@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.dispatch import Signal
+from django.utils import timezone
+
+from reviews.models import Change, ChangeCompaction, Comment, Review, Title
+
+SAFETY_SECONDS = getattr(settings, 'CHANGES_SAFETY_SECONDS', 5)
+
+# Отправляется после записей пачками, которые проходят мимо сигналов
+# моделей; title_ids — id затронутых тайтлов.
+titles_changed = Signal()
+
+KINDS = {
+    Title: Change.TITLE,
+    Review: Change.REVIEW,
+    Comment: Change.COMMENT,
+}
+
+TITLE_PATHS = {
+    Title: 'pk',
+    Review: 'title_id',
+    Comment: 'review__title_id',
+}
+
+
+def title_id_of(instance):
+    """Возвращает id тайтла, к которому относится объект."""
+    if isinstance(instance, Title):
+        return instance.pk
+    if isinstance(instance, Review):
+        return instance.title_id
+    if Comment.review.is_cached(instance):
+        return instance.review.title_id
+    return Review._base_manager.using(instance._state.db).filter(
+        pk=instance.review_id
+    ).values_list('title_id', flat=True).first()
+
+
+def record(instance, action):
+    """Записывает изменение одного объекта в журнал."""
+    return Change.objects.create(
+        kind=KINDS[type(instance)],
+        object_id=instance.pk,
+        title_id=title_id_of(instance),
+        action=action,
+    )
+
+
+def record_many(model, rows, action):
+    """Записывает изменения пачки объектов и сообщает о них titles_changed.
+
+    rows — пары (id объекта, id тайтла).
+    """
+    rows = list(rows)
+    Change.objects.bulk_create(
+        Change(kind=KINDS[model], object_id=pk, title_id=title_id,
+               action=action)
+        for pk, title_id in rows
+    )
+    titles_changed.send(
+        sender=model, title_ids={title_id for _, title_id in rows}
+    )
+
+
+def horizon():
+    """Граница сжатия журнала: курсоры меньше неё устарели."""
+    return ChangeCompaction.objects.aggregate(Max('seq'))['seq__max'] or 0
+
+
+def committed_upper(since):
+    """Последний seq перед незафиксированным пропуском или None.
+
+    seq выдаётся при вставке, а транзакции фиксируются в своём порядке:
+    запись с меньшим seq может появиться позже записи с большим. Пропуск
+    в нумерации перед записью моложе SAFETY_SECONDS считается такой
+    незафиксированной транзакцией, и чтение останавливается перед ним.
+    Старые пропуски — откаты и сжатие журнала — чтение не задерживают.
+    """
+    recent = list(Change.objects.filter(
+        seq__gt=since,
+        created__gte=timezone.now() - timedelta(seconds=SAFETY_SECONDS),
+    ).order_by('seq').values_list('seq', flat=True))
+    if not recent:
+        return None
+    present = set(recent) | set(Change.objects.filter(
+        seq__in=[seq - 1 for seq in recent]
+    ).values_list('seq', flat=True))
+    for seq in recent:
+        if seq - 1 > since and seq - 1 not in present:
+            return seq - 2
+    return None
+
+
+def read_upper(since):
+    """Последний seq, до которого журнал можно читать после since."""
+    upper = committed_upper(since)
+    if upper is not None:
+        return upper
+    last = Change.objects.order_by('-seq').values_list('seq', flat=True)
+    return last.first() or since
@@ -0,0 +1,28 @@
+from django.db.models import Count, F
+
+from reviews.models import Comment, Review
+
+
+def add_comments(review_id, count, using):
+    """Меняет число комментариев отзыва в базе using."""
+    Review._base_manager.using(using).filter(pk=review_id).update(
+        comment_count=F('comment_count') + count
+    )
+
+
+def recount_comments(review_ids, using):
+    """Пересчитывает число комментариев отзывов по таблице комментариев."""
+    review_ids = set(review_ids)
+    if not review_ids:
+        return
+    counts = dict(Comment.objects.using(using).filter(
+        review_id__in=review_ids
+    ).values('review_id').annotate(count=Count('pk')).values_list(
+        'review_id', 'count'
+    ).order_by())
+    Review._base_manager.using(using).bulk_update(
+        [Review(id=pk, comment_count=counts.get(pk, 0))
+         for pk in review_ids],
+        ('comment_count',),
+        batch_size=500,
+    )
@@ -0,0 +1,307 @@
+import contextvars
+import logging
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from reviews import changelog, counters, ratings, sharding
+from reviews.models import (Category, Change, Comment, DeletionJob, Review,
+                            SimilarTitle, Title, User)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = getattr(settings, 'DELETION_CHUNK_SIZE', 1000)
+SYNC_LIMIT = getattr(settings, 'DELETION_SYNC_LIMIT', 1000)
+BACKGROUND = getattr(settings, 'DELETION_BACKGROUND', True)
+STALE_SECONDS = getattr(settings, 'DELETION_STALE_SECONDS', 600)
+
+_purging = contextvars.ContextVar('deletion_purging', default=False)
+
+
+def _title_steps(pk):
+    return (
+        (Comment.objects.filter(review__title_id=pk), None),
+        (Review.objects.filter(title_id=pk), None),
+        (Title.genre.through.objects.filter(title_id=pk), None),
+        (SimilarTitle.objects.filter(title_id=pk), None),
+        (SimilarTitle.objects.filter(similar_id=pk), None),
+    )
+
+
+def _review_steps(pk):
+    return (
+        (Comment.objects.filter(review_id=pk), None),
+    )
+
+
+def _user_steps(pk):
+    return (
+        (Comment.objects.filter(author_id=pk), None),
+        # Свои комментарии к своим отзывам уже удалены шагом выше,
+        # и в count_dependents они не должны считаться дважды.
+        (Comment.objects.filter(review__author_id=pk).exclude(
+            author_id=pk
+        ), None),
+        (Review.objects.filter(author_id=pk), None),
+    )
+
+
+def _category_steps(pk):
+    return (
+        (Title.objects.filter(category_id=pk), {'category': None}),
+    )
+
+
+PLANS = {
+    'title': (Title, _title_steps),
+    'review': (Review, _review_steps),
+    'user': (User, _user_steps),
+    'category': (Category, _category_steps),
+}
+
+
+def _plan_name(obj):
+    name = obj._meta.model_name
+    return name if name in PLANS else None
+
+
+def _databases(queryset):
+    """Базы, в которых нужно выполнить шаг удаления."""
+    if sharding.is_sharded(queryset.model):
+        return sharding.SHARDS
+    return [queryset.db]
+
+
+def count_dependents(obj):
+    """Считает зависимые записи, которые затронет удаление."""
+    _, steps = PLANS[_plan_name(obj)]
+    return sum(
+        queryset.using(alias).count()
+        for queryset, _ in steps(obj.pk)
+        for alias in _databases(queryset)
+    )
+
+
+def _process_step(job, queryset, values):
+    """Удаляет или обновляет записи пачками по первичному ключу.
+
+    Отзывы и комментарии обрабатываются в каждом шарде; после удаления
+    отзывов пересчитываются оценки их тайтлов, после удаления
+    комментариев — число комментариев их отзывов.
+    """
+    for alias in _databases(queryset):
+        _process_database(job, queryset.using(alias), values)
+
+
+def _process_database(job, queryset, values, cascade=None):
+    """Обрабатывает записи одной базы, возвращает их число.
+
+    cascade(база, ids) вызывается перед удалением каждой пачки.
+    """
+    model = queryset.model
+    title_path = changelog.TITLE_PATHS.get(model)
+    queryset = queryset.order_by('pk')
+    processed = 0
+    last = None
+    while True:
+        pending = queryset if last is None else queryset.filter(pk__gt=last)
+        if title_path is None:
+            rows = None
+            ids = list(pending.values_list('pk', flat=True)[:CHUNK_SIZE])
+        else:
+            rows = list(pending.values_list('pk', title_path)[:CHUNK_SIZE])
+            ids = [pk for pk, _ in rows]
+        if not ids:
+            return processed
+        last = ids[-1]
+        if cascade is not None:
+            cascade(queryset.db, ids)
+        chunk = model._base_manager.using(queryset.db).filter(pk__in=ids)
+        if model is Comment and values is None:
+            review_ids = set(chunk.values_list('review_id', flat=True))
+        with transaction.atomic(using=queryset.db):
+            if values is None:
+                chunk._raw_delete(chunk.db)
+            else:
+                chunk.update(**values)
+        if rows is not None:
+            changelog.record_many(
+                model, rows,
+                Change.DELETE if values is None else Change.UPDATE
+            )
+        if model is Review:
+            ratings.recount(title_id for _, title_id in rows)
+        if model is Comment and values is None:
+            counters.recount_comments(review_ids, queryset.db)
+        processed += len(ids)
+        if job is not None:
+            job.processed += len(ids)
+            job.save(update_fields=('processed', 'updated'))
+
+
+def bulk_delete(queryset, databases=None):
+    """Удаляет отзывы или комментарии запроса пачками во всех шардах.
+
+    Комментарии удаляемых отзывов удаляются вместе с ними, оценки
+    тайтлов пересчитываются. Возвращает число удалённых объектов.
+    """
+    counts = {'reviews': 0, 'comments': 0}
+
+    def delete_comments(alias, ids):
+        counts['comments'] += _process_database(
+            None, Comment.objects.using(alias).filter(review_id__in=ids), None
+        )
+
+    for alias in databases or _databases(queryset):
+        if queryset.model is Review:
+            counts['reviews'] += _process_database(
+                None, queryset.using(alias), None, delete_comments
+            )
+        else:
+            counts['comments'] += _process_database(
+                None, queryset.using(alias), None
+            )
+    return counts
+
+
+@contextmanager
+def _atomic():
+    """Транзакция в основной базе и во всех шардах.
+
+    Каждая база откатывается целиком при ошибке; общей двухфазной
+    фиксации между базами нет.
+    """
+    with ExitStack() as stack:
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *sharding.SHARDS]):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def _purge(model, pk, steps, job=None):
+    for queryset, values in steps(pk):
+        _process_step(job, queryset, values)
+    manager = model._base_manager
+    token = _purging.set(True)
+    try:
+        for alias in (sharding.SHARDS if sharding.is_sharded(model)
+                      else [manager.db]):
+            manager.using(alias).filter(pk=pk).delete()
+    finally:
+        _purging.reset(token)
+
+
+def delete_dependents(obj):
+    """Удаляет зависимые записи объекта, которого удаляют напрямую.
+
+    Вызывается перед obj.delete(), когда отзывы и комментарии лежат
+    в других базах и каскад базы данных до них не доходит. Внутри
+    reviews.deletion зависимые записи уже удалены.
+    """
+    name = _plan_name(obj)
+    if name is None or _purging.get():
+        return
+    _, steps = PLANS[name]
+    for queryset, values in steps(obj.pk):
+        _process_step(None, queryset, values)
+
+
+def claim(job):
+    """Переводит задачу в RUNNING, если её никто не выполняет.
+
+    Условный UPDATE по статусу не даёт двум потокам или процессам взять
+    одну задачу. Задача в RUNNING без продвижения дольше STALE_SECONDS
+    считается брошенной, например после падения процесса.
+    """
+    now = timezone.now()
+    claimed = DeletionJob.objects.filter(
+        Q(status__in=(DeletionJob.PENDING, DeletionJob.FAILED))
+        | Q(status=DeletionJob.RUNNING,
+            updated__lt=now - timedelta(seconds=STALE_SECONDS)),
+        pk=job.pk,
+    ).update(status=DeletionJob.RUNNING, error='', updated=now)
+    if claimed:
+        job.status = DeletionJob.RUNNING
+        job.error = ''
+        job.updated = now
+    return bool(claimed)
+
+
+def run(job):
+    """Выполняет задачу удаления до конца.
+
+    Возвращает задачу либо None, если её уже выполняет другой поток.
+    При любой ошибке задача помечается FAILED, ошибка пробрасывается.
+    """
+    if not claim(job):
+        return None
+    model, steps = PLANS[job.model]
+    try:
+        _purge(model, job.object_id, steps, job)
+    except Exception as error:
+        job.status = DeletionJob.FAILED
+        job.error = str(error) or type(error).__name__
+        job.save(update_fields=('status', 'error', 'updated'))
+        raise
+    job.status = DeletionJob.DONE
+    job.finished = timezone.now()
+    job.save(update_fields=('status', 'finished', 'updated'))
+    return job
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run(DeletionJob.objects.get(pk=job_id))
+    except Exception:
+        logger.exception('Ошибка фонового удаления, задача %s', job_id)
+    finally:
+        close_old_connections()
+
+
+def start(job):
+    """Запускает задачу в фоновом потоке после коммита транзакции."""
+    if not BACKGROUND:
+        return
+    transaction.on_commit(lambda: threading.Thread(
+        target=_run_in_thread, args=(job.pk,), daemon=True
+    ).start())
+
+
+def schedule(obj, total=0):
+    """Скрывает объект и ставит удаление зависимых записей в очередь."""
+    name = _plan_name(obj)
+    with transaction.atomic():
+        obj.is_deleted = True
+        fields = ['is_deleted']
+        if name == 'user':
+            obj.is_active = False
+            fields.append('is_active')
+        obj.save(update_fields=fields)
+        job = DeletionJob.objects.create(
+            model=name, object_id=obj.pk, total=total
+        )
+        start(job)
+    return job
+
+
+def delete(obj):
+    """Удаляет объект сразу или в фоне, если зависимых записей много.
+
+    Возвращает задачу удаления либо None, если объект уже удалён.
+    """
+    name = _plan_name(obj)
+    if name is None:
+        obj.delete()
+        return None
+    total = count_dependents(obj)
+    if total <= SYNC_LIMIT:
+        model, steps = PLANS[name]
+        with _atomic():
+            _purge(model, obj.pk, steps)
+        return None
+    return schedule(obj, total)
@@ -0,0 +1,329 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from reviews import changelog, sharding
+from reviews.models import Change, Review, Title
+
+FACTS_DIR = Path(getattr(settings, 'FACTS_DIR', 'facts'))
+EXPORT_CHUNK = 100000
+ID_CHUNK = 500
+
+COLUMNS = {
+    'review_id': np.int64,
+    'title_id': np.int64,
+    'category_id': np.int64,
+    'year': np.int16,
+    'score': np.int8,
+    'pub_date': np.int64,
+    'author_id': np.int64,
+}
+FIELDS = ('id', 'title_id', 'score', 'pub_date', 'author_id')
+GENRE_COLUMNS = ('genre_title', 'genre_genre')
+NO_CATEGORY = -1
+
+
+def _column_path(name):
+    return FACTS_DIR / f'{name}.bin'
+
+
+def _meta_path():
+    return FACTS_DIR / 'meta.json'
+
+
+def read_meta():
+    try:
+        with open(_meta_path()) as meta:
+            return json.load(meta)
+    except FileNotFoundError:
+        return {'count': 0, 'seq': 0}
+
+
+def _write_atomic(path, write):
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'wb') as target:
+        write(target)
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(temporary, path)
+
+
+def _write_meta(meta):
+    _write_atomic(
+        _meta_path(), lambda target: target.write(json.dumps(meta).encode())
+    )
+
+
+def _to_columns(rows):
+    titles = {
+        pk: (NO_CATEGORY if category is None else category, year)
+        for pk, category, year in Title.objects.filter(
+            pk__in={row[1] for row in rows}
+        ).values_list('pk', 'category_id', 'year').order_by()
+    }
+    data = np.array(
+        [(pk, title, *titles.get(title, (NO_CATEGORY, 0)),
+          score, int(pub_date.timestamp()), author)
+         for pk, title, score, pub_date, author in rows],
+        dtype=np.int64,
+    ).reshape(-1, len(COLUMNS))
+    return {
+        name: data[:, position].astype(dtype)
+        for position, (name, dtype) in enumerate(COLUMNS.items())
+    }
+
+
+def _export_genres():
+    links = np.array(
+        Title.genre.through.objects.values_list('title_id', 'genre_id'),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    for position, name in enumerate(GENRE_COLUMNS):
+        column = np.ascontiguousarray(links[:, position])
+        _write_atomic(_column_path(name),
+                      lambda target: target.write(column.tobytes()))
+
+
+def export(full=False):
+    """Обновляет колонки по журналу изменений после курсора meta.json.
+
+    Новые отзывы дописываются в конец файлов. Если изменены или удалены
+    уже выгруженные отзывы либо их тайтлы, их строки убираются и
+    выгружаются заново. Без курсора или с курсором за границей сжатия
+    журнала всё выгружается заново. Возвращает число выгруженных строк.
+    """
+    FACTS_DIR.mkdir(parents=True, exist_ok=True)
+    meta = read_meta()
+    if (full or not meta['count'] or 'seq' not in meta
+            or meta['seq'] < changelog.horizon()):
+        return _export_all()
+    since = meta['seq']
+    upper = changelog.read_upper(since)
+    review_ids, title_ids = set(), set()
+    changes = Change.objects.filter(
+        seq__gt=since, seq__lte=upper, kind__in=(Change.TITLE, Change.REVIEW)
+    ).values_list('kind', 'object_id', 'title_id')
+    for kind, object_id, title_id in changes.order_by().iterator():
+        if kind == Change.TITLE:
+            title_ids.add(title_id)
+        else:
+            review_ids.add(object_id)
+    rows = _changed_reviews(review_ids, title_ids)
+    keep = _unchanged(meta['count'], review_ids, title_ids)
+    if keep is None:
+        _append_columns(meta, rows)
+    else:
+        _rewrite_columns(meta, keep, rows)
+    meta['seq'] = upper
+    _export_genres()
+    meta['updated'] = timezone.now().isoformat()
+    _write_meta(meta)
+    return len(rows)
+
+
+def _export_all():
+    """Выгружает все отзывы из всех шардов заново."""
+    meta = {'count': 0, 'seq': changelog.read_upper(0)}
+    files = {}
+    for name, dtype in COLUMNS.items():
+        files[name] = open(_column_path(name), 'ab')
+        files[name].truncate(0)
+    added = 0
+    try:
+        for alias in sharding.SHARDS:
+            reviews = Review.objects.using(alias).filter(
+                is_deleted=False
+            ).order_by('id').values_list(*FIELDS)
+            chunk = []
+            for row in reviews.iterator(chunk_size=EXPORT_CHUNK):
+                chunk.append(row)
+                if len(chunk) == EXPORT_CHUNK:
+                    added += _append(files, chunk, meta)
+                    chunk = []
+            if chunk:
+                added += _append(files, chunk, meta)
+        for column in files.values():
+            column.flush()
+            os.fsync(column.fileno())
+    finally:
+        for column in files.values():
+            column.close()
+    _export_genres()
+    meta['updated'] = timezone.now().isoformat()
+    _write_meta(meta)
+    return added
+
+
+def _changed_reviews(review_ids, title_ids):
+    """Текущие строки изменённых отзывов и отзывов изменённых тайтлов."""
+    rows = {}
+    for alias in sharding.SHARDS:
+        reviews = Review.objects.using(alias).filter(is_deleted=False)
+        for lookup, ids in (('id__in', review_ids),
+                            ('title_id__in', title_ids)):
+            ids = sorted(ids)
+            for start in range(0, len(ids), ID_CHUNK):
+                chunk = reviews.filter(
+                    **{lookup: ids[start:start + ID_CHUNK]}
+                ).values_list(*FIELDS).order_by()
+                rows.update((row[0], row) for row in chunk)
+    return [rows[pk] for pk in sorted(rows)]
+
+
+def _unchanged(count, review_ids, title_ids):
+    """Маска строк, которые не нужно выгружать заново, или None.
+
+    None означает, что ни одна выгруженная строка не изменилась.
+    """
+    if not count or not (review_ids or title_ids):
+        return None
+    reviews = np.fromfile(_column_path('review_id'), dtype=np.int64,
+                          count=count)
+    titles = np.fromfile(_column_path('title_id'), dtype=np.int64,
+                         count=count)
+    changed = np.isin(reviews, list(review_ids)) | np.isin(
+        titles, list(title_ids)
+    )
+    return ~changed if changed.any() else None
+
+
+def _append_columns(meta, rows):
+    files = {}
+    for name, dtype in COLUMNS.items():
+        files[name] = open(_column_path(name), 'ab')
+        files[name].truncate(meta['count'] * np.dtype(dtype).itemsize)
+    try:
+        for start in range(0, len(rows), EXPORT_CHUNK):
+            _append(files, rows[start:start + EXPORT_CHUNK], meta)
+        for column in files.values():
+            column.flush()
+            os.fsync(column.fileno())
+    finally:
+        for column in files.values():
+            column.close()
+
+
+def _rewrite_columns(meta, keep, rows):
+    """Переписывает колонки без изменённых строк и с их новыми версиями.
+
+    Пока файлы подменяются, meta.json говорит, что строк нет, поэтому
+    сбой посередине приводит к полной выгрузке, а не к колонкам разной
+    длины.
+    """
+    fresh = _to_columns(rows) if rows else None
+    temporary = {}
+    for name, dtype in COLUMNS.items():
+        path = _column_path(name)
+        values = np.fromfile(path, dtype=dtype, count=meta['count'])[keep]
+        if fresh is not None:
+            values = np.concatenate((values, fresh[name]))
+        temporary[name] = path.with_name(path.name + '.tmp')
+        with open(temporary[name], 'wb') as target:
+            target.write(values.tobytes())
+            target.flush()
+            os.fsync(target.fileno())
+    _write_meta({'count': 0})
+    for name, path in temporary.items():
+        os.replace(path, _column_path(name))
+    meta['count'] = int(keep.sum()) + len(rows)
+
+
+def _append(files, rows, meta):
+    columns = _to_columns(rows)
+    for name, values in columns.items():
+        files[name].write(values.tobytes())
+    meta['count'] += len(rows)
+    return len(rows)
+
+
+class Snapshot:
+    """Колонки фактов об отзывах, открытые через memory map."""
+
+    def __init__(self, changed=None):
+        meta = read_meta()
+        self.meta = meta
+        self.changed = changed
+        self.columns = {
+            name: self._open(name, dtype, meta['count'])
+            for name, dtype in COLUMNS.items()
+        }
+        for name in GENRE_COLUMNS:
+            self.columns[name] = self._open(name, np.int64)
+
+    @staticmethod
+    def _open(name, dtype, count=None):
+        path = _column_path(name)
+        if count == 0 or not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r',
+                         shape=(count,) if count is not None else None)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def score_by_category_year(self):
+        """Число отзывов и средняя оценка по категории и году."""
+        years = self['year'].astype(np.int64)
+        if not len(years):
+            return _empty(4)
+        low = years.min()
+        span = years.max() - low + 1
+        key = (self['category_id'] + 1) * span + (years - low)
+        groups, counts, average = _grouped(key, self['score'])
+        return groups // span - 1, groups % span + low, counts, average
+
+    def score_by_month(self):
+        """Число отзывов и средняя оценка по месяцам публикации."""
+        months = self['pub_date'].astype('datetime64[s]').astype(
+            'datetime64[M]'
+        ).astype(np.int64)
+        if not len(months):
+            return _empty(3)
+        low = months.min()
+        groups, counts, average = _grouped(months - low, self['score'])
+        return (groups + low).astype('datetime64[M]'), counts, average
+
+    def volume_by_genre(self):
+        """Число отзывов по жанрам тайтлов."""
+        titles = self['title_id']
+        genre_titles = self['genre_title']
+        if not len(titles) or not len(genre_titles):
+            return _empty(2)
+        size = int(max(titles.max(), genre_titles.max())) + 1
+        per_title = np.bincount(titles, minlength=size)
+        genres, codes = np.unique(self['genre_genre'], return_inverse=True)
+        counts = np.bincount(
+            codes, weights=per_title[genre_titles], minlength=len(genres)
+        )
+        return genres, counts.astype(np.int64)
+
+
+def _empty(columns):
+    return tuple(np.empty(0, dtype=np.int64) for _ in range(columns))
+
+
+def _grouped(key, scores):
+    """Считает число и среднюю оценку по неотрицательному ключу."""
+    counts = np.bincount(key)
+    sums = np.bincount(key, weights=scores)
+    groups = np.flatnonzero(counts)
+    return groups, counts[groups], sums[groups] / counts[groups]
+
+
+_snapshot = None
+
+
+def get_snapshot():
+    """Возвращает снимок, переоткрывая его после нового экспорта."""
+    global _snapshot
+    try:
+        changed = os.stat(_meta_path()).st_mtime_ns
+    except FileNotFoundError:
+        changed = None
+    if _snapshot is None or _snapshot.changed != changed:
+        _snapshot = Snapshot(changed)
+    return _snapshot
@@ -0,0 +1,392 @@
+import csv
+import hashlib
+import os
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from reviews import changelog, counters, deletion, ratings, sharding
+from reviews.models import (Category, Change, Comment, Genre, Review, Title,
+                            User)
+
+CHUNK_SIZE = getattr(settings, 'IMPORT_CHUNK_SIZE', 1000)
+STATE_DIR = Path(getattr(settings, 'IMPORT_STATE_DIR', 'import_state'))
+DIGEST_SIZE = 8
+GenreTitle = Title.genre.through
+
+
+def _integer(value):
+    return int(value) if value != '' else None
+
+
+def _text(value):
+    return value
+
+
+def _datetime(value):
+    return parse_datetime(value)
+
+
+class Source:
+    """Файл выгрузки и модель, в которую он загружается.
+
+    columns — тройки (колонка CSV, атрибут модели, преобразование).
+    """
+
+    def __init__(self, name, file, model, columns):
+        self.name = name
+        self.file = file
+        self.model = model
+        self.columns = columns
+        self.fields = [attname for _, attname, _ in columns
+                       if attname != 'id']
+
+    def build(self, values):
+        return self.model(**values)
+
+
+SOURCES = (
+    Source('category', 'category.csv', Category, (
+        ('id', 'id', int), ('name', 'name', _text), ('slug', 'slug', _text),
+    )),
+    Source('genre', 'genre.csv', Genre, (
+        ('id', 'id', int), ('name', 'name', _text), ('slug', 'slug', _text),
+    )),
+    Source('titles', 'titles.csv', Title, (
+        ('id', 'id', int), ('name', 'name', _text), ('year', 'year', int),
+        ('category', 'category_id', _integer),
+    )),
+    Source('genre_title', 'genre_title.csv', GenreTitle, (
+        ('id', 'id', int), ('title_id', 'title_id', int),
+        ('genre_id', 'genre_id', int),
+    )),
+    Source('users', 'users.csv', User, (
+        ('id', 'id', int), ('username', 'username', _text),
+        ('email', 'email', _text), ('role', 'role', _text),
+        ('bio', 'bio', _text), ('first_name', 'first_name', _text),
+        ('last_name', 'last_name', _text),
+    )),
+    Source('review', 'review.csv', Review, (
+        ('id', 'id', int), ('title_id', 'title_id', int),
+        ('text', 'text', _text), ('author', 'author_id', int),
+        ('score', 'score', int), ('pub_date', 'pub_date', _datetime),
+    )),
+    Source('comments', 'comments.csv', Comment, (
+        ('id', 'id', int), ('review_id', 'review_id', int),
+        ('text', 'text', _text), ('author', 'author_id', int),
+        ('pub_date', 'pub_date', _datetime),
+    )),
+)
+
+
+class HashStore:
+    """Отпечатки строк прошлой загрузки, отсортированные по id.
+
+    Хранятся как два массива: id по 8 байт и отпечатки по 8 байт,
+    то есть 16 байт на строку.
+    """
+
+    def __init__(self, pks=None, digests=b''):
+        self.pks = pks if pks is not None else array('Q')
+        self.digests = digests
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as source:
+                count = array('Q', source.read(8))[0]
+                pks = array('Q')
+                pks.frombytes(source.read(count * 8))
+                return cls(pks, source.read(count * DIGEST_SIZE))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'wb') as target:
+            target.write(array('Q', [len(self.pks)]).tobytes())
+            target.write(self.pks.tobytes())
+            target.write(self.digests)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(temporary, path)
+
+    def find(self, pk):
+        position = bisect_left(self.pks, pk)
+        if position < len(self.pks) and self.pks[position] == pk:
+            return position
+        return None
+
+    def digest(self, position):
+        start = position * DIGEST_SIZE
+        return self.digests[start:start + DIGEST_SIZE]
+
+
+def row_digest(values):
+    return hashlib.blake2b(
+        '\x1f'.join(values).encode(), digest_size=DIGEST_SIZE
+    ).digest()
+
+
+def _sorted_store(pks, digests, skipped):
+    """Собирает хранилище из отпечатков новой загрузки.
+
+    Пропущенные строки не сохраняются, чтобы в следующий раз они
+    снова считались новыми.
+    """
+    ordered = all(pks[i] < pks[i + 1] for i in range(len(pks) - 1))
+    if ordered and not skipped:
+        return HashStore(pks, bytes(digests))
+    order = [i for i in range(len(pks)) if pks[i] not in skipped]
+    if not ordered:
+        order.sort(key=pks.__getitem__)
+    return HashStore(
+        array('Q', (pks[i] for i in order)),
+        b''.join(digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]
+                 for i in order),
+    )
+
+
+def _review_locations(review_ids):
+    """Шард и тайтл существующих отзывов: {id: (база, id тайтла)}."""
+    locations = {}
+    pending = set(review_ids)
+    for alias in sharding.SHARDS:
+        if not pending:
+            break
+        for pk, title_id in Review._base_manager.using(alias).filter(
+            pk__in=pending
+        ).values_list('pk', 'title_id'):
+            locations[pk] = (alias, title_id)
+        pending -= locations.keys()
+    return locations
+
+
+class Sync:
+    """Загрузка одного файла: сравнение с отпечатками и применение."""
+
+    def __init__(self, source, directory, state_dir):
+        self.source = source
+        self.path = Path(directory) / source.file
+        self.state_path = Path(state_dir) / f'{source.name}.bin'
+        self.store = HashStore.load(self.state_path)
+        self.counts = {'insert': 0, 'update': 0, 'unchanged': 0,
+                       'delete': 0, 'skipped': 0}
+        self.deleted = []
+        self.new_pks = array('Q')
+        self.new_digests = bytearray()
+        self.titles = set()
+        self.reviews = {}
+        self.skipped = set()
+
+    def rows(self):
+        source = self.source
+        with open(self.path, encoding='utf-8', newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                raw = [row[column] for column, _, _ in source.columns]
+                values = {
+                    attname: convert(value)
+                    for (_, attname, convert), value in zip(
+                        source.columns, raw
+                    )
+                }
+                yield values, row_digest(raw)
+
+    def upsert(self):
+        """Первый проход: вставки и изменения пачками."""
+        seen = bytearray(len(self.store.pks))
+        changed = []
+        unchanged = []
+        for values, digest in self.rows():
+            pk = values['id']
+            self.new_pks.append(pk)
+            self.new_digests += digest
+            position = self.store.find(pk)
+            if position is not None:
+                seen[position] = 1
+                if self.store.digest(position) == digest:
+                    unchanged.append(values)
+                    if len(unchanged) >= CHUNK_SIZE:
+                        changed += self.missing(unchanged)
+                        unchanged = []
+                    continue
+            changed.append(values)
+            if len(changed) >= CHUNK_SIZE:
+                self.apply(changed)
+                changed = []
+        changed += self.missing(unchanged)
+        if changed:
+            self.apply(changed)
+        position = seen.find(0)
+        while position != -1:
+            self.deleted.append(self.store.pks[position])
+            position = seen.find(0, position + 1)
+
+    def missing(self, rows):
+        """Строки с прежним отпечатком, которых нет в базе.
+
+        Отпечатки не привязаны к базе: после её пересоздания,
+        восстановления из копии или удаления строки через API такие
+        строки загружаются заново, а не считаются неизменными.
+        """
+        if not rows:
+            return []
+        model = self.source.model
+        manager = model._base_manager
+        pks = [values['id'] for values in rows]
+        present = set()
+        for alias in (sharding.SHARDS if sharding.is_sharded(model)
+                      else [manager.db]):
+            present.update(manager.using(alias).filter(
+                pk__in=pks
+            ).values_list('pk', flat=True))
+        self.counts['unchanged'] += len(present)
+        return [values for values in rows if values['id'] not in present]
+
+    def databases(self, rows):
+        """Раскладывает строки по базам: {база: строки}."""
+        model = self.source.model
+        if model is Review:
+            groups = {}
+            for values in rows:
+                groups.setdefault(
+                    sharding.shard_for_title(values['title_id']), []
+                ).append(values)
+            return groups
+        if model is Comment:
+            locations = _review_locations(
+                {values['review_id'] for values in rows}
+            )
+            groups = {}
+            for values in rows:
+                location = locations.get(values['review_id'])
+                if location is None:
+                    self.counts['skipped'] += 1
+                    self.skipped.add(values['id'])
+                    continue
+                values['title_id'] = location[1]
+                groups.setdefault(location[0], []).append(values)
+            return groups
+        return {model.objects.db: rows}
+
+    def apply(self, rows):
+        model = self.source.model
+        for alias, group in self.databases(rows).items():
+            manager = model._base_manager.using(alias)
+            existing = set(manager.filter(
+                pk__in=[values['id'] for values in group]
+            ).values_list('pk', flat=True))
+            inserts = [values for values in group
+                       if values['id'] not in existing]
+            updates = [values for values in group
+                       if values['id'] in existing]
+            with transaction.atomic(using=alias):
+                self.write(manager, inserts, updates)
+            self.counts['insert'] += len(inserts)
+            self.counts['update'] += len(updates)
+            if model is Comment:
+                self.reviews.setdefault(alias, set()).update(
+                    values['review_id'] for values in group
+                )
+            self.log(inserts, Change.INSERT)
+            self.log(updates, Change.UPDATE)
+
+    def _objects(self, rows):
+        fields = set(self.source.fields) | {'id'}
+        return [
+            self.source.build({name: value for name, value in values.items()
+                               if name in fields})
+            for values in rows
+        ]
+
+    def write(self, manager, inserts, updates):
+        fields = self.source.fields
+        if inserts:
+            manager.bulk_create(self._objects(inserts), batch_size=CHUNK_SIZE)
+            if 'pub_date' in fields:
+                manager.bulk_update(
+                    self._objects(inserts), ('pub_date',),
+                    batch_size=CHUNK_SIZE
+                )
+        if updates:
+            manager.bulk_update(
+                self._objects(updates), fields, batch_size=CHUNK_SIZE
+            )
+
+    def log(self, rows, action):
+        """Пишет журнал изменений и запоминает тайтлы для пересчёта."""
+        model = self.source.model
+        if not rows:
+            return
+        if model is GenreTitle:
+            titles = {values['title_id'] for values in rows}
+            changelog.record_many(
+                Title, [(pk, pk) for pk in titles], Change.UPDATE
+            )
+        elif model in changelog.KINDS:
+            path = 'id' if model is Title else 'title_id'
+            entries = [(values['id'], values[path]) for values in rows]
+            changelog.record_many(model, entries, action)
+            if model is Review:
+                self.titles.update(title_id for _, title_id in entries)
+
+    def delete(self):
+        """Второй проход: удаление строк, которых нет в новом файле."""
+        model = self.source.model
+        for start in range(0, len(self.deleted), CHUNK_SIZE):
+            ids = self.deleted[start:start + CHUNK_SIZE]
+            if model in (Review, Comment):
+                counts = deletion.bulk_delete(model.objects.filter(pk__in=ids))
+                self.counts['delete'] += counts[
+                    'reviews' if model is Review else 'comments'
+                ]
+            elif model is GenreTitle:
+                links = GenreTitle.objects.filter(pk__in=ids)
+                rows = list(links.values('id', 'title_id'))
+                links._raw_delete(links.db)
+                self.log(rows, Change.UPDATE)
+                self.counts['delete'] += len(rows)
+            elif model is Genre:
+                self.counts['delete'] += len(ids)
+                Genre.objects.filter(pk__in=ids).delete()
+            else:
+                for obj in model.objects.filter(pk__in=ids):
+                    deletion.delete(obj)
+                    self.counts['delete'] += 1
+
+    def finish(self):
+        """Сохраняет отпечатки новой загрузки и пересчитывает оценки
+        и число комментариев."""
+        if self.source.model is Review and self.titles:
+            ratings.recount(self.titles)
+        for alias, review_ids in self.reviews.items():
+            counters.recount_comments(review_ids, alias)
+        if self.source.model in (Review, Comment) and len(self.new_pks):
+            allocator = (sharding.review_ids if self.source.model is Review
+                         else sharding.comment_ids)
+            allocator.reserve(max(self.new_pks))
+        _sorted_store(
+            self.new_pks, self.new_digests, self.skipped
+        ).save(self.state_path)
+
+
+def sync(directory, state_dir=STATE_DIR, names=None):
+    """Загружает только изменившиеся строки файлов выгрузки.
+
+    Вставки и изменения идут в порядке зависимостей, удаления — в
+    обратном. Возвращает число строк каждого вида по файлам.
+    """
+    syncs = [Sync(source, directory, state_dir) for source in SOURCES
+             if names is None or source.name in names]
+    for item in syncs:
+        item.upsert()
+    for item in reversed(syncs):
+        item.delete()
+    for item in syncs:
+        item.finish()
+    return {item.source.name: item.counts for item in syncs}
@@ -0,0 +1,90 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Max
+
+from reviews.models import Change, SimilarTitlesBuild
+
+
+class Command(BaseCommand):
+    help = ('Строит таблицу похожих тайтлов по общим жанрам и '
+            'рецензентам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10,
+                            help='Сколько соседей хранить для тайтла.')
+        parser.add_argument('--block', type=int, default=1024,
+                            help='Сколько тайтлов считать за один шаг.')
+        parser.add_argument('--genre-weight', type=float, default=0.3,
+                            help='Вес сходства по жанрам от 0 до 1.')
+        parser.add_argument('--changed', action='store_true',
+                            help='Пересчитать только тайтлы, отзывы '
+                                 'которых изменились с прошлого запуска.')
+        parser.add_argument('--benchmark', nargs=2, type=int,
+                            metavar=('TITLES', 'REVIEWS'),
+                            help='Замерить построение на случайных данных '
+                                 'без записи в базу.')
+        parser.add_argument('--sample-blocks', type=int, default=20,
+                            help='Сколько блоков считать при замере.')
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from reviews import similarity
+        except ImportError:
+            raise CommandError('Для построения нужны numpy и scipy.')
+        if options['benchmark']:
+            return self.benchmark(np, similarity, options)
+        seq = Change.objects.aggregate(Max('seq'))['seq__max'] or 0
+        started = time.perf_counter()
+        model = similarity.load_model()
+        loaded = time.perf_counter()
+        rows = np.arange(len(model.title_ids))
+        if options['changed']:
+            last = SimilarTitlesBuild.objects.order_by('-created').first()
+            if last is not None:
+                changed = Change.objects.filter(
+                    seq__gt=last.seq,
+                    seq__lte=seq,
+                    kind__in=(Change.TITLE, Change.REVIEW),
+                ).values_list('title_id', flat=True).distinct()
+                ids = np.fromiter(changed, dtype=np.int64)
+                rows = np.flatnonzero(np.isin(model.title_ids, ids))
+        similarity.build(
+            model, rows,
+            k=options['k'],
+            genre_weight=options['genre_weight'],
+            block=options['block'],
+        )
+        SimilarTitlesBuild.objects.create(seq=seq, titles=len(rows))
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано тайтлов: {len(rows)}, загрузка '
+            f'{loaded - started:.1f} с, расчёт '
+            f'{time.perf_counter() - loaded:.1f} с.'
+        ))
+
+    def benchmark(self, np, similarity, options):
+        titles, reviews = options['benchmark']
+        started = time.perf_counter()
+        model = similarity.synthetic_model(titles, reviews)
+        built = time.perf_counter()
+        block = options['block']
+        blocks = min(options['sample_blocks'], -(-titles // block))
+        rows = np.random.default_rng(1).choice(
+            titles, size=blocks * block, replace=False
+        ) if blocks * block < titles else np.arange(titles)
+        similarity.build(
+            model, rows,
+            k=options['k'],
+            genre_weight=options['genre_weight'],
+            block=block,
+            save=lambda *args: None,
+        )
+        computed = time.perf_counter() - built
+        total = computed * titles / len(rows)
+        self.stdout.write(
+            f'Тайтлов: {titles}, отзывов: {reviews}.\n'
+            f'Матрицы: {built - started:.1f} с.\n'
+            f'Соседи для {len(rows)} тайтлов: {computed:.1f} с, '
+            f'оценка для всех: {total:.0f} с.'
+        )
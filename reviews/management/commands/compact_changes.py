@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from reviews.models import Change, ChangeCompaction
+
+CHUNK_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ('Сжимает журнал изменений: оставляет только последнюю запись '
+            'для каждого объекта и удаляет старые записи об удалении. '
+            'Курсоры до последней удалённой записи об удалении '
+            'перестают приниматься.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.CHANGES_RETENTION_DAYS,
+            help='Сколько дней хранить записи об удалении.',
+        )
+
+    def compact(self):
+        """Удаляет записи, перекрытые более поздними для того же объекта."""
+        removed = 0
+        upper = Change.objects.aggregate(Max('seq'))['seq__max'] or 0
+        start = 0
+        while start < upper:
+            stop = start + CHUNK_SIZE
+            latest = Change.objects.filter(
+                seq__gt=start, seq__lte=stop
+            ).values('kind', 'object_id').annotate(last=Max('seq'))
+            newest = {
+                (row['kind'], row['object_id']): row['last'] for row in latest
+            }
+            later = Change.objects.filter(
+                seq__gt=stop,
+                object_id__in={object_id for _, object_id in newest},
+            ).values_list('kind', 'object_id').distinct()
+            superseded = set(later)
+            stale = [
+                seq for seq, kind, object_id in Change.objects.filter(
+                    seq__gt=start, seq__lte=stop
+                ).values_list('seq', 'kind', 'object_id')
+                if (kind, object_id) in superseded
+                or seq != newest[kind, object_id]
+            ]
+            if stale:
+                removed += Change.objects.filter(seq__in=stale).delete()[0]
+            start = stop
+        return removed
+
+    def handle(self, *args, **options):
+        compacted = self.compact()
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        tombstones = Change.objects.filter(
+            action=Change.DELETE, created__lt=cutoff
+        )
+        last = tombstones.aggregate(Max('seq'))['seq__max']
+        expired, _ = tombstones.delete()
+        if expired:
+            ChangeCompaction.objects.create(seq=last, removed=expired)
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено перекрытых записей: {compacted}, '
+            f'устаревших записей об удалении: {expired}.'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Выгружает факты об отзывах в колоночные файлы для '
+            'статистики.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Выгрузить всё заново, а не только изменения.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            from reviews import facts
+        except ImportError:
+            raise CommandError('Для выгрузки нужен numpy.')
+        added = facts.export(full=options['full'])
+        meta = facts.read_meta()
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено отзывов: {added}, всего: {meta["count"]}, '
+            f'журнал изменений до записи {meta["seq"]}.'
+        ))
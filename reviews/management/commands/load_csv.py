@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.core.management import BaseCommand
 from django.shortcuts import get_object_or_404
-from get_reader import get_reader
 
+from reviews import importer, sharding
 from reviews.models import Category, Comment, Genre, Review, Title, User
 
 file_path = 'static/data/'
@@ -9,8 +10,46 @@ file_path = 'static/data/'
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=('Загрузить только изменившиеся строки, сравнив их с '
+                  'отпечатками прошлой загрузки.'),
+        )
+        parser.add_argument('--path', default=file_path)
+        parser.add_argument(
+            '--state-dir',
+            default=settings.IMPORT_STATE_DIR,
+            help='Каталог с отпечатками строк прошлой загрузки.',
+        )
+
+    def incremental(self, options):
+        from api import autocomplete, reference
+
+        report = importer.sync(options['path'], options['state_dir'])
+        for name, counts in report.items():
+            self.stdout.write(
+                f'{name}: ' + ', '.join(
+                    f'{kind} {count}' for kind, count in counts.items()
+                )
+            )
+        changed = {name for name, counts in report.items()
+                   if counts['insert'] + counts['update'] + counts['delete']}
+        if changed & {'category', 'genre'}:
+            reference.invalidate()
+        for name, index in (('titles', 'titles'), ('genre', 'genres'),
+                            ('category', 'categories'), ('users', 'users')):
+            if name in changed:
+                autocomplete.invalidate(index)
+        self.stdout.write(self.style.SUCCESS('Загрузка изменений завершена.'))
+
     def handle(self, *args, **kwargs):
-        reader = get_reader(file_path + 'genre.csv')
+        if kwargs['incremental']:
+            return self.incremental(kwargs)
+        from get_reader import get_reader
+
+        reader = get_reader(kwargs['path'] + 'genre.csv')
         next(reader, None)
         for row in reader:
             obj, created = Genre.objects.get_or_create(
@@ -20,7 +59,7 @@ class Command(BaseCommand):
             )
         self.stdout.write(self.style.SUCCESS('Загрузка genre прошла успешно.'))
 
-        reader = get_reader(file_path + 'category.csv')
+        reader = get_reader(kwargs['path'] + 'category.csv')
         next(reader, None)
         for row in reader:
             obj, created = Category.objects.get_or_create(
@@ -31,7 +70,7 @@ class Command(BaseCommand):
         self.stdout.write(
             self.style.SUCCESS('Загрузка category прошла успешно.'))
 
-        reader = get_reader(file_path + 'titles.csv')
+        reader = get_reader(kwargs['path'] + 'titles.csv')
         next(reader, None)
         for row in reader:
             obj, created = Title.objects.get_or_create(
@@ -42,7 +81,7 @@ class Command(BaseCommand):
             )
         self.stdout.write(self.style.SUCCESS('Загрузка title прошла успешно.'))
 
-        reader = get_reader(file_path + 'users.csv')
+        reader = get_reader(kwargs['path'] + 'users.csv')
         next(reader, None)
         for row in reader:
             obj, created = User.objects.get_or_create(
@@ -56,28 +95,39 @@ class Command(BaseCommand):
             )
         self.stdout.write(self.style.SUCCESS('Загрузка users прошла успешно.'))
 
-        reader = get_reader(file_path + 'review.csv')
+        reader = get_reader(kwargs['path'] + 'review.csv')
         next(reader, None)
+        last_id = 0
         for row in reader:
-            obj, created = Review.objects.get_or_create(
-                id=row[0],
-                title_id=get_object_or_404(Title, id=row[1]),
-                text=row[2],
-                author=get_object_or_404(User, id=row[3]),
-                score=row[4],
-                pub_date=row[5]
-            )
+            with sharding.for_title(row[1]):
+                obj, created = Review.objects.get_or_create(
+                    id=row[0],
+                    title_id=get_object_or_404(Title, id=row[1]),
+                    text=row[2],
+                    author=get_object_or_404(User, id=row[3]),
+                    score=row[4],
+                    pub_date=row[5]
+                )
+            last_id = max(last_id, int(row[0]))
+        sharding.review_ids.reserve(last_id)
         self.stdout.write(
             self.style.SUCCESS('Загрузка review прошла успешно.'))
 
-        reader = get_reader(file_path + 'comments.csv')
+        reader = get_reader(kwargs['path'] + 'comments.csv')
         next(reader, None)
+        last_id = 0
         for row in reader:
-            obj, created = Comment.objects.get_or_create(
-                id=row[0],
-                review_id=get_object_or_404(Review, id=row[1]),
-                text=row[2],
-                pub_date=row[3]
-            )
+            review = sharding.find(Review, id=row[1])
+            if review is None:
+                raise Review.DoesNotExist(f'Отзыв {row[1]} не найден.')
+            with sharding.use_shard(review._state.db):
+                obj, created = Comment.objects.get_or_create(
+                    id=row[0],
+                    review_id=review,
+                    text=row[2],
+                    pub_date=row[3]
+                )
+            last_id = max(last_id, int(row[0]))
+        sharding.comment_ids.reserve(last_id)
         self.stdout.write(
             self.style.SUCCESS('Загрузка comments прошла успешно.'))
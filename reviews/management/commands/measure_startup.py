@@ -0,0 +1,92 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+PROBE = '''
+import json
+import sys
+import time
+
+started = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+if settings.WARMUP:
+    from api.warmup import prepare
+    prepare()
+ready = time.perf_counter()
+from django.test import Client
+client = Client()
+timings = []
+for _ in range(2):
+    request_started = time.perf_counter()
+    status = client.get(sys.argv[1]).status_code
+    timings.append(time.perf_counter() - request_started)
+print(json.dumps({
+    'setup_ms': (ready - started) * 1000,
+    'first_request_ms': timings[0] * 1000,
+    'second_request_ms': timings[1] * 1000,
+    'status': status,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время запуска процесса и первого запроса в новом '
+            'интерпретаторе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=settings.STARTUP_URL)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument(
+            '--output',
+            help='Файл, в конец которого дописывается результат в JSON.',
+        )
+        parser.add_argument(
+            '--max-first-request-ms', type=float,
+            help='Завершиться ошибкой, если первый запрос медленнее.',
+        )
+
+    def probe(self, url):
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, url],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ,
+                     DJANGO_SETTINGS_MODULE=os.environ.get(
+                         'DJANGO_SETTINGS_MODULE', 'api_yamdb.settings')),
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def handle(self, *args, **options):
+        probes = [self.probe(options['url']) for _ in range(options['runs'])]
+        report = {
+            name: round(statistics.median(probe[name] for probe in probes), 1)
+            for name in ('setup_ms', 'first_request_ms', 'second_request_ms')
+        }
+        report.update(
+            url=options['url'],
+            runs=options['runs'],
+            status=probes[-1]['status'],
+            warmup=getattr(settings, 'WARMUP', False),
+            measured=timezone.now().isoformat(),
+        )
+        self.stdout.write(json.dumps(report))
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                output.write(json.dumps(report) + '\n')
+        limit = options['max_first_request_ms']
+        if limit is not None and report['first_request_ms'] > limit:
+            raise CommandError(
+                f'Первый запрос занял {report["first_request_ms"]} мс, '
+                f'допустимо {limit} мс.'
+            )
@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+
+from reviews import deletion
+from reviews.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = ('Выполняет незавершённые задачи фонового удаления. Задачи, '
+            'которые сейчас выполняет другой поток, пропускаются.')
+
+    def handle(self, *args, **kwargs):
+        jobs = DeletionJob.objects.exclude(
+            status=DeletionJob.DONE
+        ).order_by('created')
+        for job in jobs:
+            try:
+                done = deletion.run(job)
+            except Exception as error:
+                self.stderr.write(
+                    f'Удаление {job.model} {job.object_id} не удалось: '
+                    f'{job.error or error}'
+                )
+                continue
+            if done is None:
+                self.stdout.write(
+                    f'Удаление {job.model} {job.object_id} уже выполняется.'
+                )
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f'Удаление {job.model} {job.object_id} завершено, '
+                f'обработано записей: {job.processed}.'
+            ))
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+
+from api import provisioning
+
+
+class Command(BaseCommand):
+    help = ('Создаёт пользователей из файла в формате users.csv или JSON '
+            'и рассылает им коды подтверждения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv или .json.')
+        parser.add_argument(
+            '--no-email',
+            action='store_true',
+            help='Не отправлять коды подтверждения.',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        try:
+            rows = provisioning.read_file(path.name, path.read_bytes())
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        if not isinstance(rows, list):
+            raise CommandError('Ожидается список пользователей.')
+        try:
+            report = provisioning.provision(
+                rows, send_email=not options['no_email']
+            )
+        except provisioning.ProvisioningConflict as error:
+            raise CommandError(str(error.detail))
+        for error in report['errors']:
+            self.stderr.write(f'Строка {error["row"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {report["created"]}, '
+            f'отправлено писем: {report["emails_sent"]}, '
+            f'строк с ошибками: {len(report["errors"])}.'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+
+from api import snapshot
+
+
+class Command(BaseCommand):
+    help = ('Публикует категории, жанры, первые страницы тайтлов и '
+            'карточки тайтлов в JSON-файлы для раздачи через nginx. '
+            'Повторный запуск обновляет только изменившиеся файлы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересобрать все карточки тайтлов.',
+        )
+        parser.add_argument(
+            '--path',
+            default=snapshot.SNAPSHOT_DIR,
+            help='Каталог снимка.',
+        )
+
+    def handle(self, *args, **options):
+        counts = snapshot.publish(options['path'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Тайтлов обработано: {counts["titles"]}, '
+            f'файлов записано: {counts["written"]}, '
+            f'удалено: {counts["removed"]}.'
+        ))
@@ -0,0 +1,87 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from reviews import sharding
+from reviews.models import Comment, Review
+
+CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Переносит отзывы и комментарии в шарды, которые им назначает '
+            'кольцо REVIEW_SHARDS. Запускается после изменения списка '
+            'шардов; повторный запуск продолжает прерванный перенос.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            action='append',
+            default=[],
+            help=('Дополнительная база, из которой нужно вынести все '
+                  'отзывы, например выводимый из кольца шард.'),
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, сколько тайтлов нужно перенести.',
+        )
+
+    def misplaced(self, alias):
+        """Тайтлы, отзывы которых лежат не в своём шарде."""
+        title_ids = Review._base_manager.using(alias).values_list(
+            'title_id', flat=True
+        ).distinct().order_by()
+        return [title_id for title_id in title_ids.iterator()
+                if sharding.shard_for_title(title_id) != alias]
+
+    def move(self, title_id, source, target):
+        """Переносит отзывы тайтла пачками; возвращает их число."""
+        moved = 0
+        while True:
+            reviews = list(Review._base_manager.using(source).filter(
+                title_id=title_id
+            ).order_by('pk')[:CHUNK_SIZE])
+            if not reviews:
+                return moved
+            ids = [review.pk for review in reviews]
+            comments = list(Comment._base_manager.using(source).filter(
+                review_id__in=ids
+            ))
+            with transaction.atomic(using=target):
+                Review._base_manager.using(target).bulk_create(
+                    reviews, ignore_conflicts=True
+                )
+                Comment._base_manager.using(target).bulk_create(
+                    comments, ignore_conflicts=True
+                )
+            with transaction.atomic(using=source):
+                Comment._base_manager.using(source).filter(
+                    review_id__in=ids
+                )._raw_delete(source)
+                Review._base_manager.using(source).filter(
+                    pk__in=ids
+                )._raw_delete(source)
+            moved += len(reviews)
+
+    def handle(self, *args, **options):
+        sources = list(sharding.SHARDS)
+        for alias in options['source']:
+            if alias not in connections.databases:
+                raise CommandError(f'База {alias} не настроена.')
+            if alias not in sources:
+                sources.append(alias)
+        for source in sources:
+            title_ids = self.misplaced(source)
+            self.stdout.write(
+                f'{source}: тайтлов не на своём месте: {len(title_ids)}.'
+            )
+            if options['dry_run']:
+                continue
+            for title_id in title_ids:
+                target = sharding.shard_for_title(title_id)
+                moved = self.move(title_id, source, target)
+                self.stdout.write(
+                    f'Тайтл {title_id}: {source} -> {target}, '
+                    f'отзывов: {moved}.'
+                )
+        self.stdout.write(self.style.SUCCESS('Перебалансировка завершена.'))
@@ -0,0 +1,31 @@
+import os
+import sys
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Запускает gunicorn с рабочими процессами uvicorn, '
+            'предзагрузкой приложения и прогревом.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='0.0.0.0:8000')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Число рабочих процессов, по умолчанию из gunicorn.conf.py.',
+        )
+
+    def handle(self, *args, **options):
+        if find_spec('gunicorn') is None or find_spec('uvicorn') is None:
+            raise CommandError('Для запуска нужны gunicorn и uvicorn.')
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--config', os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+            '--chdir', str(settings.BASE_DIR),
+            '--bind', options['bind'],
+        ]
+        if options['workers']:
+            command += ['--workers', str(options['workers'])]
+        os.execv(sys.executable, command)
@@ -0,0 +1,80 @@
+# Generated by Django 3.2.25 on 2026-10-19 05:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import reviews.sharding
+
+
+def seed_counters(apps, schema_editor):
+    """Переносит текущие id и оценки в счётчики и агрегаты тайтлов."""
+    alias = schema_editor.connection.alias
+    IdBlock = apps.get_model('reviews', 'IdBlock')
+    Review = apps.get_model('reviews', 'Review')
+    Comment = apps.get_model('reviews', 'Comment')
+    Title = apps.get_model('reviews', 'Title')
+    for name, model in (('review', Review), ('comment', Comment)):
+        last = model.objects.using(alias).aggregate(
+            last=models.Max('id')
+        )['last'] or 0
+        IdBlock.objects.using(alias).create(name=name, next_id=last + 1)
+    totals = Review.objects.using(alias).filter(is_deleted=False).values(
+        'title_id'
+    ).annotate(total=models.Sum('score'), count=models.Count('id'))
+    for row in totals.order_by():
+        Title.objects.using(alias).filter(pk=row['title_id']).update(
+            rating_sum=row['total'], rating_count=row['count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0007_similar_titles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdBlock',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Счётчик')),
+                ('next_id', models.BigIntegerField(verbose_name='Следующий id')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='title',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='число оценок'),
+        ),
+        migrations.AddField(
+            model_name='title',
+            name='rating_sum',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='сумма оценок'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='comments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='id',
+            field=models.BigIntegerField(default=reviews.sharding.next_comment_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='reviews', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='id',
+            field=models.BigIntegerField(default=reviews.sharding.next_review_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='title',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='reviews', to='reviews.title'),
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
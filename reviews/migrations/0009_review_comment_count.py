@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+
+def count_comments(apps, schema_editor):
+    """Заполняет число комментариев отзывов в каждом шарде."""
+    alias = schema_editor.connection.alias
+    Review = apps.get_model('reviews', 'Review')
+    Comment = apps.get_model('reviews', 'Comment')
+    counts = Comment.objects.using(alias).values('review_id').annotate(
+        count=models.Count('id')
+    )
+    for row in counts.order_by():
+        Review.objects.using(alias).filter(pk=row['review_id']).update(
+            comment_count=row['count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0008_review_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='число комментариев'),
+        ),
+        migrations.RunPython(
+            count_comments, migrations.RunPython.noop,
+            hints={'model_name': 'review'},
+        ),
+    ]
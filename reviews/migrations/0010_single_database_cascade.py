@@ -0,0 +1,58 @@
+from django.db import migrations, models
+
+from reviews.sharding import SHARDED
+
+# Связи отзывов и комментариев остаются как в 0008 при любом числе
+# шардов; каскад при прямом удалении выполняет reviews.deletion.
+
+
+def delete_orphans(apps, schema_editor):
+    """Удаляет отзывы и комментарии, оставшиеся без тайтла или автора.
+
+    Такие записи могли появиться, пока связи не проверялись базой.
+    Оценки тайтлов и число комментариев отзывов пересчитываются.
+    """
+    if SHARDED:
+        return
+    alias = schema_editor.connection.alias
+    Title = apps.get_model('reviews', 'Title')
+    User = apps.get_model('reviews', 'User')
+    Review = apps.get_model('reviews', 'Review')
+    Comment = apps.get_model('reviews', 'Comment')
+    titles = Title.objects.using(alias).values('pk')
+    users = User.objects.using(alias).values('pk')
+    reviews = Review.objects.using(alias)
+    comments = Comment.objects.using(alias)
+    orphans = reviews.exclude(title_id__in=titles) | reviews.exclude(
+        author_id__in=users
+    )
+    rated = set(orphans.values_list('title_id', flat=True))
+    comments.filter(review_id__in=orphans.values('pk'))._raw_delete(alias)
+    orphans._raw_delete(alias)
+    orphan_comments = comments.exclude(author_id__in=users)
+    commented = set(orphan_comments.values_list('review_id', flat=True))
+    orphan_comments._raw_delete(alias)
+    for review in reviews.filter(pk__in=commented):
+        review.comment_count = comments.filter(review_id=review.pk).count()
+        review.save(update_fields=('comment_count',))
+    for title in Title.objects.using(alias).filter(pk__in=rated):
+        totals = reviews.filter(title_id=title.pk, is_deleted=False).aggregate(
+            total=models.Sum('score'), count=models.Count('id')
+        )
+        title.rating_sum = totals['total'] or 0
+        title.rating_count = totals['count']
+        title.save(update_fields=('rating_sum', 'rating_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0009_review_comment_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_orphans, migrations.RunPython.noop,
+            hints={'model_name': 'review'},
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Поиск админки по '^name' выполняется как UPPER(name::text) LIKE
+# UPPER('…%'), и обычный индекс по столбцу для него не подходит.
+# Функциональные индексы с text_pattern_ops есть только в PostgreSQL;
+# в SQLite LIKE без учёта регистра индексом не обслуживается.
+INDEXES = (
+    ('reviews_title_name_upper_like', 'reviews_title', 'name'),
+    ('reviews_user_username_upper_like', 'reviews_user', 'username'),
+    ('reviews_user_email_upper_like', 'reviews_user', 'email'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'((UPPER({column}::text)) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0012_changecompaction'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_indexes, drop_indexes, hints={'model_name': 'title'},
+        ),
+    ]
@@ -9,8 +9,17 @@ from django.db import models
 
 from api_yamdb.settings import USERNAME_LENGTH
 from api.validators import validate_username
+from reviews.sharding import (ShardedQuerySet, next_comment_id,
+                              next_review_id)
 
 LENGTH = 15
+# Связи отзывов и комментариев с тайтлом и автором могут вести в другую
+# базу, поэтому не проверяются базой, а каскад выполняет
+# reviews.deletion. Схема не зависит от числа шардов.
+CROSS_SHARD = {
+    'on_delete': models.DO_NOTHING,
+    'db_constraint': False,
+}
 
 
 class User(AbstractUser):
@@ -42,7 +51,12 @@ class User(AbstractUser):
         'Роль пользователя',
         max_length=50,
         choices=ROLE_CHOICES,
-        default=USER,)
+        default=USER,
+        db_index=True,)
+    is_deleted = models.BooleanField(
+        'Удалён',
+        default=False,
+        db_index=True,)
 
     @property
     def is_moderator(self):
@@ -64,6 +78,11 @@ class Category(models.Model):
         max_length=settings.SLUG_LENGTH,
         unique=True,
     )
+    is_deleted = models.BooleanField(
+        verbose_name='удалена',
+        default=False,
+        db_index=True
+    )
 
     class Meta:
         ordering = ('name',)
@@ -128,6 +147,21 @@ class Title(models.Model):
         null=True,
         blank=False,
     )
+    is_deleted = models.BooleanField(
+        verbose_name='удалено',
+        default=False,
+        db_index=True
+    )
+    rating_sum = models.PositiveBigIntegerField(
+        verbose_name='сумма оценок',
+        default=0,
+        editable=False
+    )
+    rating_count = models.PositiveIntegerField(
+        verbose_name='число оценок',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ('-year', 'name')
@@ -137,24 +171,41 @@ class Title(models.Model):
 
 
 class Review(models.Model):
-    """Модель для отзывов."""
+    """Модель для отзывов.
+
+    Отзывы лежат в шарде тайтла. Связи с тайтлом и автором не
+    проверяются базой, а удаление каскадом выполняет reviews.deletion.
+    """
+    id = models.BigIntegerField(
+        primary_key=True, default=next_review_id, editable=False
+    )
     title = models.ForeignKey(
         Title,
-        on_delete=models.CASCADE,
         related_name="reviews",
+        **CROSS_SHARD,
     )
     text = models.TextField("Текст", help_text="Отзыв")
     author = models.ForeignKey(
         User,
-        on_delete=models.CASCADE,
         related_name="reviews",
         verbose_name="Автор",
+        **CROSS_SHARD,
     )
     score = models.SmallIntegerField(
         verbose_name="Оценка",
         validators=[MinValueValidator(1), MaxValueValidator(10)],
     )
-    pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    pub_date = models.DateTimeField(
+        "Дата публикации", auto_now_add=True, db_index=True
+    )
+    is_deleted = models.BooleanField("Удалён", default=False, db_index=True)
+    comment_count = models.PositiveIntegerField(
+        verbose_name="число комментариев",
+        default=0,
+        editable=False
+    )
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         ordering = ["-pub_date"]
@@ -165,22 +216,174 @@ class Review(models.Model):
         ]
 
     def __str__(self):
-        return self.name[:LENGTH]
+        return self.text[:LENGTH]
 
 
 class Comment(models.Model):
-    """Модель для комментариев."""
+    """Модель для комментариев, лежат в шарде своего отзыва."""
+    id = models.BigIntegerField(
+        primary_key=True, default=next_comment_id, editable=False
+    )
     review = models.ForeignKey(
         Review, on_delete=models.CASCADE, related_name="comments"
     )
     text = models.TextField("Текст", help_text="Комментарий")
     author = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="comments"
+        User,
+        related_name="comments",
+        **CROSS_SHARD,
     )
-    pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    pub_date = models.DateTimeField(
+        "Дата публикации", auto_now_add=True, db_index=True
+    )
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         ordering = ["-pub_date"]
 
     def __str__(self):
         return self.text
+
+
+class DeletionJob(models.Model):
+    """Модель для фонового удаления объекта с зависимыми записями."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    ]
+
+    model = models.CharField('Модель', max_length=50)
+    object_id = models.BigIntegerField('ID объекта')
+    status = models.CharField(
+        'Статус',
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        db_index=True,
+    )
+    total = models.PositiveBigIntegerField('Всего записей', default=0)
+    processed = models.PositiveBigIntegerField('Обработано', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создано', auto_now_add=True)
+    updated = models.DateTimeField('Обновлено', auto_now=True)
+    finished = models.DateTimeField('Завершено', null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}: {self.status}'
+
+
+class Change(models.Model):
+    """Модель для журнала изменений тайтлов, отзывов и комментариев."""
+    TITLE = 'title'
+    REVIEW = 'review'
+    COMMENT = 'comment'
+    KIND_CHOICES = [
+        (TITLE, 'title'),
+        (REVIEW, 'review'),
+        (COMMENT, 'comment'),
+    ]
+    INSERT = 'insert'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ACTION_CHOICES = [
+        (INSERT, 'insert'),
+        (UPDATE, 'update'),
+        (DELETE, 'delete'),
+    ]
+
+    seq = models.BigAutoField('Номер', primary_key=True)
+    kind = models.CharField('Тип', max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField('ID объекта')
+    title_id = models.BigIntegerField('ID тайтла', db_index=True)
+    action = models.CharField('Действие', max_length=10,
+                              choices=ACTION_CHOICES)
+    created = models.DateTimeField('Время', auto_now_add=True,
+                                   db_index=True)
+
+    class Meta:
+        ordering = ['seq']
+        indexes = [
+            models.Index(fields=['kind', 'object_id'],
+                         name='change_object_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.seq}: {self.action} {self.kind} {self.object_id}'
+
+
+class ChangeCompaction(models.Model):
+    """Модель для отметок о сжатии журнала изменений.
+
+    seq — последняя удалённая запись об удалении: курсор меньше неё
+    мог пропустить удаление.
+    """
+    seq = models.BigIntegerField('Граница журнала')
+    removed = models.PositiveIntegerField('Удалено записей')
+    created = models.DateTimeField('Время', auto_now_add=True)
+
+    class Meta:
+        ordering = ('-created',)
+        get_latest_by = 'created'
+
+    def __str__(self):
+        return f'{self.created}: {self.seq}'
+
+
+class SimilarTitle(models.Model):
+    """Модель для предрасчитанных похожих тайтлов."""
+    title = models.ForeignKey(
+        Title,
+        on_delete=models.CASCADE,
+        related_name='neighbours',
+    )
+    similar = models.ForeignKey(
+        Title,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    score = models.FloatField('Сходство')
+    rank = models.PositiveSmallIntegerField('Место')
+
+    class Meta:
+        ordering = ('title', 'rank')
+        constraints = [
+            models.UniqueConstraint(
+                fields=('title', 'rank'), name='unique_similar_rank'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.title_id} -> {self.similar_id}'
+
+
+class SimilarTitlesBuild(models.Model):
+    """Модель для отметок о построении похожих тайтлов."""
+    seq = models.BigIntegerField('Последняя запись журнала')
+    titles = models.PositiveIntegerField('Пересчитано тайтлов')
+    created = models.DateTimeField('Время', auto_now_add=True)
+
+    class Meta:
+        ordering = ('-created',)
+        get_latest_by = 'created'
+
+    def __str__(self):
+        return f'{self.created}: {self.titles}'
+
+
+class IdBlock(models.Model):
+    """Модель для общего счётчика id отзывов и комментариев."""
+    name = models.CharField('Счётчик', max_length=50, primary_key=True)
+    next_id = models.BigIntegerField('Следующий id')
+
+    def __str__(self):
+        return f'{self.name}: {self.next_id}'
@@ -0,0 +1,54 @@
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast, NullIf
+
+from reviews import changelog, sharding
+from reviews.models import Review, Title
+
+RATING = Cast('rating_sum', FloatField()) / NullIf(
+    Cast('rating_count', FloatField()), 0.0
+)
+
+
+def add(title_id, score, count):
+    """Меняет сумму и число оценок тайтла на заданные величины."""
+    Title.objects.filter(pk=title_id).update(
+        rating_sum=F('rating_sum') + score,
+        rating_count=F('rating_count') + count,
+    )
+
+
+def recount(title_ids):
+    """Пересчитывает оценки тайтлов по отзывам в их шардах."""
+    title_ids = set(title_ids)
+    titles = []
+    for alias, ids in sharding.group_by_shard(title_ids).items():
+        totals = {
+            title_id: (total, count)
+            for title_id, total, count in Review.objects.using(alias).filter(
+                title_id__in=ids, is_deleted=False
+            ).values('title_id').annotate(
+                total=Sum('score'), count=Count('pk')
+            ).values_list('title_id', 'total', 'count').order_by()
+        }
+        for title_id in ids:
+            total, count = totals.get(title_id, (0, 0))
+            titles.append(
+                Title(pk=title_id, rating_sum=total, rating_count=count)
+            )
+    Title.objects.bulk_update(
+        titles, ('rating_sum', 'rating_count'), batch_size=500
+    )
+    changelog.titles_changed.send(sender=Title, title_ids=title_ids)
+
+
+def scores_of(author_id, title_ids):
+    """Оценки автора по тайтлам: {id тайтла: оценка}.
+
+    Один запрос на шард по индексу unique_review (author, title).
+    """
+    scores = {}
+    for alias, ids in sharding.group_by_shard(set(title_ids)).items():
+        scores.update(Review.objects.using(alias).filter(
+            author_id=author_id, title_id__in=ids, is_deleted=False
+        ).values_list('title_id', 'score').order_by())
+    return scores
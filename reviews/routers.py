@@ -0,0 +1,42 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from reviews import sharding
+
+
+class ShardRouter:
+    """Роутер, который держит отзывы и комментарии в базах-шардах.
+
+    База выбирается по объекту из подсказок, затем по шарду текущего
+    запроса. Остальные модели живут в основной базе.
+    """
+
+    def _shard(self, model, instance):
+        if instance is not None:
+            if sharding.is_sharded(type(instance)):
+                if instance._state.db:
+                    return instance._state.db
+                title_id = getattr(instance, 'title_id', None)
+                if title_id is not None:
+                    return sharding.shard_for_title(title_id)
+                review = instance._state.fields_cache.get('review')
+                if review is not None and review._state.db:
+                    return review._state.db
+            elif instance._meta.model_name == 'title' and instance.pk:
+                return sharding.shard_for_title(instance.pk)
+        return sharding.current() or DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        if sharding.is_sharded(model):
+            return self._shard(model, hints.get('instance'))
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'reviews' and model_name in sharding.SHARDED_MODELS:
+            return db in sharding.SHARDS
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,180 @@
+import bisect
+import contextvars
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+SHARDS = list(getattr(settings, 'REVIEW_SHARDS', [DEFAULT_DB_ALIAS]))
+SHARDED = len(SHARDS) > 1
+VNODES = getattr(settings, 'REVIEW_SHARD_VNODES', 64)
+ID_BLOCK = getattr(settings, 'REVIEW_SHARD_ID_BLOCK', 100)
+SHARDED_MODELS = ('review', 'comment')
+
+_current = contextvars.ContextVar('review_shard', default=None)
+
+
+def _hash(key):
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big'
+    )
+
+
+class HashRing:
+    """Кольцо согласованного хеширования.
+
+    У каждой базы VNODES точек на кольце, поэтому при добавлении базы
+    переезжает примерно 1/N тайтлов, а не почти все.
+    """
+
+    def __init__(self, shards, vnodes=VNODES):
+        points = sorted(
+            (_hash(f'{alias}#{number}'), alias)
+            for alias in shards for number in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._aliases = [alias for _, alias in points]
+
+    def get(self, key):
+        position = bisect.bisect(self._hashes, _hash(str(key)))
+        return self._aliases[position % len(self._aliases)]
+
+
+ring = HashRing(SHARDS)
+
+
+def shard_for_title(title_id):
+    """Возвращает базу, в которой лежат отзывы тайтла."""
+    return ring.get(title_id)
+
+
+def is_sharded(model):
+    return (model._meta.app_label == 'reviews'
+            and model._meta.model_name in SHARDED_MODELS)
+
+
+def current():
+    """База, выбранная для текущего запроса, или None."""
+    return _current.get()
+
+
+@contextmanager
+def use_shard(alias):
+    """Направляет запросы к отзывам и комментариям в базу alias."""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def for_title(title_id):
+    """Направляет запросы к отзывам и комментариям в базу тайтла."""
+    return use_shard(shard_for_title(title_id))
+
+
+def group_by_shard(title_ids):
+    """Раскладывает id тайтлов по базам."""
+    groups = {}
+    for title_id in title_ids:
+        groups.setdefault(shard_for_title(title_id), []).append(title_id)
+    return groups
+
+
+def fan_out(queryset):
+    """Выполняет запрос во всех базах и отдаёт объекты подряд."""
+    for alias in SHARDS:
+        yield from queryset.using(alias)
+
+
+def find(model, **lookup):
+    """Ищет объект во всех базах, возвращает первый найденный или None."""
+    for alias in SHARDS:
+        obj = model._base_manager.using(alias).filter(**lookup).first()
+        if obj is not None:
+            return obj
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """QuerySet, который создаёт объект в шарде по его полям.
+
+    Без явного using() база выбирается роутером по самому объекту,
+    например по тайтлу отзыва или отзыву комментария.
+    """
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
+class IdAllocator:
+    """Выдаёт глобально уникальные id блоками из таблицы IdBlock.
+
+    Автоинкремент у каждой базы свой, поэтому id отзывов и комментариев
+    берутся из общего счётчика в основной базе. Блок привязан к
+    процессу: после fork рабочий процесс берёт собственный блок.
+    """
+
+    def __init__(self, name, size=ID_BLOCK):
+        self.name = name
+        self.size = size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def _take_block(self):
+        IdBlock = apps.get_model('reviews', 'IdBlock')
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            block, _ = IdBlock.objects.using(
+                DEFAULT_DB_ALIAS
+            ).select_for_update().get_or_create(
+                name=self.name, defaults={'next_id': 1}
+            )
+            start = block.next_id
+            block.next_id = start + self.size
+            block.save(update_fields=('next_id',))
+        return start, start + self.size
+
+    def __call__(self):
+        with self._lock:
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._take_block()
+                self._pid = os.getpid()
+            value = self._next
+            self._next += 1
+            return value
+
+    def reserve(self, upto):
+        """Гарантирует, что следующие id будут больше upto."""
+        IdBlock = apps.get_model('reviews', 'IdBlock')
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            block, _ = IdBlock.objects.using(
+                DEFAULT_DB_ALIAS
+            ).select_for_update().get_or_create(
+                name=self.name, defaults={'next_id': upto + 1}
+            )
+            if block.next_id <= upto:
+                block.next_id = upto + 1
+                block.save(update_fields=('next_id',))
+        with self._lock:
+            self._next = self._end = 0
+
+
+review_ids = IdAllocator('review')
+comment_ids = IdAllocator('comment')
+
+
+def next_review_id():
+    return review_ids()
+
+
+def next_comment_id():
+    return comment_ids()
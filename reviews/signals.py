@@ -0,0 +1,103 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from reviews import changelog, counters, deletion, ratings, sharding
+from reviews.models import Change, Comment, Review, Title, User
+
+
+@receiver(pre_delete, sender=Title)
+@receiver(pre_delete, sender=User)
+def delete_dependents(sender, instance, **kwargs):
+    """Удаляет отзывы и комментарии тайтла или пользователя во всех
+    шардах: внешние ключи к ним не удаляют каскадом."""
+    deletion.delete_dependents(instance)
+
+
+@receiver(post_save, sender=Title)
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=Comment)
+def log_save(sender, instance, created, raw=False, **kwargs):
+    """Записывает создание, изменение или скрытие объекта в журнал."""
+    if raw:
+        return
+    if created:
+        action = Change.INSERT
+    elif getattr(instance, 'is_deleted', False):
+        action = Change.DELETE
+    else:
+        action = Change.UPDATE
+    changelog.record(instance, action)
+
+
+@receiver(post_delete, sender=Title)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=Comment)
+def log_delete(sender, instance, **kwargs):
+    """Записывает удаление объекта в журнал."""
+    if getattr(instance, 'is_deleted', False):
+        return
+    changelog.record(instance, Change.DELETE)
+
+
+@receiver(m2m_changed, sender=Title.genre.through)
+def log_genres(sender, instance, action, reverse, **kwargs):
+    """Записывает смену жанров тайтла в журнал."""
+    if reverse or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    changelog.record(instance, Change.UPDATE)
+
+
+def _rated(score, is_deleted):
+    return (0, 0) if is_deleted else (score, 1)
+
+
+@receiver(pre_save, sender=Review)
+def remember_rating(sender, instance, raw=False, update_fields=None,
+                    **kwargs):
+    """Запоминает прежнюю оценку отзыва перед изменением."""
+    instance._rated = (0, 0)
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {'score', 'is_deleted'} & set(
+        update_fields
+    ):
+        instance._rated = None
+        return
+    previous = Review._base_manager.using(instance._state.db).filter(
+        pk=instance.pk
+    ).values_list('score', 'is_deleted').first()
+    instance._rated = _rated(*previous) if previous else (0, 0)
+
+
+@receiver(post_save, sender=Review)
+def update_rating(sender, instance, raw=False, **kwargs):
+    """Переносит изменение оценки в сумму и число оценок тайтла."""
+    previous = getattr(instance, '_rated', None)
+    if raw or previous is None:
+        return
+    score, count = _rated(instance.score, instance.is_deleted)
+    if (score, count) != previous:
+        ratings.add(
+            instance.title_id, score - previous[0], count - previous[1]
+        )
+
+
+@receiver(post_delete, sender=Review)
+def discount_rating(sender, instance, **kwargs):
+    """Убирает оценку удалённого отзыва из рейтинга тайтла."""
+    if not instance.is_deleted:
+        ratings.add(instance.title_id, -instance.score, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    """Увеличивает число комментариев отзыва."""
+    if created and not raw:
+        counters.add_comments(instance.review_id, 1, instance._state.db)
+
+
+@receiver(post_delete, sender=Comment)
+def discount_comment(sender, instance, **kwargs):
+    """Уменьшает число комментариев отзыва."""
+    counters.add_comments(instance.review_id, -1, instance._state.db)
@@ -0,0 +1,183 @@
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+
+from reviews import sharding
+from reviews.models import Review, SimilarTitle, Title
+
+READ_CHUNK = 100000
+
+
+def _read_columns(queryset, fields, dtype=np.int64):
+    """Читает колонки запроса в массивы NumPy порциями."""
+    parts = []
+    rows = queryset.values_list(*fields).order_by()
+    chunk = []
+    for row in rows.iterator(chunk_size=READ_CHUNK):
+        chunk.append(row)
+        if len(chunk) == READ_CHUNK:
+            parts.append(np.array(chunk, dtype=dtype))
+            chunk = []
+    if chunk:
+        parts.append(np.array(chunk, dtype=dtype))
+    if not parts:
+        return np.empty((0, len(fields)), dtype=dtype)
+    return np.concatenate(parts)
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def _codes(values):
+    """Переводит произвольные id в плотные номера столбцов."""
+    unique, codes = np.unique(values, return_inverse=True)
+    return codes, len(unique)
+
+
+class SimilarityModel:
+    """Разреженные матрицы тайтл-жанр и тайтл-рецензент.
+
+    Строки нормированы, поэтому скалярное произведение строк даёт
+    косинусное сходство.
+    """
+
+    def __init__(self, title_ids, genre_links, reviews, popular=20):
+        self.title_ids = title_ids
+        size = len(title_ids)
+        rows, keep = self._rows(genre_links[:, 0])
+        genres, genre_count = _codes(genre_links[keep, 1])
+        self.genres = _normalize_rows(sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, genres)),
+            shape=(size, genre_count),
+        ))
+        rows, keep = self._rows(reviews[:, 0])
+        authors, author_count = _codes(reviews[keep, 1])
+        self.reviewers = _normalize_rows(sparse.csr_matrix(
+            (reviews[keep, 2].astype(np.float32), (rows, authors)),
+            shape=(size, author_count),
+        ))
+        self.reviewers_t = self.reviewers.T.tocsr()
+        self.popularity = np.bincount(rows, minlength=size)
+        self.popular_by_genre = self._popular_by_genre(popular)
+
+    def _rows(self, ids):
+        if not len(self.title_ids):
+            return ids[:0], np.zeros(len(ids), dtype=bool)
+        rows = np.searchsorted(self.title_ids, ids)
+        rows[rows == len(self.title_ids)] = 0
+        keep = self.title_ids[rows] == ids
+        return rows[keep], keep
+
+    def _popular_by_genre(self, count):
+        """Самые обсуждаемые тайтлы каждого жанра, -1 — пусто."""
+        links = self.genres.T.tocsr()
+        result = np.full((links.shape[0], count), -1, dtype=np.int64)
+        for genre in range(links.shape[0]):
+            start, stop = links.indptr[genre], links.indptr[genre + 1]
+            members = links.indices[start:stop]
+            if len(members) > count:
+                weights = -self.popularity[members]
+                members = members[np.argpartition(weights, count)[:count]]
+            result[genre, :len(members)] = members
+        return result
+
+    def neighbours(self, rows, k, genre_weight):
+        """Возвращает пары (строка, сосед, сходство) для блока строк.
+
+        Кандидаты — тайтлы с общими рецензентами и самые популярные
+        тайтлы общих жанров, поэтому память ограничена размером блока.
+        """
+        by_reviewers = (self.reviewers[rows] @ self.reviewers_t).tocoo()
+        block_genres = self.genres[rows].tocoo()
+        popular = self.popular_by_genre[block_genres.col]
+        genre_rows = np.repeat(block_genres.row, popular.shape[1])
+        genre_cols = popular.ravel()
+        filled = genre_cols >= 0
+        pairs_i = np.concatenate((by_reviewers.row, genre_rows[filled]))
+        pairs_j = np.concatenate((by_reviewers.col, genre_cols[filled]))
+        review_score = np.concatenate((
+            by_reviewers.data, np.zeros(filled.sum(), dtype=np.float32)
+        ))
+        order = np.lexsort((-review_score, pairs_j, pairs_i))
+        pairs_i, pairs_j = pairs_i[order], pairs_j[order]
+        review_score = review_score[order]
+        first = np.ones(len(pairs_i), dtype=bool)
+        first[1:] = ((pairs_i[1:] != pairs_i[:-1])
+                     | (pairs_j[1:] != pairs_j[:-1]))
+        first &= rows[pairs_i] != pairs_j
+        pairs_i, pairs_j = pairs_i[first], pairs_j[first]
+        review_score = review_score[first]
+        genre_score = np.asarray(
+            self.genres[rows[pairs_i]].multiply(self.genres[pairs_j]).sum(1)
+        ).ravel()
+        score = (1 - genre_weight) * review_score + genre_weight * genre_score
+        order = np.lexsort((-score, pairs_i))
+        pairs_i, pairs_j, score = pairs_i[order], pairs_j[order], score[order]
+        starts = np.flatnonzero(np.r_[True, pairs_i[1:] != pairs_i[:-1]])
+        ranks = np.arange(len(pairs_i)) - np.repeat(
+            starts, np.diff(np.r_[starts, len(pairs_i)])
+        )
+        top = ranks < k
+        return pairs_i[top], pairs_j[top], score[top], ranks[top]
+
+
+def load_model(popular=20):
+    """Строит матрицы сходства по данным из базы."""
+    title_ids = _read_columns(
+        Title.objects.filter(is_deleted=False).order_by('pk'), ('pk',)
+    ).ravel()
+    genre_links = _read_columns(
+        Title.genre.through.objects.all(), ('title_id', 'genre_id')
+    )
+    reviews = np.concatenate([
+        _read_columns(
+            Review.objects.using(alias).filter(is_deleted=False),
+            ('title_id', 'author_id', 'score'),
+        )
+        for alias in sharding.SHARDS
+    ])
+    return SimilarityModel(title_ids, genre_links, reviews, popular)
+
+
+def save_block(model, rows, pairs_i, pairs_j, score, ranks):
+    """Заменяет соседей тайтлов блока в таблице."""
+    title_ids = model.title_ids
+    with transaction.atomic():
+        SimilarTitle.objects.filter(title_id__in=title_ids[rows]).delete()
+        SimilarTitle.objects.bulk_create(
+            (SimilarTitle(title_id=int(title_ids[rows[i]]),
+                          similar_id=int(title_ids[j]),
+                          score=float(value),
+                          rank=int(rank))
+             for i, j, value, rank in zip(pairs_i, pairs_j, score, ranks)),
+            batch_size=5000,
+        )
+
+
+def build(model, rows, k=10, genre_weight=0.3, block=1024, save=save_block):
+    """Пересчитывает соседей для строк rows блоками по block строк."""
+    for start in range(0, len(rows), block):
+        chunk = rows[start:start + block]
+        save(model, chunk, *model.neighbours(chunk, k, genre_weight))
+
+
+def synthetic_model(titles, reviews, genres=30, seed=0):
+    """Генерирует случайные данные для замера времени построения."""
+    rng = np.random.default_rng(seed)
+    title_ids = np.arange(1, titles + 1, dtype=np.int64)
+    per_title = rng.integers(1, 4, size=titles)
+    genre_links = np.column_stack((
+        np.repeat(title_ids, per_title),
+        rng.integers(1, genres + 1, size=per_title.sum()),
+    ))
+    authors = max(reviews // 50, 1)
+    review_rows = np.column_stack((
+        title_ids[np.minimum(rng.zipf(1.3, size=reviews), titles) - 1],
+        rng.integers(1, authors + 1, size=reviews),
+        rng.integers(1, 11, size=reviews),
+    ))
+    return SimilarityModel(title_ids, genre_links, review_rows)
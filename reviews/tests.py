@@ -0,0 +1,514 @@
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from reviews import deletion, facts, importer, ratings, sharding
+from reviews.routers import ShardRouter
+from reviews.models import (Category, ChangeCompaction, Comment, DeletionJob,
+                            Genre, Review, SimilarTitlesBuild, Title, User)
+
+
+class DirectDeleteTests(TestCase):
+    """Удаление тайтла или пользователя мимо reviews.deletion."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        category = Category.objects.create(name='Фильм', slug='movie')
+        self.title = Title.objects.create(
+            name='Сталкер', year=1979, category=category
+        )
+        self.other = Title.objects.create(
+            name='Солярис', year=1972, category=category
+        )
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.reader = User.objects.create(
+            username='reader', email='reader@example.com'
+        )
+        review = Review.objects.create(
+            title=self.title, author=self.author, text='Текст', score=9
+        )
+        Review.objects.create(
+            title=self.other, author=self.author, text='Текст', score=3
+        )
+        Review.objects.create(
+            title=self.other, author=self.reader, text='Текст', score=7
+        )
+        Comment.objects.create(
+            review=review, author=self.reader, text='Комментарий'
+        )
+
+    def assert_author_removed(self):
+        self.assertFalse(Review.objects.filter(author=self.author).exists())
+        self.assertFalse(Comment.objects.exists())
+        self.other.refresh_from_db()
+        self.assertEqual((self.other.rating_sum, self.other.rating_count),
+                         (7, 1))
+
+    def test_title_delete_cascades(self):
+        pk = self.title.pk
+        self.title.delete()
+        self.assertFalse(Review.objects.filter(title_id=pk).exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_user_delete_cascades_and_updates_ratings(self):
+        self.author.delete()
+        self.assert_author_removed()
+
+    def test_queryset_delete_goes_through_deletion(self):
+        # Каскада по внешним ключам нет: зависимые записи удаляет
+        # обработчик pre_delete до удаления самого пользователя.
+        User.objects.filter(pk=self.author.pk).delete()
+        self.assert_author_removed()
+
+    def test_own_comments_on_own_reviews_are_counted_once(self):
+        review = sharding.find(Review, title=self.title)
+        Comment.objects.create(review=review, author=self.author,
+                               text='Ответ')
+        Comment.objects.create(
+            review=sharding.find(Review, author=self.reader),
+            author=self.author, text='Комментарий',
+        )
+        # Два отзыва автора и три комментария: ответ на свой отзыв,
+        # комментарий к чужому и чужой комментарий к его отзыву.
+        self.assertEqual(deletion.count_dependents(self.author), 5)
+        deletion.delete(self.author)
+        self.assert_author_removed()
+
+    def test_delete_dependents_removes_reviews_and_comments(self):
+        deletion.delete_dependents(self.author)
+        self.assert_author_removed()
+        self.assertTrue(User.objects.filter(pk=self.author.pk).exists())
+
+
+class DeletionJobTests(TestCase):
+    """Задачи удаления и синхронное удаление небольших объектов."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.title = Title.objects.create(name='Сталкер', year=1979)
+        author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        review = Review.objects.create(
+            title=self.title, author=author, text='Текст', score=9
+        )
+        Comment.objects.create(review=review, author=author, text='Текст')
+        self.job = DeletionJob.objects.create(
+            model='title', object_id=self.title.pk
+        )
+
+    def test_any_error_marks_job_failed(self):
+        with mock.patch.object(deletion, '_purge',
+                               side_effect=RuntimeError('сбой')), \
+                mock.patch.object(deletion, 'close_old_connections'):
+            deletion._run_in_thread(self.job.pk)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, DeletionJob.FAILED)
+        self.assertEqual(self.job.error, 'сбой')
+
+    def test_running_job_is_not_taken_twice(self):
+        self.assertTrue(deletion.claim(self.job))
+        other = DeletionJob.objects.get(pk=self.job.pk)
+        with mock.patch.object(deletion, '_purge') as purge:
+            self.assertIsNone(deletion.run(other))
+        purge.assert_not_called()
+
+    def test_stale_running_job_is_taken_over(self):
+        DeletionJob.objects.filter(pk=self.job.pk).update(
+            status=DeletionJob.RUNNING,
+            updated=timezone.now() - timedelta(
+                seconds=deletion.STALE_SECONDS + 1
+            ),
+        )
+        deletion.run(DeletionJob.objects.get(pk=self.job.pk))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, DeletionJob.DONE)
+        self.assertFalse(Title.objects.filter(pk=self.title.pk).exists())
+
+    def test_sync_delete_is_atomic(self):
+        with mock.patch.object(ratings, 'recount',
+                               side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                deletion.delete(self.title)
+        self.assertIsNotNone(sharding.find(Comment, review__title=self.title))
+        self.assertIsNotNone(sharding.find(Review, title=self.title))
+        self.assertTrue(Title.objects.filter(pk=self.title.pk).exists())
+
+
+class AdminQueryTests(TestCase):
+    """Число запросов и время страниц админки на сгенерированных данных.
+
+    Строк больше, чем list_per_page, поэтому лишний запрос на строку
+    сразу виден в числе запросов.
+    """
+
+    databases = '__all__'
+
+    ROWS = 120
+    TIME_BUDGET = 1.0
+
+    @classmethod
+    def setUpTestData(cls):
+        # Таблица блоков id откатывается после каждого теста, а блок
+        # в памяти процесса остаётся: без сброса новый блок пересечётся
+        # с уже выданными id.
+        for allocator in (sharding.review_ids, sharding.comment_ids):
+            allocator.reserve(0)
+        cls.admin = User.objects.create(
+            username='admin', email='admin@example.com',
+            is_staff=True, is_superuser=True,
+        )
+        User.objects.bulk_create(
+            User(username=f'user{number}', email=f'user{number}@example.com')
+            for number in range(cls.ROWS)
+        )
+        users = list(User.objects.filter(username__startswith='user'))
+        Category.objects.bulk_create(
+            Category(name=f'Категория {number}', slug=f'category{number}')
+            for number in range(cls.ROWS)
+        )
+        categories = list(Category.objects.all())
+        Genre.objects.bulk_create(
+            Genre(name=f'Жанр {number}', slug=f'genre{number}')
+            for number in range(cls.ROWS)
+        )
+        Title.objects.bulk_create(
+            Title(name=f'Тайтл {number}', year=1900 + number % 100,
+                  category=categories[number % len(categories)])
+            for number in range(cls.ROWS)
+        )
+        titles = list(Title.objects.all())
+        Review.objects.bulk_create(
+            Review(title=title, author=users[number], text='Текст',
+                   score=number % 10 + 1)
+            for number, title in enumerate(titles)
+        )
+        reviews = list(Review.objects.all())
+        Comment.objects.bulk_create(
+            Comment(review=reviews[number % len(reviews)],
+                    author=users[number], text='Комментарий')
+            for number in range(cls.ROWS)
+        )
+        cls.objects = {
+            'user': users[0], 'category': categories[0],
+            'genre': Genre.objects.first(), 'title': titles[0],
+            'review': reviews[0], 'comment': Comment.objects.first(),
+        }
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_page(self, url, queries):
+        started = time.perf_counter()
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLess(time.perf_counter() - started, self.TIME_BUDGET, url)
+
+    def test_changelists(self):
+        for model, queries in (('user', 4), ('category', 5), ('genre', 5),
+                               ('title', 6), ('review', 6), ('comment', 5)):
+            with self.subTest(model=model):
+                self.assert_page(f'/admin/reviews/{model}/', queries)
+
+    def test_search(self):
+        for url, queries in (
+            ('/admin/reviews/user/?q=user1', 4),
+            ('/admin/reviews/title/?q=Тайтл&year=1901', 6),
+            ('/admin/reviews/review/?q=user1', 8),
+        ):
+            with self.subTest(url=url):
+                self.assert_page(url, queries)
+
+    def test_change_forms(self):
+        for model, queries in (('user', 10), ('category', 6), ('genre', 6),
+                               ('title', 8), ('review', 13), ('comment', 11)):
+            with self.subTest(model=model):
+                self.assert_page(
+                    f'/admin/reviews/{model}/{self.objects[model].pk}/change/',
+                    queries,
+                )
+
+
+class FactsExportTests(TestCase):
+    """Выгрузка фактов об отзывах по журналу изменений."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(facts, 'FACTS_DIR', Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.title = Title.objects.create(name='Сталкер', year=1979)
+        self.authors = [
+            User.objects.create(username=f'user{number}',
+                                email=f'user{number}@example.com')
+            for number in range(3)
+        ]
+        self.reviews = [
+            Review.objects.create(title=self.title, author=author,
+                                  text='Текст', score=number + 1)
+            for number, author in enumerate(self.authors)
+        ]
+        facts.export()
+
+    def exported(self):
+        snapshot = facts.Snapshot()
+        return dict(zip(snapshot['review_id'].tolist(),
+                        zip(snapshot['score'].tolist(),
+                            snapshot['year'].tolist())))
+
+    def test_edits_and_deletes_are_exported(self):
+        edited, deleted, _ = self.reviews
+        edited.score = 10
+        edited.save()
+        deleted.delete()
+        other = Title.objects.create(name='Солярис', year=1972)
+        added = Review.objects.create(title=other, author=self.authors[0],
+                                      text='Текст', score=7)
+        self.title.year = 1980
+        self.title.save()
+        facts.export()
+        self.assertEqual(self.exported(), {
+            edited.pk: (10, 1980),
+            self.reviews[2].pk: (3, 1980),
+            added.pk: (7, 1972),
+        })
+        self.assertEqual(facts.read_meta()['count'], 3)
+
+    def test_new_reviews_are_appended(self):
+        other = Title.objects.create(name='Солярис', year=1972)
+        added = Review.objects.create(title=other, author=self.authors[0],
+                                      text='Текст', score=7)
+        with mock.patch.object(facts, '_rewrite_columns') as rewrite:
+            self.assertEqual(facts.export(), 1)
+        rewrite.assert_not_called()
+        self.assertEqual(self.exported()[added.pk], (7, 1972))
+
+    def test_cursor_past_horizon_exports_everything(self):
+        ChangeCompaction.objects.create(
+            seq=facts.read_meta()['seq'] + 1, removed=1
+        )
+        self.assertEqual(facts.export(), 3)
+        self.assertEqual(len(self.exported()), 3)
+
+
+class IncrementalImportTests(TestCase):
+    """Загрузка изменений по отпечаткам прошлой загрузки."""
+
+    databases = '__all__'
+
+    DATA = Path(__file__).resolve().parent.parent / 'static' / 'data'
+
+    def setUp(self):
+        for allocator in (sharding.review_ids, sharding.comment_ids):
+            allocator.reserve(0)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_dir = directory.name
+        importer.sync(self.DATA, self.state_dir)
+
+    def test_rows_missing_from_database_are_loaded_again(self):
+        reviews = self.count(Review)
+        self.assertTrue(reviews)
+        for alias in sharding.SHARDS:
+            Comment.objects.using(alias).all().delete()
+            Review.objects.using(alias).all().delete()
+        report = importer.sync(self.DATA, self.state_dir)
+        self.assertEqual(report['review']['insert'], reviews)
+        self.assertEqual(report['review']['unchanged'], 0)
+        self.assertEqual(report['titles']['unchanged'], Title.objects.count())
+        self.assertEqual(self.count(Review), reviews)
+        self.assertTrue(self.count(Comment))
+
+    @staticmethod
+    def count(model):
+        return sum(model.objects.using(alias).count()
+                   for alias in sharding.SHARDS)
+
+
+class RatingAggregateTests(TestCase):
+    """Сумма и число оценок, хранящиеся в тайтле."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.title = Title.objects.create(name='Сталкер', year=1979)
+        self.reviews = [
+            Review.objects.create(
+                title=self.title, text='Текст', score=score,
+                author=User.objects.create(username=f'user{score}',
+                                           email=f'user{score}@example.com'),
+            )
+            for score in (4, 8)
+        ]
+
+    def assert_rating(self, total, count):
+        self.title.refresh_from_db()
+        self.assertEqual((self.title.rating_sum, self.title.rating_count),
+                         (total, count))
+
+    def test_writes_keep_aggregates_current(self):
+        self.assert_rating(12, 2)
+        first, second = self.reviews
+        first.score = 10
+        first.save()
+        self.assert_rating(18, 2)
+        second.is_deleted = True
+        second.save(update_fields=('is_deleted',))
+        self.assert_rating(10, 1)
+        first.delete()
+        self.assert_rating(0, 0)
+
+    def test_recount_matches_reviews(self):
+        Title.objects.filter(pk=self.title.pk).update(rating_sum=0,
+                                                      rating_count=0)
+        ratings.recount([self.title.pk])
+        self.assert_rating(12, 2)
+        rating = Title.objects.annotate(
+            rating=ratings.RATING
+        ).get(pk=self.title.pk).rating
+        self.assertEqual(rating, 6)
+
+
+class SimilarTitlesTests(APITestCase):
+    """Предрасчитанные похожие тайтлы."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        drama = Genre.objects.create(name='Драма', slug='drama')
+        comedy = Genre.objects.create(name='Комедия', slug='comedy')
+        self.titles = {}
+        for name, genre in (('Сталкер', drama), ('Солярис', drama),
+                            ('Зеркало', drama), ('Кин-дза-дза', comedy)):
+            title = Title.objects.create(name=name, year=1979)
+            title.genre.add(genre)
+            self.titles[name] = title
+        self.users = [User.objects.create(username=f'user{number}',
+                                          email=f'user{number}@example.com')
+                      for number in range(3)]
+        for user in self.users[:2]:
+            self.review(user, 'Сталкер')
+            self.review(user, 'Солярис')
+        self.review(self.users[2], 'Зеркало')
+
+    def review(self, user, name, score=8):
+        Review.objects.create(title=self.titles[name], author=user,
+                              text='Текст', score=score)
+
+    def similar(self, name):
+        response = self.client.get(
+            f'/api/v1/titles/{self.titles[name].pk}/similar/'
+        )
+        return [item['name'] for item in response.data]
+
+    def build(self, *args):
+        call_command('build_similar_titles', *args, stdout=StringIO())
+
+    def test_neighbours_ranked_by_reviewers_and_genres(self):
+        self.build()
+        self.assertEqual(self.similar('Сталкер'), ['Солярис', 'Зеркало'])
+        self.assertEqual(self.similar('Кин-дза-дза'), [])
+        Title.objects.filter(pk=self.titles['Солярис'].pk).update(
+            is_deleted=True
+        )
+        self.assertEqual(self.similar('Сталкер'), ['Зеркало'])
+
+    def test_changed_rebuilds_only_titles_with_new_reviews(self):
+        self.build()
+        self.review(self.users[0], 'Кин-дза-дза')
+        self.build('--changed')
+        self.assertEqual(SimilarTitlesBuild.objects.latest('pk').titles, 1)
+        self.assertEqual(self.similar('Кин-дза-дза'),
+                         ['Сталкер', 'Солярис'])
+
+
+@skipUnless(sharding.SHARDED, 'нужно несколько шардов: REVIEW_SHARD_COUNT=2')
+class ShardingTests(APITestCase):
+    """Отзывы и комментарии в нескольких базах-шардах."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.titles = {}
+        number = 0
+        while len(self.titles) < len(sharding.SHARDS):
+            title = Title.objects.create(name=f'Тайтл {number}', year=2000)
+            self.titles.setdefault(sharding.shard_for_title(title.pk), title)
+            number += 1
+
+    def review(self, title, score=5, **kwargs):
+        return Review.objects.create(title=title, author=self.author,
+                                     text='Текст', score=score, **kwargs)
+
+    def test_reviews_and_comments_follow_title_shard(self):
+        for alias, title in self.titles.items():
+            review = self.review(title)
+            comment = Comment.objects.create(review=review,
+                                             author=self.author, text='Текст')
+            self.assertEqual(review._state.db, alias)
+            self.assertEqual(comment._state.db, alias)
+            for other in set(sharding.SHARDS) - {alias}:
+                self.assertFalse(
+                    Review.objects.using(other).filter(pk=review.pk).exists()
+                )
+
+    def test_router_keeps_other_models_in_default(self):
+        router = ShardRouter()
+        shard = next(alias for alias in sharding.SHARDS
+                     if alias != 'default')
+        self.assertEqual(router.db_for_write(Title), 'default')
+        with sharding.use_shard(shard):
+            self.assertEqual(router.db_for_read(Review), shard)
+            self.assertEqual(router.db_for_read(User), 'default')
+        self.assertTrue(router.allow_migrate(shard, 'reviews', 'review'))
+        self.assertFalse(router.allow_migrate(shard, 'reviews', 'title'))
+
+    def test_fan_out_and_ratings_cover_every_shard(self):
+        for score, title in enumerate(self.titles.values(), start=1):
+            self.review(title, score)
+        reviews = list(sharding.fan_out(Review.objects.all()))
+        self.assertEqual(len(reviews), len(self.titles))
+        for score, title in enumerate(self.titles.values(), start=1):
+            response = self.client.get(f'/api/v1/titles/{title.pk}/')
+            self.assertEqual(response.data['rating'], score)
+            response = self.client.get(f'/api/v1/titles/{title.pk}/reviews/')
+            self.assertEqual([review['score']
+                              for review in response.data['results']],
+                             [score])
+
+    def test_rebalance_moves_misplaced_reviews(self):
+        alias, title = next(iter(self.titles.items()))
+        wrong = next(other for other in sharding.SHARDS if other != alias)
+        review = Review.objects.using(wrong).create(
+            title=title, author=self.author, text='Текст', score=5
+        )
+        Comment.objects.using(wrong).create(review=review, author=self.author,
+                                            text='Текст')
+        call_command('rebalance_shards', stdout=StringIO())
+        self.assertFalse(Review.objects.using(wrong).exists())
+        self.assertFalse(Comment.objects.using(wrong).exists())
+        self.assertTrue(
+            Review.objects.using(alias).filter(pk=review.pk).exists()
+        )
+        self.assertEqual(
+            Comment.objects.using(alias).filter(review=review).count(), 1
+        )